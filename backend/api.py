@@ -2,48 +2,167 @@
 # api.py — REST API для клиентского UI
 # Запуск:  uvicorn api:app --host 0.0.0.0 --port 8000 --reload
 # Зависимости:
-#   pip install fastapi uvicorn[standard] psycopg2-binary pandas numpy python-docx requests
+#   pip install fastapi uvicorn[standard] "psycopg[binary]" psycopg2-binary pandas numpy python-docx requests httpx
+#   (необязательно, быстрее JSON и сжатие brotli: pip install orjson brotli)
+#
+# Все эндпоинты асинхронные: БД — через async-пул psycopg 3, LLM — через httpx.AsyncClient,
+# поэтому долгие ответы модели не занимают потоки и не тормозят дашборд.
+# CPU-работа (сборка DOCX) уходит в threadpool.
+# TTR_OFFLINE_BUNDLE=<файл> — автономный режим без PostgreSQL: данные из выгрузки
+# (python -m ttr_core.offline export <файл>, см. ttr_core/offline.py).
+# GET /metrics — время запросов и этапов (Prometheus), у каждого запроса X-Request-ID (ttr_core/metrics.py).
+# python-docx и HTTP-клиенты LLM импортируются при первом использовании — старт процесса
+# за них не платит (отчёт по времени импорта: python -m ttr_core.startup).
+
+import time
+_IMPORT_STARTED = time.perf_counter()  # для /api/health/startup
 
 import os
-import io
-from typing import Optional, Dict, Any
+import sys
+import re
+import json
+import asyncio
+import hashlib
+from collections import deque
+from contextlib import aclosing
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Dict, Any, List
 
-import numpy as np
-import pandas as pd
-import psycopg2
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, Response, FileResponse
+from starlette.background import BackgroundTask
 
 # ------- общий модуль логики (такой же, как в app.py) -------
 from ttr_core.logic import (
-    compute_recommendation,               # алгоритм мер (I/II)
     SYSTEM_PROMPT,                        # промт для чата (строгий стиль)
     sanitize_ai, clamp_measures_in_text,  # фильтры и защита от "лишнего"
-    chat_completion, make_grounding_message,
-    build_brief_docx,                     # DOCX «Справка по товару …»
-    build_mosprom_docx                    # DOCX «Обращение в АНО “Моспром”»
+    chat_completion_async,                # запрос к OpenAI-совместимому серверу
+    chat_completion_stream_async,         # то же, потоком (SSE)
+    StreamSanitizer,                      # фильтры для потокового ответа
+    CHAT_MODEL, PROMPT_VERSION, LLM_DETERMINISTIC,
+    close_async_http,
 )
+from ttr_core.db import async_pool, PoolTimeout, DB_SCHEMA, DB_CONNINFO
+from ttr_core.events import DataListener, DataChange
+from ttr_core.bundle import GoodBundle, load_good_bundle_async, load_goods_index_async, load_bulk_async
+from ttr_core import store, analytics, scenarios, backtest, export
+from ttr_core.cache import make_cache, SingleFlight, CACHE_BACKEND
+from ttr_core.doccache import doc_cache, doc_filename, render_doc, DOC_KINDS, DOCX_TEMPLATE_VERSION
+from ttr_core.jobs import doc_jobs, DOC_JOB_MAX_GOODS
+from ttr_core.serialize import dumps, frame_records, frame_columns, compress
+from ttr_core.search import GoodsIndex
+from ttr_core.startup import LAZY_MODULES, STARTUP_BUDGET_S
+from ttr_core.admission import AdmissionController, Overloaded
+from ttr_core.snapshot import Snapshot, SnapshotStore, SNAPSHOT_ENABLED, SNAPSHOT_TOP_MAX
+from ttr_core.offline import OFFLINE_BUNDLE, load_bundle
+from ttr_core import metrics
+from ttr_core.metrics import RequestMetrics, span, timed, log
 
 # =============================
-# Настройки БД (совпадают с app.py)
+# БД: общий async-пул соединений (настройки — PG*/PGPOOL_* в ttr_core/db.py)
 # =============================
-DB_HOST = os.environ.get("PGHOST", "localhost")
-DB_PORT = int(os.environ.get("PGPORT", "5433"))
-DB_NAME = os.environ.get("PGDATABASE", "Hackaton")
-DB_USER = os.environ.get("PGUSER", "postgres")
-DB_PASS = os.environ.get("PGPASSWORD", "123")
-DB_SCHEMA = "ttr"
-
 def get_conn():
-    return psycopg2.connect(
-        host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASS
-    )
+    """Соединение из пула (внутри request_scope — соединение текущего запроса)."""
+    return async_pool.connection()
+
+# Портфельные запросы: максимум товаров за запрос и размер пачки при выдаче
+BULK_MAX_GOODS = int(os.environ.get("BULK_MAX_GOODS", "5000"))
+BULK_CHUNK = int(os.environ.get("BULK_CHUNK", "200"))
+
+# Выгрузки import_values (ttr_core/export.py): одновременно не больше EXPORT_MAX_CONCURRENT
+# на воркер — каждая держит своё соединение с БД; сверх — 503 с Retry-After
+export_slots = export.ExportSlots(export.EXPORT_MAX_CONCURRENT)
+
+# Ревизия кода ответов: входит в ETag, чтобы после изменения алгоритма/шаблонов DOCX
+# браузеры не получали 304 на старые версии (по умолчанию — версия API + версия шаблона DOCX)
+ETAG_REV = os.environ.get("ETAG_REV", f"2.0.0-{DOCX_TEMPLATE_VERSION}")
+
+# Метрики потокового чата: время до первого токена модели (TTFT) и до первого
+# отправленного клиенту куска (после фильтров), последние CHAT_STATS_WINDOW значений
+CHAT_STATS_WINDOW = int(os.environ.get("CHAT_STATS_WINDOW", "500"))
+CHAT_STATS = {
+    "streams": 0,
+    "errors": 0,
+    "stopped_early": 0,
+    "ttft_s": deque(maxlen=CHAT_STATS_WINDOW),
+    "first_chunk_s": deque(maxlen=CHAT_STATS_WINDOW),
+    "total_s": deque(maxlen=CHAT_STATS_WINDOW),
+}
+
+# Кэш ответов чата (только в детерминированном режиме LLM): LRU + TTL;
+# при CACHE_BACKEND=sqlite|redis — ещё и общий уровень для всех воркеров (ttr_core/cache.py)
+CHAT_CACHE_SIZE = int(os.environ.get("CHAT_CACHE_SIZE", "2000"))
+CHAT_CACHE_TTL = float(os.environ.get("CHAT_CACHE_TTL", "86400"))
+chat_cache = make_cache("chat", CHAT_CACHE_SIZE, ttl=CHAT_CACHE_TTL, codec="json")
+chat_flight = SingleFlight()
+docx_flight = SingleFlight()
+
+# Допуск к LLM: не больше LLM_MAX_CONCURRENCY генераций одновременно на воркер, остальные —
+# в очереди до LLM_MAX_QUEUE (по кругу между клиентами); сверх — сразу 429/503 с Retry-After
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "32"))
+LLM_MAX_PER_CLIENT = int(os.environ.get("LLM_MAX_PER_CLIENT", "4"))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "30"))
+llm_admission = AdmissionController(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_MAX_PER_CLIENT, LLM_QUEUE_TIMEOUT)
+
+# Кэш готовых JSON-ответов /dashboard по (вид, товар, версия данных, ревизия кода):
+# новая загрузка данных даёт новую версию — устаревшие записи просто не запрашиваются
+DASHBOARD_CACHE_SIZE = int(os.environ.get("DASHBOARD_CACHE_SIZE", "2000"))
+DASHBOARD_CACHE_MB = float(os.environ.get("DASHBOARD_CACHE_MB", "64"))
+dashboard_cache = make_cache("dashboard", DASHBOARD_CACHE_SIZE, max_bytes=int(DASHBOARD_CACHE_MB * 1024 * 1024),
+                             sizeof=len, codec="bytes")
+dashboard_flight = SingleFlight()
+
+# Поиск товаров: индекс в памяти (ttr_core/search.py). Сигнатура справочника сверяется
+# с БД по уведомлению о загрузке, а без подписки — не чаще раза в SEARCH_REFRESH_S
+SEARCH_REFRESH_S = float(os.environ.get("SEARCH_REFRESH_S", "60"))
+SEARCH = {"index": None, "signature": None, "checked_at": 0.0, "dirty": False}
+_search_lock = asyncio.Lock()
+
+def on_data_change(change: DataChange):
+    """
+    Уведомление parser.py (ttr_core/events.py): ответы в кэшах ключуются версией данных,
+    поэтому устаревшими они не отдаются — из памяти убираем прежние версии изменившихся
+    товаров, а индекс поиска сверяем с БД при первом же поиске.
+    """
+    if snapshots is not None:
+        snapshots.request_refresh()
+    if change.resync or change.catalog:
+        SEARCH["dirty"] = True
+    if change.goods:
+        dropped = dashboard_cache.delete_stale(change.goods)
+        # DOCX — ещё и файлы на диске: не в event loop
+        asyncio.get_running_loop().run_in_executor(None, doc_cache.delete_stale, change.goods)
+        print(f"[api] загрузка данных: {len(change.goods)} товаров, из кэша дашбордов убрано: {dropped}")
+
+data_events = DataListener(DB_CONNINFO, on_data_change)
+
+# Снимок схемы ttr в памяти (ttr_core/snapshot.py): чтения по товарам обслуживаются
+# без запросов к БД; обновляется по уведомлению о загрузке (без подписки — опросом).
+# Товар, которого ещё нет в снимке, читается из БД. Отключение: API_SNAPSHOT=0.
+# В автономном режиме (TTR_OFFLINE_BUNDLE) снимок загружается из файла один раз и БД не нужна
+snapshots = SnapshotStore(get_conn, lambda: data_events.connected) if SNAPSHOT_ENABLED or OFFLINE_BUNDLE else None
+
+def current_snapshot() -> Optional[Snapshot]:
+    return snapshots.current if snapshots is not None else None
+
+doc_jobs.snapshot = current_snapshot
+
+# Время старта: импорт модуля и готовность к приёму запросов (после startup-хуков)
+STARTUP = {"import_s": None, "ready_s": None}
 
 # =============================
 # FastAPI + CORS
 # =============================
-app = FastAPI(title="TTR API", version="2.0.0")
+class FastJSONResponse(JSONResponse):
+    """JSON через ttr_core.serialize.dumps (orjson, если установлен)."""
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+app = FastAPI(title="TTR API", version="2.0.0", default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -51,178 +170,969 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[metrics.REQUEST_ID_HEADER],
 )
+# Снаружи CORS: id запроса и время каждого запроса/этапа (ttr_core/metrics.py, GET /metrics)
+app.add_middleware(RequestMetrics)
+
+@app.exception_handler(PoolTimeout)
+def _pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse({"detail": f"БД перегружена: {exc}"}, status_code=503, headers={"Retry-After": "1"})
+
+@app.exception_handler(Overloaded)
+def _overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse({"detail": exc.detail, "retry_after": exc.retry_after},
+                        status_code=exc.status_code, headers={"Retry-After": str(exc.retry_after)})
+
+@app.on_event("startup")
+async def _ensure_store_schema():
+    if OFFLINE_BUNDLE:
+        # автономный режим: без файла подниматься незачем — ошибка старта
+        snap = snapshots.current = await run_in_threadpool(load_bundle, OFFLINE_BUNDLE)
+        print(f"[api] автономный режим: {OFFLINE_BUNDLE}, {len(snap)} товаров, "
+              f"чтение {snap.load_s:.2f} c, сборка {snap.build_s:.2f} c")
+    else:
+        await _connect_db()
+    try:
+        await goods_search_index()
+    except Exception as e:
+        print(f"[api] индекс поиска не построен (построится при первом поиске): {e}")
+    STARTUP["ready_s"] = time.perf_counter() - _IMPORT_STARTED
+    print(f"[api] старт: импорт {STARTUP['import_s']:.3f} c, готов через {STARTUP['ready_s']:.3f} c")
+
+async def _connect_db():
+    # таблицы версий/рекомендаций (их же создаёт parser.py); без БД API всё равно поднимется
+    try:
+        await async_pool.open()
+        async with get_conn() as conn:
+            await store.ensure_schema_async(conn)
+            await analytics.ensure_schema_async(conn)
+            await backtest.ensure_schema_async(conn)
+            await conn.commit()
+    except Exception as e:
+        print(f"[api] не удалось проверить схему {DB_SCHEMA}: {e}")
+    data_events.start()
+    if snapshots is not None:
+        try:
+            await snapshots.refresh(force=True)
+        except Exception as e:
+            print(f"[api] снимок данных не загружен (чтения пойдут в БД до обновления): {e}")
+        snapshots.start()
+
+@app.on_event("shutdown")
+async def _close_pool():
+    doc_jobs.shutdown()
+    await data_events.stop()
+    if snapshots is not None:
+        await snapshots.stop()
+    await async_pool.close()
+    await close_async_http()
 
 # =============================
 # Внутренние helper’ы работы с БД
 # =============================
-def fetch_good(good_id: int) -> Dict[str, Any]:
-    with get_conn() as conn:
-        df = pd.read_sql(f"SELECT id, hs_code, name FROM {DB_SCHEMA}.goods WHERE id=%s", conn, params=[good_id])
-    if df.empty:
+@timed("fetch_bundle")
+async def fetch_bundle(good_id: int) -> GoodBundle:
+    """Товар, тарифы, ряды P/C, импорт и флаги — из снимка или одним запросом к БД."""
+    snap = current_snapshot()
+    bundle = snap.bundle(good_id) if snap is not None else None
+    if bundle is not None:
+        return bundle
+    if OFFLINE_BUNDLE:
+        raise HTTPException(404, "Товар не найден")
+    async with get_conn() as conn:
+        bundle = await load_good_bundle_async(conn, good_id)
+    if bundle is None:
+        raise HTTPException(404, "Товар не найден")
+    return bundle
+
+@timed("fetch_recommendation")
+async def fetch_recommendation(good_id: int):
+    """
+    Снимок данных по товару + результат алгоритма мер.
+    Рекомендация берётся из ttr.recommendations; если для текущей версии данных
+    её ещё нет — считается и сохраняется (дальше это чистый lookup).
+    В снимке рекомендации есть у всех товаров (недостающие досчитаны при сборке).
+    """
+    snap = current_snapshot()
+    if snap is not None and (OFFLINE_BUNDLE or snap.covers([good_id])):
+        bundle = await fetch_bundle(good_id)
+        rec = bundle.recommendation
+        return bundle, rec.measures, rec.summary
+    async with async_pool.request_scope() as conn:
+        bundle = await fetch_bundle(good_id)
+        rec = bundle.recommendation
+        if rec is None:
+            rec = store.compute_for_bundle(bundle)
+            bundle.recommendation = rec
+            try:
+                await store.save_recommendation_async(conn, good_id, bundle.data_version, rec)
+                await conn.commit()
+            except Exception as e:
+                await conn.rollback()
+                log(f"[api] рекомендация для good_id={good_id} не сохранена: {e}")
+    return bundle, rec.measures, rec.summary
+
+# =============================
+# HTTP-кэширование (ETag / Last-Modified по версии данных товара)
+# =============================
+GOODS_SIGNATURE_SQL = f"""
+SELECT count(*), COALESCE(sum(hashtext(COALESCE(hs_code, '') || '|' || COALESCE(name, ''))::bigint), 0)
+FROM {DB_SCHEMA}.goods
+"""
+
+async def _set_search_index(rows, signature: tuple):
+    index = await run_in_threadpool(GoodsIndex, rows)
+    SEARCH["index"], SEARCH["signature"] = index, signature
+    print(f"[api] индекс поиска: {len(index)} товаров, {index.build_s * 1000:.0f} мс")
+
+async def goods_search_index() -> GoodsIndex:
+    """
+    Текущий индекс поиска. Перестраивается (в threadpool) только если изменилась
+    сигнатура справочника — число товаров и хэш кодов/названий; пока строится новый,
+    конкурентные запросы ждут на замке, а не строят его повторно.
+    Со снимком данных сигнатура и справочник берутся из него, без БД; без снимка
+    при живой подписке на загрузки сигнатура сверяется только после уведомления.
+    """
+    snap = current_snapshot()
+    if snap is not None:
+        if SEARCH["index"] is None or SEARCH["signature"] != snap.catalog_signature:
+            async with _search_lock:
+                if SEARCH["index"] is None or SEARCH["signature"] != snap.catalog_signature:
+                    await _set_search_index(snap.goods_rows(), snap.catalog_signature)
+        return SEARCH["index"]
+
+    def fresh() -> bool:
+        return SEARCH["index"] is not None and not SEARCH["dirty"] and (
+            data_events.connected or time.monotonic() - SEARCH["checked_at"] < SEARCH_REFRESH_S)
+
+    if fresh():
+        return SEARCH["index"]
+    async with _search_lock:
+        if fresh():
+            return SEARCH["index"]
+        SEARCH["dirty"] = False
+        async with get_conn() as conn:
+            cur = await conn.execute(GOODS_SIGNATURE_SQL)
+            signature = tuple(await cur.fetchone())
+            if SEARCH["index"] is None or signature != SEARCH["signature"]:
+                cur = await conn.execute(f"SELECT id, hs_code, name FROM {DB_SCHEMA}.goods")
+                rows = await cur.fetchall()
+            else:
+                rows = None
+        if rows is not None:
+            await _set_search_index(rows, signature)
+        SEARCH["checked_at"] = time.monotonic()
+        return SEARCH["index"]
+
+@timed("fetch_import_summaries")
+async def fetch_import_summaries(good_ids, top: int = 5) -> Dict[int, Dict[str, Any]]:
+    """Агрегаты импорта по товарам (ttr.import_by_year / import_by_country)."""
+    snap = current_snapshot()
+    if snap is not None and (OFFLINE_BUNDLE or top <= SNAPSHOT_TOP_MAX and snap.covers(good_ids)):
+        return snap.import_summaries(good_ids, top)
+    async with get_conn() as conn:
+        return await analytics.load_import_summaries_async(conn, good_ids, top)
+
+def make_etag(kind: str, good_id: int, data_version: int) -> str:
+    return f'"{kind}-{good_id}-v{data_version}-{ETAG_REV}"'
+
+def cache_headers(kind: str, good_id: int, data_version: int, updated_at: Optional[datetime]) -> Dict[str, str]:
+    # no-cache: браузер хранит ответ, но каждый раз переспрашивает (If-None-Match)
+    headers = {"ETag": make_etag(kind, good_id, data_version), "Cache-Control": "private, no-cache"}
+    if updated_at is not None:
+        headers["Last-Modified"] = format_datetime(updated_at.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+def is_not_modified(request: Request, etag: str, updated_at: Optional[datetime]) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        # If-None-Match важнее If-Modified-Since; слабые W/-метки сравниваем как сильные
+        tags = [t.strip().removeprefix("W/") for t in inm.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+    ims = request.headers.get("if-modified-since")
+    if ims and updated_at is not None:
+        try:
+            # в заголовке точность до секунды
+            return updated_at.replace(microsecond=0) <= parsedate_to_datetime(ims)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+@timed("good_version")
+async def good_version(good_id: int) -> Optional[store.GoodVersion]:
+    """Версия данных товара: из снимка, а если товара в нём ещё нет — из ttr.data_version."""
+    snap = current_snapshot()
+    found = snap.good_version(good_id) if snap is not None else None
+    if found is not None or OFFLINE_BUNDLE:
+        return found
+    async with get_conn() as conn:
+        return await store.load_version_async(conn, good_id)
+
+async def check_not_modified(request: Request, kind: str, good_id: int) -> Optional[Response]:
+    """
+    Условный GET: если у клиента актуальная версия — 304 после одного lookup'а
+    ttr.data_version по ключу, без загрузки данных, расчёта и рендеринга.
+    Без условных заголовков ничего не запрашивает.
+    """
+    if "if-none-match" not in request.headers and "if-modified-since" not in request.headers:
+        return None
+    found = await good_version(good_id)
+    if found is None:
         raise HTTPException(404, "Товар не найден")
-    return df.iloc[0].to_dict()
-
-def fetch_tariffs(good_id: int) -> pd.DataFrame:
-    with get_conn() as conn:
-        return pd.read_sql(
-            f"SELECT applied_rate, wto_bound_rate FROM {DB_SCHEMA}.tariffs WHERE good_id=%s",
-            conn, params=[good_id]
-        )
-
-def fetch_series(table: str, good_id: int) -> pd.DataFrame:
-    with get_conn() as conn:
-        return pd.read_sql(
-            f"SELECT year, value_usd_mln FROM {DB_SCHEMA}.{table} WHERE good_id=%s ORDER BY year",
-            conn, params=[good_id]
-        )
-
-def fetch_imports(good_id: int) -> pd.DataFrame:
-    with get_conn() as conn:
-        return pd.read_sql(
-            f"""SELECT year, country,
-                        COALESCE(value_usd_mln,0) AS value_usd_mln,
-                        COALESCE(value_tons,0)    AS value_tons,
-                        country_group
-                 FROM {DB_SCHEMA}.import_values
-                 WHERE good_id=%s""",
-            conn, params=[good_id]
-        )
-
-def fetch_flags(good_id: int) -> pd.DataFrame:
-    with get_conn() as conn:
-        return pd.read_sql(
-            f"SELECT in_techreg, in_pp1875, in_order4114 FROM {DB_SCHEMA}.goods_flags WHERE good_id=%s",
-            conn, params=[good_id]
-        )
+    headers = cache_headers(kind, good_id, found.data_version, found.updated_at)
+    if is_not_modified(request, headers["ETag"], found.updated_at):
+        return Response(status_code=304, headers=headers)
+    return None
+
+# =============================
+# Чат: общие части обычного и потокового варианта
+# =============================
+def chat_messages(grounding: str, question: str):
+    # та же схема промта, что в app.py
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user",   "content": f"Основание для ответа (не показывай как источник):\n{grounding}"},
+        {"role": "user",   "content": f"Вопрос: {question}"}
+    ]
+
+def client_id(request: Request) -> str:
+    """Клиент для справедливой очереди к LLM: X-Client-Id (если фронт/прокси его ставит) или IP."""
+    return request.headers.get("x-client-id") or (request.client.host if request.client else "unknown")
+
+def chat_question(body: Optional[Dict[str, Any]]) -> str:
+    question = (body or {}).get("question", "").strip()
+    if not question:
+        raise HTTPException(400, "question is required")
+    return question
+
+def chat_deterministic(body: Optional[Dict[str, Any]]) -> bool:
+    """Режим из запроса ({"deterministic": true/false}), по умолчанию — LLM_DETERMINISTIC."""
+    value = (body or {}).get("deterministic")
+    return LLM_DETERMINISTIC if value is None else bool(value)
+
+def normalize_question(question: str) -> str:
+    # «Почему Мера 6?» и «почему  мера 6» — один вопрос
+    q = question.lower().replace("ё", "е")
+    q = re.sub(r"[^\w\s]", " ", q)
+    return " ".join(q.split())
+
+def chat_cache_key(question: str, grounding: str) -> str:
+    grounding_hash = hashlib.sha256(grounding.encode("utf-8")).hexdigest()
+    raw = "\x1f".join([normalize_question(question), grounding_hash, CHAT_MODEL, PROMPT_VERSION])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    v = sorted(values)
+    return v[min(len(v) - 1, int(q * len(v)))]
+
+def chat_stats() -> Dict[str, Any]:
+    out = {k: CHAT_STATS[k] for k in ("streams", "errors", "stopped_early")}
+    out["cache"] = chat_cache.stats()
+    out["cache"]["coalesced"] = chat_flight.coalesced
+    out["cache"]["inflight"] = len(chat_flight)
+    out["admission"] = llm_admission.stats()
+    for k in ("ttft_s", "first_chunk_s", "total_s"):
+        out[k] = {"p50": _percentile(CHAT_STATS[k], 0.5), "p95": _percentile(CHAT_STATS[k], 0.95),
+                  "n": len(CHAT_STATS[k])}
+    return out
+
+def dashboard_payload(bundle: GoodBundle, columnar: bool = False,
+                      import_summary: Optional[Dict[str, Any]] = None,
+                      raw_imports: bool = True) -> Dict[str, Any]:
+    """
+    Ответ /dashboard. columnar=True — таблицы в колоночном виде
+    {"year": [...], "country": [...], ...} вместо списка строк-словарей.
+    import_summary — агрегаты импорта (ttr_core/analytics.py); исходные строки
+    импорта попадают в ответ только при raw_imports=True.
+    """
+    frame = frame_columns if columnar else frame_records
+    rec = bundle.recommendation
+    payload = {
+        "good": bundle.good,
+        "tariffs": frame(bundle.tariffs),
+        "production": frame(bundle.production),
+        "consumption": frame(bundle.consumption),
+        "flags": frame(bundle.flags),
+        "measures": rec.measures,
+        "summary": rec.summary
+    }
+    if import_summary is not None:
+        payload["import_summary"] = import_summary
+    if raw_imports:
+        payload["imports"] = frame(bundle.imports)
+    return payload
+
+def json_response(request: Request, content: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Сериализованный и (по Accept-Encoding) сжатый brotli/gzip ответ; bytes — уже готовый JSON.
+    Сжатое представление получает слабый ETag: байты другие, смысл тот же.
+    """
+    body = content if isinstance(content, bytes) else dumps(content)
+    body, encoding = compress(body, request.headers.get("accept-encoding"))
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        if "ETag" in headers and not headers["ETag"].startswith("W/"):
+            headers["ETag"] = "W/" + headers["ETag"]
+    return Response(body, media_type="application/json", headers=headers)
 
 # =============================
 # ENDPOINTS
 # =============================
 
+@app.get("/api/health/db")
+async def api_health_db():
+    """Проверка БД и метрики пула (ожидание, насыщение, переподключения)."""
+    if OFFLINE_BUNDLE:
+        return {"ok": True, "offline": OFFLINE_BUNDLE}
+    ok = await async_pool.health_check()
+    return JSONResponse({"ok": ok, "pool": async_pool.stats()}, status_code=200 if ok else 503)
+
+
 @app.get("/api/goods")
-def api_goods():
+async def api_goods():
     """Справочник товаров (id, hs_code, name)."""
-    with get_conn() as conn:
-        df = pd.read_sql(f"SELECT id, hs_code, name FROM {DB_SCHEMA}.goods ORDER BY name", conn)
-    return df.to_dict(orient="records")
+    snap = current_snapshot()
+    if snap is not None:
+        rows = sorted(snap.goods_rows(), key=lambda r: (r[2] is None, r[2] or ""))
+        return [{"id": r[0], "hs_code": r[1], "name": r[2]} for r in rows]
+    async with get_conn() as conn:
+        cur = await conn.execute(f"SELECT id, hs_code, name FROM {DB_SCHEMA}.goods ORDER BY name")
+        rows = await cur.fetchall()
+    return [{"id": r[0], "hs_code": r[1], "name": r[2]} for r in rows]
+
+
+@app.get("/api/goods/search")
+async def api_goods_search(q: str = Query(..., min_length=1, max_length=200),
+                           limit: int = Query(20, ge=1, le=200),
+                           offset: int = Query(0, ge=0, le=100_000)):
+    """
+    Поиск товаров по коду ТН ВЭД или названию, постранично.
+      - цифры (с пробелами или без: «8428 10» = «842810») — префикс кода;
+      - иначе — нечёткий поиск по названию, устойчивый к опечаткам.
+    Ответ: {"total", "mode", "items": [{id, hs_code, name, score, match}], "limit", "offset"}.
+    """
+    index = await goods_search_index()
+    result = index.search(q, limit=limit, offset=offset)
+    result.update(limit=limit, offset=offset)
+    return result
 
 
 @app.get("/api/goods/{good_id}/dashboard")
-def api_dashboard(good_id: int):
+async def api_dashboard(good_id: int, request: Request,
+                        format: str = Query("records", pattern="^(records|columnar)$"),
+                        imports: str = Query("summary", pattern="^(summary|raw)$"),
+                        top: int = Query(5, ge=1, le=50)):
     """
     Полный набор данных для UI по конкретному товару:
       - good (id, hs_code, name)
       - tariffs (applied_rate, wto_bound_rate)
       - production/consumption time series
-      - imports by country
+      - import_summary: импорт по годам (итоги, доля и динамика НС, изменения к прошлому
+        году, топ-{top} поставщиков и топ по СКЦ) — из материализованных представлений
       - flags (in_techreg, in_pp1875, in_order4114)
       - measures, summary (результат алгоритма)
+
+    ?imports=raw — дополнительно исходные строки импорта (год, страна) в "imports";
+    постранично они доступны в /api/goods/{id}/imports.
+    ?format=columnar — таблицы в колоночном виде ({"year": [...], "country": [...]}).
+    Ответ сжимается brotli/gzip по Accept-Encoding.
+
+    Отдаёт ETag/Last-Modified по версии данных товара; на If-None-Match
+    с актуальной меткой — 304 без загрузки данных. Готовый JSON кэшируется
+    по версии данных (dashboard_cache, общий для воркеров при CACHE_BACKEND=sqlite|redis).
     """
-    good = fetch_good(good_id)
-    tariffs = fetch_tariffs(good_id)
-    prod = fetch_series("production", good_id)
-    cons = fetch_series("consumption", good_id)
-    imp = fetch_imports(good_id)
-    flags = fetch_flags(good_id)
+    kind = f"dashboard-{format}-{imports}-top{top}"
+    found = await good_version(good_id)
+    if found is None:
+        raise HTTPException(404, "Товар не найден")
+    headers = cache_headers(kind, good_id, found.data_version, found.updated_at)
+    if is_not_modified(request, headers["ETag"], found.updated_at):
+        return Response(status_code=304, headers=headers)
 
-    measures, summary = compute_recommendation(tariffs, prod, cons, imp, flags)
+    # готовый JSON из кэша (память воркера → общий уровень); при промахе — один расчёт на ключ
+    key = (kind, good_id, found.data_version, ETAG_REV)
+    body = await dashboard_cache.aget(key)
+    if body is None:
+        async def build() -> bytes:
+            (bundle, measures, summary), import_summaries = await asyncio.gather(
+                fetch_recommendation(good_id), fetch_import_summaries([good_id], top),
+            )
+            with span("dashboard_payload"):
+                data = dumps(dashboard_payload(bundle, columnar=format == "columnar",
+                                               import_summary=import_summaries[good_id],
+                                               raw_imports=imports == "raw"))
+            await dashboard_cache.aset((kind, good_id, bundle.data_version, ETAG_REV), data)
+            return data
+        body = await dashboard_flight.do(key, build)
+    return json_response(request, body, headers)
 
-    return {
-        "good": good,
-        "tariffs": tariffs.to_dict(orient="records"),
-        "production": prod.to_dict(orient="records"),
-        "consumption": cons.to_dict(orient="records"),
-        "imports": imp.to_dict(orient="records"),
-        "flags": flags.to_dict(orient="records"),
-        "measures": measures,
-        "summary": summary
-    }
+
+@app.get("/api/goods/{good_id}/imports/summary")
+async def api_import_summary(good_id: int, request: Request, top: int = Query(5, ge=1, le=50)):
+    """
+    Аналитика импорта по годам (без исходных строк):
+      {"last_year", "top", "years": [{year, total_usd_mln, total_tons, unfriendly_usd_mln,
+        unfriendly_share_pct, unfriendly_delta, metric_used, total_delta_usd_mln,
+        total_yoy_pct, countries, top_suppliers: [...], top_skc: [...]}, ...]}
+    Страна в топах: value_usd_mln, value_tons, share_pct, skc_usd_per_ton ($/т), места.
+    """
+    kind = f"imports-summary-top{top}"
+    not_modified = await check_not_modified(request, kind, good_id)
+    if not_modified is not None:
+        return not_modified
+    found = await good_version(good_id)
+    if found is None:
+        raise HTTPException(404, "Товар не найден")
+    summaries = await fetch_import_summaries([good_id], top)
+    headers = cache_headers(kind, good_id, found.data_version, found.updated_at)
+    return json_response(request, summaries[good_id], headers)
 
 
-@app.get("/api/goods/{good_id}/report.docx")
-def api_brief_docx(good_id: int):
+@app.get("/api/goods/{good_id}/imports")
+async def api_import_rows(good_id: int,
+                          year: Optional[int] = Query(None),
+                          country_group: Optional[str] = Query(None, max_length=32),
+                          limit: int = Query(100, ge=1, le=1000),
+                          offset: int = Query(0, ge=0)):
+    """Исходные строки импорта (год, страна) постранично: {"total", "items", "limit", "offset"}."""
+    snap = current_snapshot()
+    if snap is not None and snap.covers([good_id]):
+        page = snap.import_rows(good_id, year, country_group, limit, offset)
+    elif OFFLINE_BUNDLE:
+        raise HTTPException(404, "Товар не найден")
+    else:
+        async with get_conn() as conn:
+            found = await store.load_version_async(conn, good_id)
+            if found is None:
+                raise HTTPException(404, "Товар не найден")
+            page = await analytics.load_import_rows_async(conn, good_id, year, country_group, limit, offset)
+    page.update(limit=limit, offset=offset)
+    return page
+
+
+@app.post("/api/goods/{good_id}/scenarios")
+async def api_scenarios(good_id: int, body: Dict[str, Any], request: Request):
     """
-    DOCX «Справка по товару …» — тот самый связный текст с «Ключевыми ориентирами периода анализа».
+    «Что если»: как меняются меры при сдвиге тарифа, доли НС, объёма импорта или P/C.
+
+    Request JSON:
+      { "axes": { "applied_rate": {"from": 0, "to": 0.2, "step": 0.01},
+                  "unfriendly_share_pct": [10, 20, 30, 40],
+                  "production_change_pct": {"from": -30, "to": 30, "step": 10} } }
+      оси: applied_rate, wto_bound_rate, unfriendly_share_pct, import_change_pct,
+           production_change_pct, consumption_change_pct (см. ttr_core/scenarios.py)
+
+    Response: {"base", "axes", "shape", "scenarios", "outcomes": [{measures, branches, count}],
+               "grid": [номер исхода по точкам сетки, C-порядок], "changed_share", "notes"}
+    Исход 0 — текущие меры товара.
     """
-    good = fetch_good(good_id)
-    tariffs = fetch_tariffs(good_id)
-    prod = fetch_series("production", good_id)
-    cons = fetch_series("consumption", good_id)
-    imp = fetch_imports(good_id)
-    flags = fetch_flags(good_id)
+    axes = (body or {}).get("axes")
+    bundle = await fetch_bundle(good_id)
+    try:
+        with span("scenarios_sweep"):
+            result = await run_in_threadpool(scenarios.sweep, bundle, axes)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return json_response(request, dumps(result))
 
-    measures, summary = compute_recommendation(tariffs, prod, cons, imp, flags)
-    buf = build_brief_docx(good, measures, summary, tariffs, imp)
 
-    filename = f"Spravka_{good['hs_code'].replace(' ','')}.docx"
-    return StreamingResponse(
-        buf,
-        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
-    )
+@app.get("/api/goods/{good_id}/backtest")
+async def api_backtest(good_id: int, request: Request):
+    """
+    Бэктест: какие меры алгоритм рекомендовал бы на конец каждого года с импортом
+    (импорт и P/C — до этого года включительно, тарифы и флаги — текущие).
+
+    Response: {"good_id", "data_version", "years": [{year, measures, summary, changed}],
+               "changes", "changed_years", "note"}; changed — меры сменились к предыдущему году.
+    Без снимка данных берётся из ttr.backtest, а если там нет актуальной версии — считается
+    и сохраняется. ETag/304 и кэш готового JSON — по версии данных, как у /dashboard.
+    """
+    kind = "backtest"
+    found = await good_version(good_id)
+    if found is None:
+        raise HTTPException(404, "Товар не найден")
+    headers = cache_headers(kind, good_id, found.data_version, found.updated_at)
+    if is_not_modified(request, headers["ETag"], found.updated_at):
+        return Response(status_code=304, headers=headers)
+
+    key = (kind, good_id, found.data_version, ETAG_REV)
+    body = await dashboard_cache.aget(key)
+    if body is None:
+        async def build() -> bytes:
+            snap = current_snapshot()
+            if snap is not None and (OFFLINE_BUNDLE or snap.covers([good_id])):
+                bundle = await fetch_bundle(good_id)
+                rows = await run_in_threadpool(timed("backtest")(backtest.backtest_bundle), bundle)
+            else:
+                async with async_pool.request_scope() as conn:
+                    rows = await backtest.load_backtest_async(conn, good_id, found.data_version)
+                    if rows is None:
+                        bundle = await fetch_bundle(good_id)
+                        rows = await run_in_threadpool(timed("backtest")(backtest.backtest_bundle), bundle)
+                        try:
+                            await backtest.save_backtest_async(conn, good_id, bundle.data_version, rows)
+                            await conn.commit()
+                        except Exception as e:
+                            await conn.rollback()
+                            log(f"[api] бэктест good_id={good_id} не сохранён: {e}")
+            data = dumps(backtest.payload(good_id, found.data_version, rows))
+            await dashboard_cache.aset(key, data)
+            return data
+        body = await dashboard_flight.do(key, build)
+    return json_response(request, body, headers)
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse, который освобождает слот при любом исходе ответа. finally генератора
+    не срабатывает, если клиент ушёл до первого куска (генератор так и не запущен), а
+    background не вызывается, если отправка оборвалась, — поэтому release() здесь (он идемпотентен).
+    """
+
+    def __init__(self, content, slot, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.slot.release()
+
+
+@app.get("/api/export/imports")
+async def api_export_imports(format: str = Query("csv", pattern="^(csv|parquet|arrow)$"),
+                             ids: Optional[List[int]] = Query(None),
+                             hs_prefix: Optional[str] = Query(None, max_length=16),
+                             year_from: Optional[int] = Query(None),
+                             year_to: Optional[int] = Query(None),
+                             country_group: Optional[str] = Query(None, max_length=32)):
+    """
+    Выгрузка строк импорта целиком или срезом (товары, префикс ТН ВЭД, годы, группа стран)
+    потоком из серверного курсора, без сборки выборки в памяти.
+
+    Колонки: good_id, hs_code, year, country, country_group, value_usd_mln, value_tons;
+    порядок — товар, год, страна. format: csv | parquet | arrow (Arrow IPC stream);
+    parquet и arrow — при установленном pyarrow, иначе 501.
+    """
+    try:
+        encoder = export.make_encoder(format)
+    except LookupError as e:
+        raise HTTPException(501, str(e))
+    slot = export_slots.try_acquire()
+    if slot is None:
+        raise Overloaded(503, 5, f"идёт {export.EXPORT_MAX_CONCURRENT} выгрузок, повторите позже")
+
+    params = export.export_params(ids, hs_prefix, year_from, year_to, country_group)
+    if OFFLINE_BUNDLE:
+        batches = export.snapshot_batches(current_snapshot(), params)
+    else:
+        batches = export.db_batches(DB_CONNINFO, params)
+
+    async def body():
+        t0 = time.perf_counter()
+        sent = 0
+        try:
+            async with aclosing(export.stream(encoder, batches)) as chunks:
+                async for chunk in chunks:
+                    sent += len(chunk)
+                    yield chunk
+        finally:
+            slot.release()
+            log(f"[api] выгрузка {format}: {sent / 1e6:.1f} МБ за {time.perf_counter() - t0:.1f} c")
+
+    return SlotStreamingResponse(body(), slot, media_type=encoder.media_type, headers={
+        "Content-Disposition": f'attachment; filename="ttr_imports.{encoder.suffix}"',
+        "Cache-Control": "no-store",
+    })
+
+
+@app.post("/api/goods/dashboards")
+async def api_dashboards(body: Dict[str, Any]):
+    """
+    Дашборды по набору товаров (портфель).
+
+    Request JSON:
+      { "ids": [1, 2, 3] }  и/или  { "hs_prefix": "8428" }  (пробелы в коде не важны)
+
+      необязательно: "imports": "summary" (по умолчанию) | "raw" — как ?imports= у /dashboard
+
+    Response: NDJSON-поток, по строке на товар (формат как у /dashboard).
+    Данные грузятся пачками по BULK_CHUNK товаров: на пачку — пять set-based запросов
+    и два к агрегатам импорта, меры берутся из ttr.recommendations, недостающие
+    считаются за один проход. Со снимком данных (ttr_core/snapshot.py) — без БД.
+    """
+    body = body or {}
+    ids = body.get("ids")
+    hs_prefix = body.get("hs_prefix")
+    raw_imports = body.get("imports", "summary") == "raw"
+    if ids is None and not hs_prefix:
+        raise HTTPException(400, "Нужен ids или hs_prefix")
+    try:
+        ids = [int(x) for x in ids] if ids is not None else None
+    except (TypeError, ValueError):
+        raise HTTPException(400, "ids — список целых чисел")
+
+    snap = current_snapshot()
+    if snap is not None:
+        goods = snap.goods_index(ids, hs_prefix, limit=BULK_MAX_GOODS + 1)
+    else:
+        async with get_conn() as conn:
+            goods = await load_goods_index_async(conn, ids, hs_prefix, limit=BULK_MAX_GOODS + 1)
+    if len(goods) > BULK_MAX_GOODS:
+        raise HTTPException(413, f"Слишком много товаров (не больше {BULK_MAX_GOODS})")
+
+    def snapshot_chunk(chunk) -> bytes:
+        good_ids = chunk["id"].tolist()
+        summaries = snap.import_summaries(good_ids)
+        return b"".join(dumps(dashboard_payload(snap.bundle(g), import_summary=summaries[g],
+                                                raw_imports=raw_imports)) + b"\n" for g in good_ids)
+
+    async def stream():
+        for start in range(0, len(goods), BULK_CHUNK):
+            if snap is not None:
+                yield await run_in_threadpool(snapshot_chunk, goods.iloc[start:start + BULK_CHUNK])
+                continue
+            chunk = goods.iloc[start:start + BULK_CHUNK]
+            async with get_conn() as conn:
+                bulk = await load_bulk_async(conn, chunk)
+                bundles = list(bulk.bundles())
+                computed = store.fill_missing(bundles, bulk)
+                if computed:
+                    try:
+                        await store.save_many_async(conn, computed)
+                        await conn.commit()
+                    except Exception as e:
+                        await conn.rollback()
+                        log(f"[api] рекомендации пачки не сохранены: {e}")
+                summaries = await analytics.load_import_summaries_async(conn, [b.good_id for b in bundles])
+            # соединение уже вернулось в пул — медленный клиент его не держит
+            yield b"".join(dumps(dashboard_payload(b, import_summary=summaries[b.good_id],
+                                                   raw_imports=raw_imports)) + b"\n" for b in bundles)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+async def docx_response(request: Request, kind: str, good_id: int) -> Response:
+    """
+    Общая часть DOCX-эндпоинтов: 304 по ETag, затем готовые байты из doc_cache
+    (память → диск) по (вид, товар, версия данных, версия шаблона); при промахе —
+    сборка в threadpool (одна на ключ, даже при одновременных запросах) и запись в кэш.
+    """
+    not_modified = await check_not_modified(request, kind, good_id)
+    if not_modified is not None:
+        return not_modified
+
+    found = await good_version(good_id)
+    if found is None:
+        raise HTTPException(404, "Товар не найден")
+    key = (kind, good_id, found.data_version)
+    data = await run_in_threadpool(doc_cache.get, key)
+    version, updated_at = found.data_version, found.updated_at
+
+    if data is None:
+        async def render():
+            bundle, measures, summary = await fetch_recommendation(good_id)
+            with span(f"docx_{kind}"):
+                body = await run_in_threadpool(render_doc, kind, bundle.good, measures, summary,
+                                               bundle.tariffs, bundle.imports)
+            # версия могла вырасти между lookup'ом и загрузкой — кладём под фактической
+            await run_in_threadpool(doc_cache.put, (kind, good_id, bundle.data_version), body)
+            return body, bundle.data_version, bundle.updated_at
+        data, version, updated_at = await docx_flight.do(key, render)
+
+    headers = cache_headers(kind, good_id, version, updated_at)
+    headers["Content-Disposition"] = f'attachment; filename="{doc_filename(kind, found.hs_code)}"'
+    return Response(data, media_type=DOCX_MEDIA_TYPE, headers=headers)
+
+
+@app.get("/api/goods/{good_id}/report.docx")
+async def api_brief_docx(good_id: int, request: Request):
+    """
+    DOCX «Справка по товару …» — тот самый связный текст с «Ключевыми ориентирами периода анализа».
+    """
+    return await docx_response(request, "report", good_id)
 
 
 @app.get("/api/goods/{good_id}/mosprom-letter.docx")
-def api_mosprom_docx(good_id: int):
+async def api_mosprom_docx(good_id: int, request: Request):
     """
     DOCX «Обращение в АНО “Моспром”».
     """
-    good = fetch_good(good_id)
-    tariffs = fetch_tariffs(good_id)
-    prod = fetch_series("production", good_id)
-    cons = fetch_series("consumption", good_id)
-    imp = fetch_imports(good_id)
-    flags = fetch_flags(good_id)
+    return await docx_response(request, "mosprom", good_id)
 
-    measures, summary = compute_recommendation(tariffs, prod, cons, imp, flags)
-    buf = build_mosprom_docx(good, measures, summary, tariffs, imp)
 
-    filename = f"Mosprom_{good['hs_code'].replace(' ','')}.docx"
-    return StreamingResponse(
-        buf,
-        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
-    )
+@app.post("/api/docs/jobs", status_code=202)
+async def api_doc_job_submit(body: Dict[str, Any]):
+    """
+    Пакетная генерация DOCX в фоне.
+
+    Request JSON:
+      { "ids": [1, 2, 3] }  и/или  { "hs_prefix": "8428" },
+      "kinds": ["report", "mosprom"]   (по умолчанию — оба)
+
+    Response: { "job_id", "status", ... } — дальше опрашивать GET /api/docs/jobs/{job_id},
+    по статусу "done" скачать ZIP: GET /api/docs/jobs/{job_id}/download.
+    """
+    body = body or {}
+    ids = body.get("ids")
+    hs_prefix = body.get("hs_prefix")
+    if ids is None and not hs_prefix:
+        raise HTTPException(400, "Нужен ids или hs_prefix")
+    try:
+        ids = [int(x) for x in ids] if ids is not None else None
+    except (TypeError, ValueError):
+        raise HTTPException(400, "ids — список целых чисел")
+    kinds = body.get("kinds") or list(DOC_KINDS)
+    unknown = [k for k in kinds if k not in DOC_KINDS]
+    if unknown:
+        raise HTTPException(400, f"Неизвестные виды документов: {unknown}; допустимы: {list(DOC_KINDS)}")
+
+    # Отбор считаем сразу, как в /api/goods/dashboards: выборка по hs_prefix больше лимита —
+    # тот же 413, что и длинный список ids, а не молча обрезанный архив. Заданию уходят
+    # отобранные id — оно собирает ровно то, что здесь посчитано.
+    snap = current_snapshot()
+    if snap is not None:
+        goods = snap.goods_index(ids, hs_prefix, limit=DOC_JOB_MAX_GOODS + 1)
+    else:
+        async with get_conn() as conn:
+            goods = await load_goods_index_async(conn, ids, hs_prefix, limit=DOC_JOB_MAX_GOODS + 1)
+    if len(goods) > DOC_JOB_MAX_GOODS:
+        raise HTTPException(413, f"Слишком много товаров (не больше {DOC_JOB_MAX_GOODS})")
+
+    job = doc_jobs.submit(goods["id"].tolist(), hs_prefix, kinds)
+    return job.to_dict()
+
+
+@app.get("/api/docs/jobs/{job_id}")
+async def api_doc_job_status(job_id: str):
+    """Статус и прогресс задания (done/total, ошибки, скорость)."""
+    job = doc_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Задание не найдено")
+    return job.to_dict()
+
+
+@app.get("/api/docs/jobs/{job_id}/download")
+async def api_doc_job_download(job_id: str):
+    """ZIP с документами задания (когда статус — done)."""
+    job = doc_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Задание не найдено")
+    if job.status != "done" or not job.zip_path:
+        raise HTTPException(409, f"Задание ещё не готово (status={job.status})")
+    return FileResponse(job.zip_path, media_type="application/zip", filename=f"docs_{job_id}.zip")
 
 
 @app.post("/api/goods/{good_id}/chat")
-def api_chat(good_id: int, body: Dict[str, Any]):
+async def api_chat(good_id: int, body: Dict[str, Any], request: Request):
     """
     Чат по товару (тот же промт/логика, что в app.py).
 
     Request JSON:
-      { "question": "строка вопроса" }
+      { "question": "строка вопроса", "deterministic": true }   (deterministic — необязательно)
 
     Response JSON:
       { "answer": "текст ответа" }
+
+    В детерминированном режиме ответ кэшируется по (нормализованный вопрос, хэш
+    заземления, модель, версия промта); одинаковые одновременные вопросы уходят
+    в LLM одним запросом.
+
+    Запросы к LLM проходят допуск (llm_admission): при заполненной очереди — 503,
+    при превышении лимита клиента — 429, оба с заголовком Retry-After.
     """
-    question = (body or {}).get("question", "").strip()
-    if not question:
-        raise HTTPException(400, "question is required")
+    question = chat_question(body)
+    deterministic = chat_deterministic(body)
+    client = client_id(request)
 
     # собираем «заземление» на основе расчёта мер (без внешних PDF/RAG)
-    good = fetch_good(good_id)
-    tariffs = fetch_tariffs(good_id)
-    prod = fetch_series("production", good_id)
-    cons = fetch_series("consumption", good_id)
-    imp = fetch_imports(good_id)
-    flags = fetch_flags(good_id)
-
-    measures, summary = compute_recommendation(tariffs, prod, cons, imp, flags)
-    grounding = make_grounding_message(good, measures, summary)
+    bundle, measures, summary = await fetch_recommendation(good_id)
+    grounding = bundle.recommendation.grounding
+    messages = chat_messages(grounding, question)
 
-    # та же схема промта, что в app.py
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user",   "content": f"Основание для ответа (не показывай как источник):\n{grounding}"},
-        {"role": "user",   "content": f"Вопрос: {question}"}
-    ]
+    async def ask() -> str:
+        with span("llm_admission"):
+            slot = await llm_admission.acquire(client)
+        async with slot:
+            with span("chat_completion"):
+                raw = await chat_completion_async(messages, temperature=0.15, max_tokens=900,
+                                                  deterministic=deterministic)
+        with span("sanitize_ai"):
+            ans = clamp_measures_in_text(sanitize_ai(raw), measures)
+        if deterministic:
+            await chat_cache.aset(key, ans)
+        return ans
 
     try:
-        raw = chat_completion(messages, temperature=0.15, max_tokens=900)
-        ans = sanitize_ai(raw)
-        ans = clamp_measures_in_text(ans, measures)
+        if not deterministic:
+            return {"answer": await ask()}
+        key = chat_cache_key(question, grounding)
+        ans = await chat_cache.aget(key)
+        if ans is None:
+            ans = await chat_flight.do(key, ask)
         return {"answer": ans}
+    except Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(500, f"LLM error: {e}")
+
+
+@app.post("/api/goods/{good_id}/chat/stream")
+async def api_chat_stream(good_id: int, body: Dict[str, Any], request: Request):
+    """
+    Потоковый чат по товару (Server-Sent Events), запрос — как у /chat.
+
+    События:
+      event: delta  data: {"text": "..."}     — очередной кусок ответа (уже отфильтрованный)
+      event: done   data: {"answer": "...", "ttft_ms": ..., "total_ms": ...}
+                    answer — итоговый текст (sanitize_ai + clamp по всему ответу),
+                    клиенту стоит заменить им собранные куски
+      event: error  data: {"detail": "..."}
+
+    Фильтры применяются к потоку по предложениям (StreamSanitizer); если сработала
+    запретная фраза или лимит слов, чтение ответа модели прекращается.
+    В детерминированном режиме ответ из кэша /chat отдаётся сразу одним куском,
+    а полученный потоком — сохраняется в кэш.
+
+    Слот допуска к LLM берётся до начала ответа (отказ — обычный 429/503 с Retry-After)
+    и держится, пока идёт генерация.
+    """
+    question = chat_question(body)
+    deterministic = chat_deterministic(body)
+    t0 = time.perf_counter()
+    bundle, measures, summary = await fetch_recommendation(good_id)
+    grounding = bundle.recommendation.grounding
+    messages = chat_messages(grounding, question)
+    key = chat_cache_key(question, grounding) if deterministic else None
+    cached = await chat_cache.aget(key) if deterministic else None
+
+    async def replay():
+        yield sse("delta", {"text": cached})
+        yield sse("done", {"answer": cached, "cached": True, "ttft_ms": 0,
+                           "total_ms": round((time.perf_counter() - t0) * 1000)})
+
+    slot = None
+    if cached is None:
+        with span("llm_admission"):
+            slot = await llm_admission.acquire(client_id(request))
+
+    async def stream():
+        CHAT_STATS["streams"] += 1
+        san = StreamSanitizer(measures)
+        ttft = first_chunk = None
+        t_llm = time.perf_counter()
+        try:
+            tokens_iter = chat_completion_stream_async(messages, temperature=0.15, max_tokens=900,
+                                                       deterministic=deterministic)
+            async with aclosing(tokens_iter) as tokens:
+                async for delta in tokens:
+                    if ttft is None:
+                        ttft = time.perf_counter() - t0
+                        CHAT_STATS["ttft_s"].append(ttft)
+                        metrics.observe("chat_completion_ttft", time.perf_counter() - t_llm)
+                    text = san.feed(delta)
+                    if text:
+                        if first_chunk is None:
+                            first_chunk = time.perf_counter() - t0
+                            CHAT_STATS["first_chunk_s"].append(first_chunk)
+                        yield sse("delta", {"text": text})
+                    if san.stopped:
+                        CHAT_STATS["stopped_early"] += 1
+                        break
+            metrics.observe("chat_completion_stream", time.perf_counter() - t_llm)
+            text = san.finish()
+            if text:
+                yield sse("delta", {"text": text})
+        except Exception as e:
+            CHAT_STATS["errors"] += 1
+            log(f"[api] chat stream good_id={good_id}: LLM error: {e}")
+            yield sse("error", {"detail": f"LLM error: {e}"})
+            return
+        finally:
+            slot.release()
+
+        total = time.perf_counter() - t0
+        CHAT_STATS["total_s"].append(total)
+        log(f"[api] chat stream good_id={good_id}: ttft={ttft or 0:.2f}s total={total:.2f}s")
+        with span("sanitize_ai"):
+            answer = clamp_measures_in_text(sanitize_ai(san.raw), measures)
+        if deterministic:
+            await chat_cache.aset(key, answer)
+        yield sse("done", {
+            "answer": answer,
+            "cached": False,
+            "ttft_ms": round(ttft * 1000) if ttft is not None else None,
+            "total_ms": round(total * 1000),
+        })
+
+    return StreamingResponse(
+        replay() if cached is not None else stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # клиент ушёл до начала потока — генератор не стартовал, слот освобождаем здесь
+        background=BackgroundTask(slot.release) if slot is not None else None,
+    )
+
+
+@app.get("/api/health/docs")
+async def api_health_docs():
+    """Кэш готовых DOCX: попадания в память/на диск, объём, версия шаблона."""
+    return doc_cache.stats()
+
+
+@app.get("/api/health/llm")
+async def api_health_llm():
+    """Метрики потокового чата: TTFT, время до первого куска и полного ответа (p50/p95)."""
+    return chat_stats()
+
+
+@app.get("/api/health/cache")
+async def api_health_cache():
+    """
+    Кэши по уровням (память воркера / sqlite / redis, диск DOCX): попадания, промахи, вытеснения;
+    events — подписка на уведомления о загрузке данных (LISTEN/NOTIFY).
+    """
+    return await run_in_threadpool(lambda: {
+        "backend": CACHE_BACKEND,
+        "dashboard": dashboard_cache.stats(),
+        "chat": chat_cache.stats(),
+        "docx": doc_cache.stats(),
+        "events": data_events.stats(),
+    })
+
+
+@app.get("/api/health/snapshot")
+async def api_health_snapshot():
+    """Снимок данных в памяти: размер, время чтения и сборки, возраст, число обновлений."""
+    if snapshots is None:
+        return {"enabled": False}
+    return {**snapshots.stats(), "offline": OFFLINE_BUNDLE}
+
+@app.get("/api/health/startup")
+async def api_health_startup():
+    """Время старта процесса и какие ленивые зависимости уже загружены запросами."""
+    return {
+        **STARTUP,
+        "budget_s": STARTUP_BUDGET_S,
+        "lazy_loaded": {m: m in sys.modules for m in LAZY_MODULES},
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+async def api_metrics():
+    """Гистограммы времени запросов и этапов по эндпоинтам (Prometheus, ttr_core/metrics.py)."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+STARTUP["import_s"] = time.perf_counter() - _IMPORT_STARTED
@@ -21,6 +21,9 @@ from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import cm
 from docx import Document
 
+from ttr_core.events import ThreadedDataListener, GoodRevisions
+from ttr_core import offline
+
 # =============================
 # Настройки
 # =============================
@@ -30,6 +33,8 @@ DB_NAME = os.environ.get("PGDATABASE", "Hackaton")
 DB_USER = os.environ.get("PGUSER", "postgres")
 DB_PASS = os.environ.get("PGPASSWORD", "123")
 DB_SCHEMA = "ttr"
+# Автономный режим: данные из файла-выгрузки вместо PostgreSQL (ttr_core/offline.py)
+OFFLINE_BUNDLE = offline.OFFLINE_BUNDLE
 
 OPENAI_BASE = os.environ.get("OPENAI_BASE", "http://26.81.18.206:1234/v1")
 CHAT_MODEL  = os.environ.get("CHAT_MODEL", "meta-llama-3.1-8b-instruct")
@@ -45,33 +50,53 @@ st.title("Система мер ТТР — дашборд")
 # Соединение с БД
 # =============================
 def get_conn():
+    if OFFLINE_BUNDLE:
+        # файл подключён как схема ttr, курсор понимает %s — запросы ниже те же
+        return offline.connect(OFFLINE_BUNDLE)
     return psycopg2.connect(
         host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASS
     )
 
 # =============================
-# Загрузка данных (кэш)
+# Актуальность кэша: уведомления parser.py о загрузке (LISTEN/NOTIFY, ttr_core/events.py)
 # =============================
-@st.cache_data(show_spinner=False)
-def load_goods_list() -> pd.DataFrame:
+@st.cache_resource(show_spinner=False)
+def data_revisions() -> GoodRevisions:
+    """
+    Ревизии товаров на процесс Streamlit: фоновый поток слушает уведомления и
+    увеличивает ревизию изменившихся товаров. Ревизия — аргумент загрузчиков ниже,
+    поэтому после загрузки перечитываются только затронутые товары.
+    """
+    revisions = GoodRevisions()
+    if not OFFLINE_BUNDLE:  # файл-выгрузка не меняется — слушать нечего
+        ThreadedDataListener(get_conn, revisions.apply).start()
+    return revisions
+
+# =============================
+# Загрузка данных (кэш; rev — ревизия товара/справочника из data_revisions)
+# =============================
+CACHE_MAX_ENTRIES = 512  # прежние ревизии вытесняются, а не копятся
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_goods_list(rev=None) -> pd.DataFrame:
     q = f"SELECT id, hs_code, name FROM {DB_SCHEMA}.goods ORDER BY name"
     with get_conn() as conn:
         return pd.read_sql(q, conn)
 
-@st.cache_data(show_spinner=False)
-def load_tariffs(good_id: int) -> DataFrame:
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_tariffs(good_id: int, rev=None) -> DataFrame:
     q = f"SELECT good_id, applied_rate, wto_bound_rate FROM {DB_SCHEMA}.tariffs WHERE good_id = %s"
     with get_conn() as conn:
         return pd.read_sql(q, conn, params=[good_id])
 
-@st.cache_data(show_spinner=False)
-def load_series(table: str, good_id: int) -> DataFrame:
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_series(table: str, good_id: int, rev=None) -> DataFrame:
     q = f"SELECT year, value_usd_mln FROM {DB_SCHEMA}.{table} WHERE good_id = %s ORDER BY year"
     with get_conn() as conn:
         return pd.read_sql(q, conn, params=[good_id])
 
-@st.cache_data(show_spinner=False)
-def load_imports(good_id: int) -> DataFrame:
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_imports(good_id: int, rev=None) -> DataFrame:
     q = f"""
     SELECT year, country, 
            COALESCE(value_usd_mln,0) AS value_usd_mln,
@@ -83,8 +108,20 @@ def load_imports(good_id: int) -> DataFrame:
     with get_conn() as conn:
         return pd.read_sql(q, conn, params=[good_id])
 
-@st.cache_data(show_spinner=False)
-def load_goods_flags(good_id: int) -> DataFrame:
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_import_by_year(good_id: int, rev=None) -> DataFrame:
+    """Итоги импорта по годам из ttr.import_by_year (обновляется parser.py при загрузке)."""
+    q = f"""
+    SELECT year, total_usd_mln, unfriendly_usd_mln, unfriendly_share_pct
+    FROM {DB_SCHEMA}.import_by_year
+    WHERE good_id = %s
+    ORDER BY year
+    """
+    with get_conn() as conn:
+        return pd.read_sql(q, conn, params=[good_id])
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_goods_flags(good_id: int, rev=None) -> DataFrame:
     q = f"SELECT good_id, in_techreg, in_pp1875, in_order4114 FROM {DB_SCHEMA}.goods_flags WHERE good_id = %s"
     with get_conn() as conn:
         return pd.read_sql(q, conn, params=[good_id])
@@ -650,7 +687,8 @@ def make_grounding_message(good_row, measures, summary):
 # =============================
 # Данные для страницы
 # =============================
-goods_df = load_goods_list()
+revisions = data_revisions()
+goods_df = load_goods_list(revisions.catalog_rev())
 if goods_df.empty:
     st.error("В БД нет товаров. Загрузите справочник ttr.goods.")
     st.stop()
@@ -660,11 +698,12 @@ selected_good = st.selectbox("Выберите товар:", goods_df["display"]
 good_id = int(goods_df.loc[goods_df["display"] == selected_good, "id"].iloc[0])
 good_row = goods_df.loc[goods_df["id"] == good_id].iloc[0]
 
-tariffs = load_tariffs(good_id)
-prod_df = load_series("production", good_id)
-cons_df = load_series("consumption", good_id)
-imp_df  = load_imports(good_id)
-flags   = load_goods_flags(good_id)
+rev = revisions.of(good_id)
+tariffs = load_tariffs(good_id, rev)
+prod_df = load_series("production", good_id, rev)
+cons_df = load_series("consumption", good_id, rev)
+imp_df  = load_imports(good_id, rev)
+flags   = load_goods_flags(good_id, rev)
 
 measures, summary = compute_recommendation(tariffs, prod_df, cons_df, imp_df, flags)
 
@@ -719,8 +758,13 @@ if section == "Дашборд":
     with right:
         st.markdown("#### Динамика импорта (млн $)")
         if len(imp_df):
-            imp_sum = imp_df.groupby("year", as_index=False)["value_usd_mln"].sum().rename(
-                columns={"value_usd_mln":"Импорт, млн $", "year":"Год"})
+            try:
+                imp_sum = load_import_by_year(good_id, rev)[["year", "total_usd_mln"]].rename(
+                    columns={"total_usd_mln":"Импорт, млн $", "year":"Год"})
+            except Exception:
+                # представление ещё не создано (parser.py не запускался после обновления)
+                imp_sum = imp_df.groupby("year", as_index=False)["value_usd_mln"].sum().rename(
+                    columns={"value_usd_mln":"Импорт, млн $", "year":"Год"})
             fig_imp = px.bar(imp_sum, x="Год", y="Импорт, млн $", title=None)
             st.plotly_chart(fig_imp, use_container_width=True)
         else:
@@ -5,6 +5,9 @@
 - import_values (поддержка листов с 'YYYY, млн $' и/или 'YYYY, тонны'; обход всех листов)
 - goods_flags (техрег/ПП1875/приказ 4114)
 - country_dict (Страна | Страна капс | Недружественная | Регион)
+- агрегаты импорта: материализованные представления import_by_year / import_by_country
+- бэктест мер по годам (ttr.backtest, ttr_core/backtest.py) для изменившихся товаров
+- уведомление подписчикам (LISTEN/NOTIFY, ttr_core/events.py) о товарах с новой версией данных
 
 Зависимости:
   pip install pandas psycopg2-binary openpyxl
@@ -14,6 +17,8 @@ import re
 import pandas as pd
 import psycopg2
 
+from ttr_core import store, analytics, events, backtest
+
 # ---------- КОНФИГ БД ----------
 DB = dict(host="localhost", port=5433, dbname="Hackaton", user="postgres", password="123")
 
@@ -232,15 +237,19 @@ def upsert_import_values(cur, good_id, items):
     return ins, upd
 
 def upsert_goods_flags(cur, good_id, in_techreg, in_pp1875, in_order4114):
+    """Возвращает 1, если флаги вставлены или изменились."""
     cur.execute("""
         INSERT INTO ttr.goods_flags(good_id, in_techreg, in_pp1875, in_order4114)
         VALUES (%s, %s, %s, %s)
         ON CONFLICT (good_id) DO UPDATE
         SET in_techreg=%s, in_pp1875=%s, in_order4114=%s, updated_at=now()
-        WHERE ttr.goods_flags.good_id=%s
+        WHERE (ttr.goods_flags.in_techreg, ttr.goods_flags.in_pp1875, ttr.goods_flags.in_order4114)
+              IS DISTINCT FROM (%s, %s, %s)
         RETURNING 1;
     """, (good_id, in_techreg, in_pp1875, in_order4114,
-          in_techreg, in_pp1875, in_order4114, good_id))
+          in_techreg, in_pp1875, in_order4114,
+          in_techreg, in_pp1875, in_order4114))
+    return 1 if cur.fetchone() else 0
 
 def upsert_country_dict(cur, df):
     """
@@ -350,8 +359,13 @@ def main():
         "flags_upd":0,
         "cd_ins":0,"cd_upd":0
     }
+    all_ids, changed_ids = [], set()
 
     try:
+        store.ensure_schema(cur)
+        analytics.ensure_schema(cur)
+        backtest.ensure_schema(cur)
+
         # страны
         if df_dict is not None:
             ins, upd = upsert_country_dict(cur, df_dict)
@@ -363,31 +377,65 @@ def main():
 
             gid, inserted = upsert_goods(cur, name, hs)
             total["goods_ins" if inserted else "goods_dup"] += 1
+            all_ids.append(gid)
+            changes = int(inserted)
 
             applied = norm_rate(row_applied[col])
             wto     = norm_rate(row_wto[col])
             ins, upd = upsert_tariffs(cur, gid, applied, wto)
             total["tariff_ins"] += ins; total["tariff_upd"] += upd
+            changes += ins + upd
 
             ins1, upd1 = upsert_series(cur, "production",  gid, parse_year_series_money(row_prod[col]))
             ins2, upd2 = upsert_series(cur, "consumption", gid, parse_year_series_money(row_cons[col]))
             total["prod_ins"] += ins1; total["prod_upd"] += upd1
             total["cons_ins"] += ins2; total["cons_upd"] += upd2
+            changes += ins1 + upd1 + ins2 + upd2
 
             # флаги «да/нет»
             to_bool = lambda x: str(x).strip().lower().startswith("д")
             in_tr   = to_bool(row_flag_tr[col])
             in_1875 = to_bool(row_flag_1875[col])
             in_4114 = to_bool(row_flag_4114[col])
-            upsert_goods_flags(cur, gid, in_tr, in_1875, in_4114)
-            total["flags_upd"] += 1
+            flags_changed = upsert_goods_flags(cur, gid, in_tr, in_1875, in_4114)
+            total["flags_upd"] += flags_changed
+            changes += flags_changed
 
             # импорт (млн $, тонны)
             ins, upd = upsert_import_values(cur, gid, imp_rows)
             total["imp_ins"] += ins; total["imp_upd"] += upd
+            changes += ins + upd
+
+            if changes:
+                changed_ids.add(gid)
 
+        # справочник стран влияет на группы стран в импорте — у всех товаров
+        if total["cd_ins"] or total["cd_upd"]:
+            changed_ids.update(all_ids)
+
+        # версия данных и агрегаты импорта меняются в той же транзакции, что и сами данные
+        versions = store.bump_versions(cur, changed_ids)
+        if changed_ids:
+            analytics.refresh_import_views(cur)
+        # подписчики (API, Streamlit) получат уведомление только после COMMIT
+        notified = events.notify_changed(cur, versions, catalog=total["goods_ins"] > 0)
         conn.commit()
 
+        # пересчёт материализованных рекомендаций (изменённые + устаревшие);
+        # данные уже закоммичены — при ошибке API досчитает рекомендации сам
+        try:
+            refreshed = store.refresh_recommendations(conn, changed_ids)
+        except Exception as e:
+            conn.rollback()
+            refreshed = []
+            print("\n⚠️ Рекомендации не пересчитаны:\n", e)
+        try:
+            backtested = backtest.refresh_backtest(conn, changed_ids)
+        except Exception as e:
+            conn.rollback()
+            backtested = []
+            print("\n⚠️ Бэктест не пересчитан (python -m ttr_core.backtest refresh):\n", e)
+
     except Exception as e:
         conn.rollback()
         print("\n❌ Ошибка, транзакция откатена:\n", e)
@@ -403,9 +451,12 @@ def main():
     print(f"production:    +{total['prod_ins']} inserted, ~{total['prod_upd']} updated")
     print(f"consumption:   +{total['cons_ins']} inserted, ~{total['cons_upd']} updated")
     print(f"imports:       +{total['imp_ins']} inserted, ~{total['imp_upd']} updated")
-    print(f"goods_flags:   ~{total['flags_upd']} upserted")
+    print(f"goods_flags:   ~{total['flags_upd']} changed")
     if df_dict is not None:
         print(f"country_dict:  +{total['cd_ins']} inserted, ~{total['cd_upd']} updated")
+    print(f"data_version:  ~{len(changed_ids)} goods bumped, {len(refreshed)} recommendations recomputed")
+    print(f"backtest:      {len(backtested)} goods recomputed")
+    print(f"notify:        {notified} message(s) on {events.DATA_CHANNEL}")
     print("==========================\n")
     print("✅ Готово.")
 
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# tests/conftest.py — общие данные для тестов: синтетическая схема ttr без PostgreSQL
+#
+# Запуск (из backend/):  python -m pytest -q tests
+
+import sys
+import random
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ttr_core.snapshot import Snapshot  # noqa: E402
+
+YEARS = (2021, 2022, 2023)
+GROUPS = ("unfriendly", "friendly", None)
+
+
+def synthetic_rows(n: int = 300, seed: int = 3) -> Dict[str, Any]:
+    """
+    Строки в том виде, в каком их отдаёт PostgreSQL (запросы ttr_core/snapshot.py TABLES):
+    goods — (id, hs_code, name, версия, updated_at, рекомендация или None), tables — по таблицам.
+    Есть товары без кода, без тарифа, без импорта, с пустым потреблением и с готовой рекомендацией.
+    """
+    rng = random.Random(seed)
+    base = datetime(2026, 5, 1, tzinfo=timezone.utc)
+    goods, T, P, C, I, F, Y, TOP = [], [], [], [], [], [], [], []
+    for k in range(n):
+        gid = k * 3 + 1
+        version = rng.randint(0, 4)
+        rec = ({"measures": ["Мера 1"], "summary": {"branch": "готовая"}, "grounding": "заземление"}
+               if k % 5 == 0 else None)
+        goods.append((gid, f"{8400 + k % 50} {k % 100:02d}" if k % 7 else None, f"Товар {k} станок",
+                      version, base + timedelta(seconds=k) if version else None, rec))
+        if rng.random() < .95:
+            applied = rng.choice([0.0, .05, .1])
+            T.append((gid, applied, rng.choice([applied, .1])))
+        for y in YEARS:
+            P.append((gid, y, rng.uniform(0, 100)))
+            C.append((gid, y, rng.uniform(0, 100) if rng.random() > .05 else None))
+            for i in range(rng.randint(0, 6)):
+                I.append((gid, y, f"c{i}", rng.uniform(0, 10), rng.uniform(0, 10), rng.choice(GROUPS)))
+            Y.append((gid, y, 1.0, 2.0, .5, .3, "value_usd_mln", 50.0, .1, None, None, None, 3))
+            for r in range(1, 8):
+                TOP.append((gid, y, f"c{r}", "friendly", 1.0, 2.0, 10.0, 5e5, r, 8 - r if r % 2 else None))
+        F.append((gid, rng.random() < .5, rng.random() < .5, False))
+    rng.shuffle(I)  # порядок строк import_values в БД не определён
+    tables = {"tariffs": T, "production": P, "consumption": C, "imports": I, "flags": F,
+              "import_years": Y, "import_tops": TOP}
+    return {"goods": goods, "tables": tables, "signature": (n, 0, 9, base)}
+
+
+def rows_of(table: List[tuple], good_id: int, columns: List[str]) -> List[Dict[str, Any]]:
+    """Строки товара словарями — как их собирает json_agg в BUNDLE_SQL (ttr_core/bundle.py)."""
+    return [dict(zip(columns, r[1:])) for r in table if r[0] == good_id]
+
+
+@pytest.fixture(scope="session")
+def rows() -> Dict[str, Any]:
+    return synthetic_rows()
+
+
+@pytest.fixture(scope="session")
+def snapshot(rows) -> Snapshot:
+    return Snapshot(rows["goods"], rows["tables"], rows["signature"])
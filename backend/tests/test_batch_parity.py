@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Пакетный расчёт (ttr_core/batch.py) и бэктест (ttr_core/backtest.py) побитово совпадают
+# со скалярной compute_recommendation.
+#
+# batch._numpy_sums повторяет внутренний порядок попарного суммирования numpy (8 полос,
+# блок 128), чтобы share_ns/delta_ns совпадали с Series.sum() до последнего бита. Если numpy
+# поменяет этот порядок, первым упадёт test_numpy_sums_match_series_sum.
+
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ttr_core import backtest
+from ttr_core.batch import _PW_BLOCK, _numpy_sums, compute_recommendations_batch, iter_recommendations
+from ttr_core.bundle import FLAG_COLUMNS, IMPORT_COLUMNS, SERIES_COLUMNS, TARIFF_COLUMNS
+from ttr_core.logic import compute_recommendation
+
+
+def portfolio(n: int, seed: int):
+    """Длинные таблицы с good_id, как BulkData: все ветки алгоритма, пропуски, нули, длинные годы."""
+    rng = random.Random(seed)
+    T, P, C, I, F = [], [], [], [], []
+    for gid in range(1, n + 1):
+        if rng.random() < .9:
+            applied = rng.choice([0.0, .05, .1])
+            T.append((gid, applied, rng.choice([applied, applied, .1, .15])))
+        for y in range(2014, 2025):
+            if rng.random() < .7:
+                P.append((gid, y, float(rng.randint(0, 100)) if rng.random() < .5 else rng.uniform(0, 100)))
+            if rng.random() < .7:
+                C.append((gid, y, rng.uniform(0, 100) if rng.random() > .05 else None))
+        for y in sorted(rng.sample(range(2015, 2025), rng.randint(0, 7))):
+            # изредка больше 128 стран в году — путь np.add.reduce в _numpy_sums
+            countries = rng.randint(130, 160) if rng.random() < .01 else rng.randint(1, 20)
+            for i in range(countries):
+                usd = rng.choice([0.0, rng.uniform(0, 10)]) if rng.random() < .3 else rng.uniform(0, 10)
+                I.append((gid, y, f"c{i}", usd, rng.choice([0.0, rng.uniform(0, 10)]),
+                          rng.choice(["unfriendly", "friendly", "unfriendly"])))
+        if rng.random() < .9:
+            F.append((gid, rng.random() < .5, rng.random() < .5, rng.random() < .3))
+    rng.shuffle(I)
+    rng.shuffle(P)
+    return {
+        "ids": list(range(1, n + 1)),
+        "tariffs": pd.DataFrame(T, columns=["good_id", *TARIFF_COLUMNS]),
+        "production": pd.DataFrame(P, columns=["good_id", *SERIES_COLUMNS]),
+        "consumption": pd.DataFrame(C, columns=["good_id", *SERIES_COLUMNS]),
+        "imports": pd.DataFrame(I, columns=["good_id", *IMPORT_COLUMNS]),
+        "flags": pd.DataFrame(F, columns=["good_id", *FLAG_COLUMNS]),
+    }
+
+
+@pytest.fixture(scope="module")
+def data():
+    return portfolio(600, seed=1)
+
+
+def scalar(data, gid, as_of=None):
+    """compute_recommendation по строкам товара (для бэктеста — P/C и импорт до года as_of)."""
+    def part(name, by_year=True):
+        df = data[name]
+        mask = df["good_id"] == gid
+        if as_of is not None and by_year:
+            mask &= df["year"] <= as_of
+        return df[mask].drop(columns="good_id").reset_index(drop=True)
+    return compute_recommendation(part("tariffs", False), part("production"), part("consumption"),
+                                  part("imports"), part("flags", False))
+
+
+def test_numpy_sums_match_series_sum():
+    rng = np.random.default_rng(7)
+    lengths = np.r_[np.arange(0, 2 * _PW_BLOCK + 20), rng.integers(0, 400, 200)]
+    values = rng.uniform(0, 1e3, (int(lengths.sum()), 2)) * rng.choice([1e-6, 1.0, 1e6], (int(lengths.sum()), 1))
+    starts = np.cumsum(lengths) - lengths
+    got = _numpy_sums(values, starts, lengths)
+    for s, m, row in zip(starts, lengths, got):
+        # эталон — то, что делает скалярный путь: Series.sum() по колонке строк товара за год
+        expected = [pd.Series(values[s:s + m, j]).sum() for j in range(values.shape[1])]
+        assert row.tolist() == expected, f"длина отрезка {m}"
+
+
+def test_batch_matches_scalar(data):
+    result = compute_recommendations_batch(data["ids"], data["tariffs"], data["production"],
+                                           data["consumption"], data["imports"], data["flags"])
+    branches = set()
+    for gid, measures, summary in iter_recommendations(result):
+        assert (measures, summary) == scalar(data, gid), gid
+        branches.add(summary["branch"])
+    assert len(branches) >= 6  # данные действительно проходят по разным веткам
+
+
+def test_backtest_matches_scalar_on_truncated_data(data):
+    result = backtest.backtest_batch(data["ids"], data["tariffs"], data["production"],
+                                     data["consumption"], data["imports"], data["flags"])
+    pairs = [(gid, r) for gid, items in backtest.rows_of(result).items() for r in items]
+    for gid, r in random.Random(5).sample(pairs, min(400, len(pairs))):
+        measures, summary = scalar(data, gid, as_of=r["year"])
+        assert (r["measures"], r["summary"]) == (measures, summary), (gid, r["year"])
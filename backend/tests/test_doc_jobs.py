@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# POST /api/docs/jobs: выборка по hs_prefix больше DOC_JOB_MAX_GOODS — 413 при постановке,
+# как у длинного списка ids; принятое задание собирает ровно отобранные товары.
+
+import asyncio
+
+import httpx
+import pytest
+
+from ttr_core import offline
+
+LIMIT = 10
+
+
+@pytest.fixture
+def api_app(snapshot, tmp_path, monkeypatch):
+    import api
+
+    path = tmp_path / "ttr_bundle.sqlite"
+    offline.write_bundle(snapshot, path)
+    monkeypatch.setattr(api, "OFFLINE_BUNDLE", str(path))
+    monkeypatch.setattr(api, "DOC_JOB_MAX_GOODS", LIMIT)
+    return api
+
+
+def submit(api, body):
+    async def scenario():
+        async with api.app.router.lifespan_context(api.app):
+            transport = httpx.ASGITransport(app=api.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                r = await client.post("/api/docs/jobs", json=body)
+            job = api.doc_jobs.get(r.json()["job_id"]) if r.status_code == 202 else None
+            if job is not None:
+                api.doc_jobs._tasks[job.id].cancel()  # сами документы здесь не нужны
+            return r, job
+    return asyncio.run(scenario())
+
+
+def test_hs_prefix_over_limit_is_rejected(api_app, snapshot):
+    assert len(snapshot.goods_index(None, "84")) > LIMIT
+    r, job = submit(api_app, {"hs_prefix": "84"})
+    assert r.status_code == 413 and job is None
+    assert str(LIMIT) in r.json()["detail"]
+    r, _ = submit(api_app, {"ids": snapshot.ids.tolist()[:LIMIT + 1]})
+    assert r.status_code == 413
+
+
+def test_accepted_job_gets_counted_selection(api_app, snapshot):
+    expected = snapshot.goods_index(None, "8401")["id"].tolist()
+    assert 0 < len(expected) <= LIMIT
+    r, job = submit(api_app, {"hs_prefix": "84 01", "kinds": ["report"]})
+    assert r.status_code == 202
+    assert job.goods == expected
+
+
+@pytest.mark.parametrize("body", [{}, {"ids": ["x"]}, {"ids": [1], "kinds": ["fax"]}])
+def test_bad_request_messages_are_russian(api_app, body):
+    r, _ = submit(api_app, body)
+    assert r.status_code == 400
+    assert any("а" <= ch <= "я" for ch in r.json()["detail"].lower())
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Нагрузочный тест api.py: дашборд отвечает быстро, пока в работе десятки запросов к чату.
+#
+# Приложение — в том же процессе (httpx.AsyncClient + ASGITransport), данные — из файла-выгрузки
+# (автономный режим), LLM подменён: chat_completion_async просто ждёт CHAT_DELAY_S. Ожидание
+# ответа модели не должно занимать event loop и потоки, поэтому p95 дашборда при LOAD_CHATS
+# висящих чатах остаётся в пределах DASHBOARD_P95_S. Заодно проверяется допуск к LLM
+# (ttr_core/admission.py): не больше LLM_MAX_CONCURRENCY генераций, очередь, 429 и 503.
+#
+#   LOAD_CHATS=60 CHAT_DELAY_S=2 python -m pytest -q tests/test_load.py   # тяжелее
+
+import os
+import time
+import asyncio
+
+import httpx
+import pytest
+
+from ttr_core import offline
+
+LOAD_CHATS = int(os.environ.get("LOAD_CHATS", "36"))             # одновременных чатов
+CHAT_DELAY_S = float(os.environ.get("CHAT_DELAY_S", "0.5"))      # «генерация» подменённой модели
+DASHBOARDS = int(os.environ.get("LOAD_DASHBOARDS", "60"))        # запросов дашборда под нагрузкой
+DASHBOARD_P95_S = float(os.environ.get("DASHBOARD_P95_S", "0.25"))
+
+
+def p95(values):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+@pytest.fixture
+def api_app(snapshot, tmp_path, monkeypatch):
+    """api.app в автономном режиме на синтетическом снимке, с подменённой моделью и свежим допуском."""
+    import api
+    from ttr_core.admission import AdmissionController
+
+    path = tmp_path / "ttr_bundle.sqlite"
+    offline.write_bundle(snapshot, path)
+    monkeypatch.setattr(api, "OFFLINE_BUNDLE", str(path))
+
+    async def slow_model(messages, **kwargs):
+        await asyncio.sleep(CHAT_DELAY_S)
+        return "Рекомендуется применить меры, указанные в справке."
+
+    monkeypatch.setattr(api, "chat_completion_async", slow_model)
+    queue = max(0, LOAD_CHATS - api.LLM_MAX_CONCURRENCY)
+    monkeypatch.setattr(api, "llm_admission", AdmissionController(
+        api.LLM_MAX_CONCURRENCY, queue, api.LLM_MAX_PER_CLIENT, timeout=60))
+    return api
+
+
+async def _run(app, scenario):
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+            return await scenario(client)
+
+
+def chat(client, good_id: int, client_id: str):
+    return client.post(f"/api/goods/{good_id}/chat", json={"question": "Какие меры применить?",
+                                                           "deterministic": False},
+                       headers={"X-Client-Id": client_id})
+
+
+def test_dashboard_stays_responsive_while_chats_pending(api_app, snapshot):
+    ids = snapshot.ids.tolist()
+
+    async def scenario(client):
+        chats = [asyncio.create_task(chat(client, ids[k % len(ids)], f"user-{k}")) for k in range(LOAD_CHATS)]
+        await asyncio.sleep(0.05)  # чаты разобраны: активные генерации + очередь
+        admission = api_app.llm_admission.stats()
+        latencies = []
+        for k in range(DASHBOARDS):
+            t0 = time.perf_counter()
+            r = await client.get(f"/api/goods/{ids[(k * 7) % len(ids)]}/dashboard")
+            latencies.append(time.perf_counter() - t0)
+            assert r.status_code == 200
+        pending = sum(not t.done() for t in chats)
+        responses = await asyncio.gather(*chats)
+        return admission, latencies, pending, responses
+
+    admission, latencies, pending, responses = asyncio.run(_run(api_app.app, scenario))
+
+    assert admission["active"] == api_app.LLM_MAX_CONCURRENCY
+    assert admission["queued"] == LOAD_CHATS - api_app.LLM_MAX_CONCURRENCY
+    assert pending > 0, "чаты закончились раньше дашбордов — нагрузка не проверена"
+    assert p95(latencies) < DASHBOARD_P95_S, f"p95 дашборда {p95(latencies):.3f} c при {pending} чатах в работе"
+    assert [r.status_code for r in responses] == [200] * LOAD_CHATS
+    assert api_app.llm_admission.stats()["active_peak"] == api_app.LLM_MAX_CONCURRENCY
+
+
+def test_admission_rejects_over_queue_and_per_client(api_app, snapshot):
+    good_id = snapshot.ids.tolist()[0]
+    limit = api_app.LLM_MAX_PER_CLIENT
+
+    async def scenario(client):
+        # один клиент: сверх LLM_MAX_PER_CLIENT — сразу 429
+        own = [asyncio.create_task(chat(client, good_id, "greedy")) for _ in range(limit)]
+        await asyncio.sleep(0.05)
+        greedy = await chat(client, good_id, "greedy")
+        # разные клиенты: сверх активных + очереди — сразу 503
+        others = [asyncio.create_task(chat(client, good_id, f"user-{k}")) for k in range(LOAD_CHATS)]
+        await asyncio.sleep(0.05)
+        t0 = time.perf_counter()
+        overflow = await chat(client, good_id, "late")
+        reject_s = time.perf_counter() - t0
+        return greedy, overflow, reject_s, await asyncio.gather(*own, *others)
+
+    greedy, overflow, reject_s, responses = asyncio.run(_run(api_app.app, scenario))
+
+    assert greedy.status_code == 429 and int(greedy.headers["Retry-After"]) >= 1
+    assert overflow.status_code == 503 and int(overflow.headers["Retry-After"]) >= 1
+    assert reject_s < CHAT_DELAY_S  # отказ без ожидания слота
+    codes = [r.status_code for r in responses]
+    assert codes.count(200) == LOAD_CHATS and set(codes) <= {200, 503}
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# Автономный режим (ttr_core/offline.py): файл-выгрузка отдаёт те же данные, что PostgreSQL.
+#
+# Эталон «как из БД» — те же функции, что у PostgreSQL-пути api.py: bundle_from_row (BUNDLE_SQL),
+# store.compute_for_bundle (рекомендация по запросу), analytics._summaries (агрегаты импорта),
+# GoodsIndex по строкам справочника. Снимок пишется в файл, читается обратно и сравнивается
+# и с исходным снимком, и с эталоном; SQL загрузчиков app.py выполняется через offline.connect.
+
+import ast
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from conftest import rows_of
+from ttr_core import analytics, offline, store
+from ttr_core.bundle import FLAG_COLUMNS, IMPORT_COLUMNS, SERIES_COLUMNS, TARIFF_COLUMNS, bundle_from_row
+from ttr_core.search import GoodsIndex
+
+FRAMES = ("tariffs", "production", "consumption", "imports", "flags")
+APP_PY = Path(__file__).resolve().parent.parent / "app.py"
+
+
+@pytest.fixture(scope="module")
+def bundle_path(snapshot, tmp_path_factory) -> Path:
+    path = tmp_path_factory.mktemp("offline") / "ttr_bundle.sqlite"
+    offline.write_bundle(snapshot, path)
+    return path
+
+
+@pytest.fixture(scope="module")
+def loaded(bundle_path):
+    return offline.load_bundle(bundle_path)
+
+
+def reference_bundle(rows, good):
+    """Товар так, как его собирает load_good_bundle из строки BUNDLE_SQL."""
+    gid, hs, name, version, updated_at, rec = good
+    t = rows["tables"]
+    return bundle_from_row({"id": gid, "hs_code": hs, "name": name},
+                           rows_of(t["tariffs"], gid, TARIFF_COLUMNS),
+                           rows_of(t["production"], gid, SERIES_COLUMNS),
+                           rows_of(t["consumption"], gid, SERIES_COLUMNS),
+                           rows_of(t["imports"], gid, IMPORT_COLUMNS),
+                           rows_of(t["flags"], gid, FLAG_COLUMNS),
+                           version, rec, updated_at)
+
+
+def records(df: pd.DataFrame):
+    """Значения без оглядки на dtype: json из БД даёт object/None там, где снимок — float/NaN."""
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+def test_bundle_roundtrip_is_lossless(snapshot, loaded):
+    assert loaded.signature == snapshot.signature
+    assert loaded.catalog_signature == snapshot.catalog_signature
+    for gid in snapshot.ids.tolist():
+        a, b = snapshot.bundle(gid), loaded.bundle(gid)
+        assert (a.good, a.data_version, a.updated_at) == (b.good, b.data_version, b.updated_at)
+        assert vars(a.recommendation) == vars(b.recommendation)
+        for name in FRAMES:
+            pd.testing.assert_frame_equal(getattr(a, name), getattr(b, name), obj=f"{gid}.{name}")
+
+
+def test_bundles_match_postgres_path(rows, loaded):
+    for good in rows["goods"]:
+        ref, got = reference_bundle(rows, good), loaded.bundle(good[0])
+        assert got.good == ref.good
+        assert (got.data_version, got.updated_at) == (ref.data_version, ref.updated_at)
+        for name in FRAMES:
+            assert records(getattr(got, name)) == records(getattr(ref, name)), (good[0], name)
+
+
+def test_recommendations_match_postgres_path(rows, loaded):
+    # готовые — как сохранены, недостающие — как посчитал бы api.fetch_recommendation
+    for good in rows["goods"]:
+        ref = reference_bundle(rows, good)
+        expected = ref.recommendation or store.compute_for_bundle(ref)
+        assert vars(loaded.bundle(good[0]).recommendation) == vars(expected), good[0]
+
+
+@pytest.mark.parametrize("top", [1, 3, 5])
+def test_import_summaries_match_postgres_path(rows, snapshot, loaded, top):
+    ids = [g[0] for g in rows["goods"]]
+    t = rows["tables"]
+    # TOP_SQL: value_rank <= top OR skc_rank <= top
+    tops = [r for r in t["import_tops"] if r[8] <= top or (r[9] is not None and r[9] <= top)]
+    expected = analytics._summaries(ids, t["import_years"], tops, top)
+    assert loaded.import_summaries(ids, top) == expected
+    assert snapshot.import_summaries(ids, top) == expected
+
+
+def test_import_rows_match(snapshot, loaded):
+    for gid in snapshot.ids.tolist()[:100]:
+        for year, group in ((None, None), (2022, None), (None, "unfriendly")):
+            assert loaded.import_rows(gid, year, group, 1000, 0) == snapshot.import_rows(gid, year, group, 1000, 0)
+
+
+@pytest.mark.parametrize("ids,hs_prefix", [(None, None), (None, "84"), (None, "8412"), ([1, 4, 7, 10_000], None),
+                                           ([1, 4, 7], "8400"), (None, "%"), (None, "84_")])
+def test_goods_index_matches(snapshot, loaded, ids, hs_prefix):
+    pd.testing.assert_frame_equal(loaded.goods_index(ids, hs_prefix), snapshot.goods_index(ids, hs_prefix))
+    if hs_prefix and hs_prefix.strip("%_") != hs_prefix:
+        # префикс буквальный, как starts_with в GOODS_INDEX_SQL: «%» и «_» — не шаблоны
+        assert loaded.goods_index(ids, hs_prefix).empty
+
+
+@pytest.mark.parametrize("query", ["станок", "Товар 12", "8401", "84 0", "нет такого"])
+def test_search_matches(rows, loaded, query):
+    # api.goods_search_index строит индекс по SELECT id, hs_code, name FROM ttr.goods
+    expected = GoodsIndex([g[:3] for g in rows["goods"]]).search(query, limit=50)
+    assert GoodsIndex(loaded.goods_rows()).search(query, limit=50) == expected
+
+
+def app_loader_queries():
+    """SQL загрузчиков app.py (q = f"..." внутри load_*) с DB_SCHEMA = ttr, без импорта Streamlit."""
+    tree = ast.parse(APP_PY.read_text(encoding="utf-8"))
+    queries = {}
+    for fn in tree.body:
+        if isinstance(fn, ast.FunctionDef) and fn.name.startswith("load_"):
+            for node in ast.walk(fn):
+                if isinstance(node, ast.Assign) and getattr(node.targets[0], "id", None) == "q":
+                    code = compile(ast.Expression(node.value), str(APP_PY), "eval")
+                    queries[fn.name] = eval(code, {"DB_SCHEMA": "ttr", "table": "{table}"})
+    return queries
+
+
+def test_app_loader_sql_runs_offline(rows, bundle_path):
+    queries = app_loader_queries()
+    assert {"load_goods_list", "load_tariffs", "load_series", "load_imports", "load_goods_flags"} <= set(queries)
+    t = rows["tables"]
+    conn = offline.connect(bundle_path)
+    try:
+        goods = pd.read_sql(queries["load_goods_list"], conn)
+        assert sorted(goods["id"].tolist()) == sorted(g[0] for g in rows["goods"])
+        assert goods["name"].tolist() == sorted(goods["name"].tolist())
+
+        for good in rows["goods"][:60]:
+            gid = good[0]
+            ref = reference_bundle(rows, good)
+            tariffs = pd.read_sql(queries["load_tariffs"], conn, params=[gid])
+            assert records(tariffs[TARIFF_COLUMNS]) == records(ref.tariffs)
+            for table in ("production", "consumption"):
+                series = pd.read_sql(queries["load_series"].format(table=table), conn, params=[gid])
+                assert records(series) == records(getattr(ref, table))
+            imports = pd.read_sql(queries["load_imports"], conn, params=[gid])
+            assert records(imports) == records(ref.imports)
+            flags = pd.read_sql(queries["load_goods_flags"], conn, params=[gid])
+            assert records(flags[FLAG_COLUMNS]) == records(ref.flags)
+            assert all(isinstance(v, bool) for v in flags[FLAG_COLUMNS].iloc[0])  # BOOLEAN, а не 0/1
+
+        by_year = pd.read_sql(queries["load_import_by_year"], conn, params=[rows["goods"][0][0]])
+        assert by_year["year"].tolist() == list(sorted(by_year["year"]))
+    finally:
+        conn.close()
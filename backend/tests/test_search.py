@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Поиск по названию (ttr_core/search.py): страницы с разным offset режут один порядок.
+
+import random
+
+import numpy as np
+import pytest
+
+from ttr_core.search import GoodsIndex, trigrams
+
+
+@pytest.fixture(scope="module")
+def index():
+    # много одинаково оцениваемых названий — как «Прочие …» в справочнике
+    rng = random.Random(11)
+    words = ["машины", "части", "изделия", "оборудование", "станки", "прочие"]
+    goods = [(k * 7 + 3, f"{8400 + k % 90}", " ".join(["Прочие", *rng.sample(words, rng.randint(1, 3))]))
+             for k in range(3000)]
+    rng.shuffle(goods)
+    return GoodsIndex(goods)
+
+
+def reference(index, query):
+    """Полная сортировка всех кандидатов: оценка ↓, Дайс ↓, позиция ↑."""
+    grams = trigrams(query)
+    hits = []
+    for k, (_, _, name) in enumerate(index.goods):
+        common = len(set(grams) & set(trigrams(name)))
+        if common and common >= 0.5 * len(grams):
+            hits.append((-common / len(grams), -2.0 * common / (len(grams) + index._sizes[k]), k))
+    return [index.goods[k][0] for *_, k in sorted(hits)]
+
+
+@pytest.mark.parametrize("query", ["прочие", "прочие машины", "чати"])
+def test_pages_are_disjoint_and_cover_the_full_result(index, query):
+    full = index.search(query, limit=len(index))
+    ids = [item["id"] for item in full["items"]]
+    assert ids == reference(index, query) and full["total"] == len(ids)
+    assert len(ids) > 200
+
+    pages = [index.search(query, limit=20, offset=offset)["items"] for offset in range(0, 200, 20)]
+    walked = [item["id"] for page in pages for item in page]
+    assert len(set(walked)) == len(walked) == 200
+    assert walked == ids[:200]
+    assert all(np.diff([-item["score"] for page in pages for item in page]) >= 0)
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Холодный старт API (ttr_core/startup.py): импорт api укладывается в бюджет и не загружает
+# зависимости, нужные только отдельным эндпоинтам (startup.LAZY_MODULES).
+#
+#   STARTUP_BUDGET_S=4 python -m pytest -q tests/test_startup.py   # медленная машина CI
+
+import pytest
+
+from ttr_core import startup
+
+
+@pytest.fixture(scope="module")
+def timing():
+    # чистый процесс, лучший из трёх запусков — как у python -m ttr_core.startup
+    return startup.measure_import("api", repeat=3)
+
+
+def test_api_cold_start_within_budget(timing):
+    assert timing["import_s"] <= startup.STARTUP_BUDGET_S, (
+        f"import api {timing['import_s']:.3f} c > бюджета {startup.STARTUP_BUDGET_S:.3f} c "
+        f"(разбивка: python -m ttr_core.startup)")
+
+
+def test_api_import_keeps_lazy_modules_unloaded(timing):
+    assert timing["lazy_loaded"] == []
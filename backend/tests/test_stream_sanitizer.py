@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Потоковые фильтры ответа (ttr_core/logic.py StreamSanitizer) совпадают с пакетными:
+# clamp_measures_in_text(sanitize_ai(text), measures) при любой нарезке потока на куски,
+# в том числе для длинного текста без границ предложений (разрез по пробелу). Если сработал
+# лимит слов, пакетная обрезка склеивает слова через пробел — там сравниваем слова.
+
+import random
+
+import pytest
+
+from ttr_core.logic import MAX_WORDS_DEFAULT, StreamSanitizer, clamp_measures_in_text, sanitize_ai
+
+WORDS = ("рекомендуется", "применить", "пошлину", "импорт", "снизился", "доля", "выросла", "рынка",
+         "производство", "внутреннее", "потребление", "стран", "тарифа", "%", "—", "2023", "млн", "USD")
+# шаблоны, которые разрыв по пробелу мог бы разрезать: запретные фразы и меры вне списка
+TRAPS = ("указ президента", "Мера 7", "Мера 12", "Мера 3", "постановление правительства",
+         "согласно данным из БД", "вне текста", "Данные, использованы в расчёте", "документ [3]",
+         "номер 4.2.1.3", "Мера\n7", "указ\nпрезидента")
+MEASURES = ["Мера 2", "Мера 5"]
+
+
+def text_of(rng: random.Random, words: int, boundaries: bool) -> str:
+    out = []
+    for _ in range(words):
+        out.append(rng.choice(TRAPS) if rng.random() < .01 else rng.choice(WORDS))
+        if boundaries and rng.random() < .08:
+            out[-1] += rng.choice([".", "!", "?", ".\n", "\n"])
+    return " ".join(out)
+
+
+def streamed(text: str, rng: random.Random, sizes) -> str:
+    san = StreamSanitizer(MEASURES)
+    out, pos = [], 0
+    while pos < len(text) and not san.stopped:
+        step = rng.randint(*sizes)
+        out.append(san.feed(text[pos:pos + step]))
+        pos += step
+    out.append(san.finish())
+    return "".join(out)
+
+
+def batch(text: str) -> str:
+    return clamp_measures_in_text(sanitize_ai(text), MEASURES)
+
+
+@pytest.mark.parametrize("boundaries", [False, True])
+@pytest.mark.parametrize("sizes", [(1, 4), (1, 40), (5, 200)])
+def test_stream_matches_batch(boundaries, sizes):
+    rng = random.Random(f"{boundaries}{sizes}")
+    for case in range(300):
+        text = text_of(rng, rng.randint(60, MAX_WORDS_DEFAULT + 40), boundaries)
+        got, expected = streamed(text, rng, sizes), batch(text)
+        if len(text.split()) > MAX_WORDS_DEFAULT:
+            got, expected = got.split(), expected.split()
+        assert got == expected, (case, text)
+
+
+@pytest.mark.parametrize("trap", ["указ президента", "Мера 7"])
+def test_long_prefix_without_boundary(trap):
+    # разрез по пробелу в запасном пути попадал внутрь шаблона при префиксе ~306–319 символов
+    for prefix_len in range(280, 340):
+        prefix = ("доля импорта " * 40)[:prefix_len].rstrip() + " "
+        text = prefix + trap + " " + "импорт вырос " * 20
+        for seed in range(4):
+            assert streamed(text, random.Random(seed), (1, 4)) == batch(text), (prefix_len, seed)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# ttr_core/admission.py — допуск запросов к LLM: ограничение параллельности и очередь
+#
+# Локальный LLM-сервер резко деградирует, если генераций одновременно больше нескольких.
+# AdmissionController держит не больше limit активных запросов; остальные ждут
+# в ограниченной очереди. Очередь справедливая: свободный слот достаётся клиентам
+# по кругу (round-robin), поэтому один клиент с пачкой вопросов не задерживает других.
+# Отказ — сразу, без ожидания:
+#   429 — у клиента уже max_per_client запросов (активных + в очереди);
+#   503 — очередь заполнена или слот не освободился за timeout.
+# В обоих случаях — оценка Retry-After по среднему времени генерации и глубине очереди.
+
+import math
+import time
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Any, Optional
+
+
+class Overloaded(Exception):
+    """Запрос не допущен: status_code (429/503) и рекомендуемый Retry-After, с."""
+
+    def __init__(self, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class Slot:
+    """Занятый слот; release() идемпотентен — можно звать и из finally, и из фоновой задачи."""
+
+    def __init__(self, owner: "AdmissionController", client: str, waited: float):
+        self._owner = owner
+        self.client = client
+        self.waited = waited
+        self.started = time.perf_counter()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._owner._release(self)
+
+    async def __aenter__(self) -> "Slot":
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class AdmissionController:
+    """
+    acquire(client) → Slot (или Overloaded). Только для одного event loop (asyncio);
+    состояние меняется без await между проверкой и изменением, поэтому без замков.
+    """
+
+    def __init__(self, limit: int, max_queue: int, max_per_client: int, timeout: float,
+                 stats_window: int = 500):
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.max_per_client = max(1, max_per_client)
+        self.timeout = timeout
+        self._active = 0
+        self._queued = 0
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {}
+        self._turns: Deque[str] = deque()            # очередность клиентов для round-robin
+        self._load: Dict[str, int] = {}              # активные + ожидающие по клиенту
+        self._service_avg: Optional[float] = None    # EMA длительности генерации, с
+        self._wait_s: Deque[float] = deque(maxlen=stats_window)
+        self._stats = {"admitted": 0, "queued_total": 0, "queued_peak": 0, "active_peak": 0,
+                       "rejected_client": 0, "rejected_queue_full": 0, "timeouts": 0}
+
+    # ---------- оценка ожидания ----------
+    def retry_after(self) -> int:
+        per_slot = self._service_avg or 5.0
+        return max(1, min(120, math.ceil(per_slot * (self._queued + 1) / self.limit)))
+
+    def _reject(self, status: int, counter: str, detail: str):
+        self._stats[counter] += 1
+        raise Overloaded(status, self.retry_after(), detail)
+
+    # ---------- допуск ----------
+    async def acquire(self, client: str) -> Slot:
+        if self._load.get(client, 0) >= self.max_per_client:
+            self._reject(429, "rejected_client",
+                         f"слишком много одновременных запросов клиента (max {self.max_per_client})")
+        if self._active < self.limit and not self._queued:
+            return self._admit(client, 0.0)
+        if self._queued >= self.max_queue:
+            self._reject(503, "rejected_queue_full", f"очередь к LLM заполнена ({self.max_queue})")
+
+        fut = asyncio.get_running_loop().create_future()
+        if client not in self._waiters:
+            self._waiters[client] = deque()
+            self._turns.append(client)
+        self._waiters[client].append(fut)
+        self._load[client] = self._load.get(client, 0) + 1
+        self._queued += 1
+        self._stats["queued_total"] += 1
+        self._stats["queued_peak"] = max(self._stats["queued_peak"], self._queued)
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait_for(fut, self.timeout)
+        except BaseException as e:
+            granted = fut.done() and not fut.cancelled()
+            self._drop_waiter(client, fut)
+            if granted:
+                # слот выдан в тот же момент, когда ожидание прервали, — отдаём следующему
+                self._finish()
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(503, "timeouts", f"LLM занята: слот не освободился за {self.timeout:.0f} c")
+            raise
+        waited = time.perf_counter() - t0
+        self._wait_s.append(waited)
+        self._stats["admitted"] += 1
+        return Slot(self, client, waited)
+
+    def _admit(self, client: str, waited: float) -> Slot:
+        self._active += 1
+        self._load[client] = self._load.get(client, 0) + 1
+        self._stats["admitted"] += 1
+        self._stats["active_peak"] = max(self._stats["active_peak"], self._active)
+        self._wait_s.append(waited)
+        return Slot(self, client, waited)
+
+    def _drop_waiter(self, client: str, fut: asyncio.Future):
+        """Снимает заявку: из очереди (если она ещё там) и из нагрузки клиента."""
+        q = self._waiters.get(client)
+        if q is not None and fut in q:
+            q.remove(fut)
+            self._queued -= 1
+            if not q:
+                del self._waiters[client]
+                self._turns.remove(client)
+        self._load[client] -= 1
+        self._cleanup(client)
+
+    def _cleanup(self, client: str):
+        if self._load.get(client, 1) <= 0:
+            del self._load[client]
+
+    # ---------- освобождение ----------
+    def _release(self, slot: Slot):
+        duration = time.perf_counter() - slot.started
+        self._service_avg = duration if self._service_avg is None else 0.8 * self._service_avg + 0.2 * duration
+        self._load[slot.client] -= 1
+        self._cleanup(slot.client)
+        self._finish()
+
+    def _finish(self):
+        """Слот свободен: передаём его следующему клиенту по кругу (или уменьшаем active)."""
+        while self._turns:
+            nxt = self._turns.popleft()
+            q = self._waiters[nxt]
+            fut = q.popleft()
+            self._queued -= 1
+            if q:
+                self._turns.append(nxt)   # у клиента есть ещё запросы — в конец круга
+            else:
+                del self._waiters[nxt]
+            if fut.done():
+                continue                  # ожидание уже прервано (таймаут, отмена)
+            fut.set_result(True)          # слот переходит ожидающему: active не меняется
+            return
+        self._active -= 1
+
+    # ---------- метрики ----------
+    def stats(self) -> Dict[str, Any]:
+        waits = list(self._wait_s)
+        return {
+            **self._stats,
+            "limit": self.limit,
+            "active": self._active,
+            "queued": self._queued,
+            "max_queue": self.max_queue,
+            "max_per_client": self.max_per_client,
+            "clients": len(self._load),
+            "clients_waiting": len(self._waiters),
+            "wait_p50_s": _percentile(waits, 0.50),
+            "wait_p95_s": _percentile(waits, 0.95),
+            "wait_max_s": max(waits) if waits else None,
+            "service_avg_s": self._service_avg,
+            "retry_after_s": self.retry_after(),
+        }
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# ttr_core/analytics.py — предагрегированная аналитика импорта
+#
+# Вместо того чтобы отдавать все строки (год, страна) и агрегировать их на клиенте
+# (фронтенд, app.py), агрегаты хранятся в материализованных представлениях:
+#   ttr.import_by_year    — по (товар, год): импорт всего, из недружественных стран,
+#                           доля НС, изменения к прошлому году;
+#   ttr.import_by_country — по (товар, год, страна): стоимость, тонны, доля страны,
+#                           СКЦ ($/т) и места в рейтингах по стоимости и по СКЦ.
+# parser.py обновляет их в транзакции загрузки (refresh_import_views) — агрегаты
+# всегда соответствуют той же версии данных, что и ttr.data_version.
+# Исходные строки доступны постранично (load_import_rows_async).
+
+from typing import Dict, Any, List, Optional, Sequence
+
+from ttr_core.db import DB_SCHEMA
+
+IMPORT_VIEWS = ("import_by_year", "import_by_country")
+
+SCHEMA_SQL = f"""
+CREATE MATERIALIZED VIEW IF NOT EXISTS {DB_SCHEMA}.import_by_year AS
+WITH y AS (
+    SELECT good_id, year,
+           sum(COALESCE(value_usd_mln, 0))::float8 AS total_usd_mln,
+           sum(COALESCE(value_tons, 0))::float8    AS total_tons,
+           COALESCE(sum(COALESCE(value_usd_mln, 0)) FILTER (WHERE country_group = 'unfriendly'), 0)::float8
+               AS unfriendly_usd_mln,
+           COALESCE(sum(COALESCE(value_tons, 0)) FILTER (WHERE country_group = 'unfriendly'), 0)::float8
+               AS unfriendly_tons,
+           count(DISTINCT country) AS countries
+    FROM {DB_SCHEMA}.import_values
+    GROUP BY good_id, year
+)
+SELECT y.good_id, y.year, y.total_usd_mln, y.total_tons, y.unfriendly_usd_mln, y.unfriendly_tons,
+       -- метрика как в алгоритме мер (choose_metric): млн $, если за год есть стоимость, иначе тонны
+       CASE WHEN y.total_usd_mln > 0 THEN 'value_usd_mln' ELSE 'value_tons' END AS metric_used,
+       CASE WHEN y.total_usd_mln > 0 THEN 100.0 * y.unfriendly_usd_mln / y.total_usd_mln
+            WHEN y.total_tons > 0    THEN 100.0 * y.unfriendly_tons / y.total_tons
+            ELSE 0.0 END AS unfriendly_share_pct,
+       -- изменение импорта из НС к прошлому году (= summary.delta_ns; нет прошлого года — от нуля)
+       CASE WHEN y.total_usd_mln > 0 THEN y.unfriendly_usd_mln - COALESCE(p.unfriendly_usd_mln, 0)
+            ELSE y.unfriendly_tons - COALESCE(p.unfriendly_tons, 0) END AS unfriendly_delta,
+       y.total_usd_mln - p.total_usd_mln AS total_delta_usd_mln,
+       100.0 * (y.total_usd_mln - p.total_usd_mln) / NULLIF(p.total_usd_mln, 0) AS total_yoy_pct,
+       y.total_tons - p.total_tons AS total_delta_tons,
+       y.countries
+FROM y
+LEFT JOIN y p ON p.good_id = y.good_id AND p.year = y.year - 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS import_by_year_pk ON {DB_SCHEMA}.import_by_year(good_id, year);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS {DB_SCHEMA}.import_by_country AS
+WITH c AS (
+    SELECT good_id, year, country,
+           max(country_group) AS country_group,   -- 'unfriendly' > 'friendly', как в app.py
+           sum(COALESCE(value_usd_mln, 0))::float8 AS value_usd_mln,
+           sum(COALESCE(value_tons, 0))::float8    AS value_tons
+    FROM {DB_SCHEMA}.import_values
+    GROUP BY good_id, year, country
+)
+SELECT c.good_id, c.year, c.country, c.country_group, c.value_usd_mln, c.value_tons,
+       100.0 * c.value_usd_mln / NULLIF(sum(c.value_usd_mln) OVER w, 0) AS share_pct,
+       CASE WHEN c.value_tons > 0 THEN c.value_usd_mln * 1000000 / c.value_tons END AS skc_usd_per_ton,
+       row_number() OVER (w ORDER BY c.value_usd_mln DESC, c.country) AS value_rank,
+       CASE WHEN c.value_tons > 0 THEN
+           row_number() OVER (PARTITION BY c.good_id, c.year, c.value_tons > 0
+                              ORDER BY c.value_usd_mln / NULLIF(c.value_tons, 0) DESC, c.country)
+       END AS skc_rank
+FROM c
+WINDOW w AS (PARTITION BY c.good_id, c.year);
+
+CREATE UNIQUE INDEX IF NOT EXISTS import_by_country_pk ON {DB_SCHEMA}.import_by_country(good_id, year, country);
+"""
+
+def ensure_schema(cur):
+    cur.execute(SCHEMA_SQL)
+
+async def ensure_schema_async(conn):
+    await conn.execute(SCHEMA_SQL)
+
+def refresh_import_views(cur):
+    """
+    Пересчёт агрегатов после загрузки (в её транзакции). CONCURRENTLY — читатели
+    API не блокируются и до коммита видят прежние агрегаты вместе с прежними данными.
+    """
+    for view in IMPORT_VIEWS:
+        cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {DB_SCHEMA}.{view}")
+
+# =============================
+# Чтение
+# =============================
+YEAR_COLUMNS = ["year", "total_usd_mln", "total_tons", "unfriendly_usd_mln", "unfriendly_tons",
+                "metric_used", "unfriendly_share_pct", "unfriendly_delta",
+                "total_delta_usd_mln", "total_yoy_pct", "total_delta_tons", "countries"]
+COUNTRY_COLUMNS = ["year", "country", "country_group", "value_usd_mln", "value_tons",
+                   "share_pct", "skc_usd_per_ton", "value_rank", "skc_rank"]
+
+YEARS_SQL = f"""
+    SELECT good_id, {", ".join(YEAR_COLUMNS)}
+    FROM {DB_SCHEMA}.import_by_year
+    WHERE good_id = ANY(%s)
+    ORDER BY good_id, year
+"""
+
+TOP_SQL = f"""
+    SELECT good_id, {", ".join(COUNTRY_COLUMNS)}
+    FROM {DB_SCHEMA}.import_by_country
+    WHERE good_id = ANY(%s) AND (value_rank <= %s OR skc_rank <= %s)
+    ORDER BY good_id, year, value_rank
+"""
+
+def _summaries(good_ids: Sequence[int], years, tops, top: int) -> Dict[int, Dict[str, Any]]:
+    out = {int(g): {"top": top, "years": []} for g in good_ids}
+    by_year = {}
+    for r in years:
+        row = dict(zip(YEAR_COLUMNS, r[1:]))
+        row["top_suppliers"], row["top_skc"] = [], []
+        out[int(r[0])]["years"].append(row)
+        by_year[(int(r[0]), row["year"])] = row
+    for r in tops:
+        item = dict(zip(COUNTRY_COLUMNS, r[1:]))
+        row = by_year.get((int(r[0]), item["year"]))
+        if row is None:
+            continue
+        del item["year"]
+        if item["value_rank"] <= top:
+            row["top_suppliers"].append(item)
+        if item["skc_rank"] is not None and item["skc_rank"] <= top:
+            row["top_skc"].append(item)
+    for s in out.values():
+        for row in s["years"]:
+            row["top_skc"].sort(key=lambda x: x["skc_rank"])
+        s["last_year"] = s["years"][-1]["year"] if s["years"] else None
+    return out
+
+async def load_import_summaries_async(conn, good_ids: Sequence[int], top: int = 5) -> Dict[int, Dict[str, Any]]:
+    """
+    {good_id: {"last_year", "top", "years": [...]}} — два запроса на любой набор товаров.
+    Год: итоги, доля и динамика НС, изменения к прошлому году, top_suppliers (по стоимости)
+    и top_skc (по СКЦ, $/т) — не больше top стран в каждом.
+    """
+    ids = [int(g) for g in good_ids]
+    cur = await conn.execute(YEARS_SQL, (ids,))
+    years = await cur.fetchall()
+    cur = await conn.execute(TOP_SQL, (ids, top, top))
+    tops = await cur.fetchall()
+    return _summaries(ids, years, tops, top)
+
+ROW_COLUMNS = ["year", "country", "value_usd_mln", "value_tons", "country_group"]
+
+async def load_import_rows_async(conn, good_id: int, year: Optional[int] = None,
+                                 country_group: Optional[str] = None,
+                                 limit: int = 100, offset: int = 0) -> Dict[str, Any]:
+    """Исходные строки импорта постранично: {"total", "items"} (год ↓, стоимость ↓)."""
+    cur = await conn.execute(f"""
+        SELECT year, country, COALESCE(value_usd_mln, 0)::float8, COALESCE(value_tons, 0)::float8,
+               country_group, count(*) OVER () AS total
+        FROM {DB_SCHEMA}.import_values
+        WHERE good_id = %s
+          AND (%s::int IS NULL OR year = %s::int)
+          AND (%s::text IS NULL OR country_group = %s::text)
+        ORDER BY year DESC, value_usd_mln DESC NULLS LAST, country
+        LIMIT %s OFFSET %s
+    """, (good_id, year, year, country_group, country_group, limit, offset))
+    rows = await cur.fetchall()
+    total = int(rows[0][-1]) if rows else 0
+    if not rows and offset:
+        # страница за пределами выборки — общее число всё равно нужно клиенту
+        cur = await conn.execute(f"""
+            SELECT count(*) FROM {DB_SCHEMA}.import_values
+            WHERE good_id = %s AND (%s::int IS NULL OR year = %s::int)
+              AND (%s::text IS NULL OR country_group = %s::text)
+        """, (good_id, year, year, country_group, country_group))
+        total = int((await cur.fetchone())[0])
+    items: List[Dict[str, Any]] = [dict(zip(ROW_COLUMNS, r[:-1])) for r in rows]
+    return {"total": total, "items": items}
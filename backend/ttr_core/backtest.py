@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+# ttr_core/backtest.py — бэктест: какие меры алгоритм рекомендовал бы в каждом прошлом году
+#
+#   python -m ttr_core.backtest refresh              # материализовать (товары с новой версией данных)
+#   python -m ttr_core.backtest refresh --all        # пересчитать всё
+#   python -m ttr_core.backtest report [--hs 8428] [--csv backtest.csv]   # устойчивость мер
+#   GET /api/goods/{id}/backtest                     # по товару (api.py)
+#
+# compute_recommendation смотрит только на последний год импорта. Бэктест считает
+# рекомендацию «на конец года Y» для каждой пары (товар, год с импортом): импорт и ряды
+# P/C — только до Y включительно. Тарифы и флаги в схеме без истории — берутся текущие,
+# поэтому бэктест показывает вклад динамики импорта и P/C при нынешних ставках.
+#
+# Все пары считаются за один векторный проход (ttr_core/batch.py): строка импорта (g, y)
+# входит в «виртуальный товар» пары (g, y) как текущий год и пары (g, y + 1) как прошлый —
+# этого достаточно, алгоритм смотрит только на последний и предпоследний годы. P/C на год Y —
+# последний общий год ≤ Y (merge_asof). Результат для пары побитово совпадает
+# с compute_recommendation на данных, обрезанных по Y.
+#
+# Материализация — таблица ttr.backtest (товар, год, версия данных, меры, summary);
+# строки устаревают вместе с версией данных товара (как ttr.recommendations).
+
+import sys
+import json
+import time
+import argparse
+from typing import Dict, Any, List, Optional, Sequence, Iterable, Set
+
+import numpy as np
+import pandas as pd
+
+from ttr_core.db import DB_SCHEMA
+from ttr_core.batch import (
+    PGC_NONE, PGC_TRUE, PGC_FALSE, import_features, tariffs_and_flags, assemble_recommendations,
+    iter_recommendations,
+)
+
+BACKTEST_CHUNK = 500  # товаров на пачку при материализации
+
+SCHEMA_SQL = f"""
+CREATE TABLE IF NOT EXISTS {DB_SCHEMA}.backtest (
+    good_id      integer     NOT NULL REFERENCES {DB_SCHEMA}.goods(id) ON DELETE CASCADE,
+    year         integer     NOT NULL,
+    data_version bigint      NOT NULL,
+    measures     jsonb       NOT NULL,
+    summary      jsonb       NOT NULL,
+    computed_at  timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (good_id, year)
+);
+"""
+
+def ensure_schema(cur):
+    cur.execute(SCHEMA_SQL)
+
+async def ensure_schema_async(conn):
+    await conn.execute(SCHEMA_SQL)
+
+# =============================
+# Расчёт
+# =============================
+def _prod_ge_cons_as_of(goods: np.ndarray, years: np.ndarray,
+                        prod: pd.DataFrame, cons: pd.DataFrame) -> np.ndarray:
+    """P ≥ C в последнем общем году ≤ years[i] для товара goods[i]: PGC_TRUE / PGC_FALSE / PGC_NONE."""
+    out = np.full(len(goods), PGC_NONE, dtype=np.int8)
+    if prod is None or cons is None or not len(prod) or not len(cons) or not len(goods):
+        return out
+    p = prod.drop_duplicates(["good_id", "year"], keep="first")
+    c = cons.drop_duplicates(["good_id", "year"], keep="first")
+    both = p.merge(c, on=["good_id", "year"], suffixes=("_p", "_c"))
+    if not len(both):
+        return out
+    both = both.astype({"good_id": np.int64, "year": np.int64}).sort_values("year", kind="mergesort")
+    both["found"] = True  # отличает «нет общего года» от пустого значения P или C
+    left = pd.DataFrame({"good_id": goods.astype(np.int64), "year": years.astype(np.int64),
+                         "pos": np.arange(len(goods))}).sort_values("year", kind="mergesort")
+    m = pd.merge_asof(left, both, on="year", by="good_id", direction="backward")
+    m = m[m["found"].notna()]
+    ge = m["value_usd_mln_p"].astype(float).to_numpy() >= m["value_usd_mln_c"].astype(float).to_numpy()
+    out[m["pos"].to_numpy()] = np.where(ge, PGC_TRUE, PGC_FALSE)
+    return out
+
+
+def backtest_batch(
+    good_ids: Sequence[int],
+    tariffs: pd.DataFrame,
+    production: pd.DataFrame,
+    consumption: pd.DataFrame,
+    imports: pd.DataFrame,
+    flags: pd.DataFrame,
+) -> pd.DataFrame:
+    """
+    Рекомендации по всем парам (товар, год с импортом) за один проход.
+    Возвращает DataFrame с индексом (good_id, year) и колонками как у
+    compute_recommendations_batch (summary.last_year — год пары).
+    """
+    ids = np.asarray(list(good_ids), dtype=np.int64)
+    imp = imports if imports is not None else pd.DataFrame(
+        columns=["good_id", "year", "country", "value_usd_mln", "value_tons", "country_group"])
+    imp = imp[imp["good_id"].isin(ids)]
+    g = imp["good_id"].to_numpy(dtype=np.int64)
+    y = imp["year"].to_numpy(dtype=np.int64)
+
+    pairs = pd.MultiIndex.from_arrays([g, y], names=["good_id", "year"]).unique().sort_values()
+    pg = pairs.get_level_values(0).to_numpy(dtype=np.int64)
+    py = pairs.get_level_values(1).to_numpy(dtype=np.int64)
+
+    # виртуальные товары = номера пар; строка попадает в свою пару и в пару следующего года
+    cur = pairs.get_indexer(pd.MultiIndex.from_arrays([g, y]))
+    nxt = pairs.get_indexer(pd.MultiIndex.from_arrays([g, y + 1]))
+    virtual = pd.concat([imp.assign(good_id=cur), imp[nxt >= 0].assign(good_id=nxt[nxt >= 0])],
+                        ignore_index=True)
+
+    return assemble_recommendations(
+        pairs,
+        tariffs_and_flags(pg, tariffs, flags),
+        _prod_ge_cons_as_of(pg, py, production, consumption),
+        import_features(np.arange(len(pairs), dtype=np.int64), virtual),
+    )
+
+
+def backtest_bundle(bundle) -> List[Dict[str, Any]]:
+    """Бэктест одного товара (GoodBundle): [{year, measures, summary}] по возрастанию года."""
+    gid = bundle.good_id
+    frames = [getattr(bundle, name).assign(good_id=gid)
+              for name in ("tariffs", "production", "consumption", "imports", "flags")]
+    return rows_of(backtest_batch([gid], *frames)).get(gid, [])
+
+
+def rows_of(result: pd.DataFrame) -> Dict[int, List[Dict[str, Any]]]:
+    """{good_id: [{year, measures, summary}, ...]} из результата backtest_batch."""
+    out: Dict[int, List[Dict[str, Any]]] = {}
+    for (gid, year), measures, summary in iter_recommendations(result):
+        out.setdefault(gid, []).append({"year": year, "measures": measures, "summary": summary})
+    return out
+
+
+def payload(good_id: int, data_version: int, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Ответ API: годы с отметкой смены мер к предыдущему году и итог по устойчивости."""
+    years, prev = [], None
+    for r in rows:
+        changed = prev is not None and r["measures"] != prev
+        years.append({**r, "changed": changed})
+        prev = r["measures"]
+    changes = [r["year"] for r in years if r["changed"]]
+    return {
+        "good_id": good_id,
+        "data_version": data_version,
+        "years": years,
+        "changes": len(changes),
+        "changed_years": changes,
+        "note": "тарифы и флаги — текущие (истории в данных нет); импорт и P/C — по состоянию на год",
+    }
+
+
+def stability(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Устойчивость по товарам из строк (good_id, year, measures, branch): число лет,
+    смен мер и ветки к предыдущему году, год последней смены мер.
+    """
+    if not len(frame):
+        return pd.DataFrame(columns=["good_id", "years", "first_year", "last_year",
+                                     "measure_changes", "branch_changes", "last_change_year"])
+    f = frame.sort_values(["good_id", "year"], kind="mergesort").reset_index(drop=True)
+    key = f["measures"].map(lambda m: "\x1f".join(m))
+    first = f["good_id"].ne(f["good_id"].shift())
+    f["measure_changed"] = ~first & key.ne(key.shift())
+    f["branch_changed"] = ~first & f["branch"].ne(f["branch"].shift())
+    f["change_year"] = f["year"].where(f["measure_changed"])
+    return f.groupby("good_id").agg(
+        years=("year", "size"), first_year=("year", "min"), last_year=("year", "max"),
+        measure_changes=("measure_changed", "sum"), branch_changes=("branch_changed", "sum"),
+        last_change_year=("change_year", "max"),
+    ).reset_index()
+
+# =============================
+# Материализация (ttr.backtest)
+# =============================
+SAVE_SQL = f"""
+    INSERT INTO {DB_SCHEMA}.backtest(good_id, year, data_version, measures, summary)
+    VALUES (%s, %s, %s, %s::jsonb, %s::jsonb)
+"""
+
+def _save_params(versions: Dict[int, int], rows: Dict[int, List[Dict[str, Any]]]):
+    return [(gid, r["year"], versions[gid],
+             json.dumps(r["measures"], ensure_ascii=False), json.dumps(r["summary"], ensure_ascii=False))
+            for gid, items in rows.items() for r in items]
+
+def stale_good_ids(cur) -> Set[int]:
+    """Товары с импортом, у которых бэктеста нет или он посчитан для другой версии данных."""
+    cur.execute(f"""
+        SELECT g.id
+        FROM {DB_SCHEMA}.goods g
+        LEFT JOIN {DB_SCHEMA}.data_version v ON v.good_id = g.id
+        LEFT JOIN (SELECT good_id, min(data_version) AS lo, max(data_version) AS hi
+                   FROM {DB_SCHEMA}.backtest GROUP BY good_id) b ON b.good_id = g.id
+        WHERE EXISTS (SELECT 1 FROM {DB_SCHEMA}.import_values i WHERE i.good_id = g.id)
+          AND (b.good_id IS NULL OR b.lo <> COALESCE(v.version, 0) OR b.hi <> COALESCE(v.version, 0))
+    """)
+    return {int(r[0]) for r in cur.fetchall()}
+
+def save_backtest(cur, versions: Dict[int, int], rows: Dict[int, List[Dict[str, Any]]]):
+    """Заменяет бэктест товаров versions (у товара без импорта строк не остаётся)."""
+    cur.execute(f"DELETE FROM {DB_SCHEMA}.backtest WHERE good_id = ANY(%s)", (list(versions),))
+    cur.executemany(SAVE_SQL, _save_params(versions, rows))
+
+async def save_backtest_async(conn, good_id: int, data_version: int, rows: List[Dict[str, Any]]):
+    async with conn.cursor() as cur:
+        await cur.execute(f"DELETE FROM {DB_SCHEMA}.backtest WHERE good_id = %s", (good_id,))
+        await cur.executemany(SAVE_SQL, _save_params({good_id: data_version}, {good_id: rows}))
+
+async def load_backtest_async(conn, good_id: int, data_version: int) -> Optional[List[Dict[str, Any]]]:
+    """Материализованный бэктест товара; None — нет или посчитан для другой версии данных."""
+    cur = await conn.execute(f"""
+        SELECT year, data_version, measures, summary FROM {DB_SCHEMA}.backtest
+        WHERE good_id = %s ORDER BY year
+    """, (good_id,))
+    rows = await cur.fetchall()
+    if not rows or any(int(r[1]) != data_version for r in rows):
+        return None
+    return [{"year": int(r[0]), "measures": r[2], "summary": r[3]} for r in rows]
+
+def refresh_backtest(conn, good_ids: Optional[Iterable[int]] = None, everything: bool = False,
+                     chunk: int = BACKTEST_CHUNK) -> List[int]:
+    """
+    Пересчитывает бэктест устаревших товаров (плюс good_ids; everything — всех) пачками:
+    на пачку — пять set-based запросов и один векторный расчёт. Коммитит по пачкам.
+    """
+    from ttr_core.bundle import load_goods_index, load_bulk
+    with conn.cursor() as cur:
+        ensure_schema(cur)
+        ids = None if everything else sorted(stale_good_ids(cur) | {int(g) for g in (good_ids or [])})
+    conn.commit()
+    goods = load_goods_index(conn, ids)
+    done = []
+    for start in range(0, len(goods), chunk):
+        part = goods.iloc[start:start + chunk]
+        bulk = load_bulk(conn, part)
+        result = backtest_batch(part["id"], bulk.tariffs, bulk.production, bulk.consumption,
+                                bulk.imports, bulk.flags)
+        versions = {int(g): int(v) for g, v in zip(part["id"], part["data_version"])}
+        with conn.cursor() as cur:
+            save_backtest(cur, versions, rows_of(result))
+        conn.commit()
+        done.extend(versions)
+    return done
+
+def load_frame(conn, hs_prefix: Optional[str] = None) -> pd.DataFrame:
+    """Материализованный бэктест: good_id, hs_code, name, year, measures, branch, share_ns, delta_ns."""
+    from ttr_core.bundle import normalize_hs
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT b.good_id, g.hs_code, g.name, b.year, b.measures, b.summary->>'branch',
+                   (b.summary->>'share_ns')::float8, (b.summary->>'delta_ns')::float8
+            FROM {DB_SCHEMA}.backtest b
+            JOIN {DB_SCHEMA}.goods g ON g.id = b.good_id
+            WHERE %(hs)s::text IS NULL OR starts_with(replace(g.hs_code, ' ', ''), %(hs)s)
+            ORDER BY b.good_id, b.year
+        """, {"hs": normalize_hs(hs_prefix) or None})
+        rows = cur.fetchall()
+    return pd.DataFrame(rows, columns=["good_id", "hs_code", "name", "year", "measures", "branch",
+                                       "share_ns", "delta_ns"])
+
+# =============================
+# CLI
+# =============================
+def main(argv=None) -> int:
+    from ttr_core.db import pool
+    ap = argparse.ArgumentParser(description="Бэктест мер по годам (материализация и отчёт об устойчивости)")
+    sub = ap.add_subparsers(dest="command", required=True)
+    p_refresh = sub.add_parser("refresh", help="пересчитать ttr.backtest для товаров с новой версией данных")
+    p_refresh.add_argument("--all", action="store_true", help="пересчитать все товары")
+    p_report = sub.add_parser("report", help="устойчивость мер по товарам")
+    p_report.add_argument("--hs", default=None, help="префикс кода ТН ВЭД")
+    p_report.add_argument("--top", type=int, default=20, help="сколько самых нестабильных товаров показать")
+    p_report.add_argument("--csv", default=None, help="выгрузить строки (товар, год) в CSV")
+    p_report.add_argument("--no-refresh", action="store_true", help="не пересчитывать устаревшие товары")
+    args = ap.parse_args(argv)
+
+    with pool.connection() as conn:
+        if args.command == "refresh" or not args.no_refresh:
+            t0 = time.perf_counter()
+            done = refresh_backtest(conn, everything=args.command == "refresh" and args.all)
+            print(f"[backtest] пересчитано товаров: {len(done)}, {time.perf_counter() - t0:.2f} c")
+        if args.command == "refresh":
+            return 0
+        frame = load_frame(conn, args.hs)
+
+    stats = stability(frame)
+    changed = stats[stats["measure_changes"] > 0]
+    print(f"[backtest] товаров: {len(stats)}, пар (товар, год): {len(frame)}; "
+          f"меры менялись у {len(changed)} ({len(changed) / max(1, len(stats)) * 100:.1f}%)")
+    if len(changed):
+        names = frame.drop_duplicates("good_id").set_index("good_id")[["hs_code", "name"]]
+        worst = changed.sort_values(["measure_changes", "branch_changes"], ascending=False).head(args.top)
+        print(worst.join(names, on="good_id").to_string(index=False))
+    if args.csv:
+        out = frame.assign(measures=frame["measures"].map(lambda m: "; ".join(m)))
+        out.to_csv(args.csv, index=False)
+        print(f"[backtest] строки записаны: {args.csv}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+# ttr_core/batch.py — пакетный (векторный) расчёт мер по всему портфелю товаров
+#
+# Тот же алгоритм, что compute_recommendation, но сразу для всех товаров:
+# вход — длинные таблицы с колонкой good_id (как в ttr_core.bundle.BulkData),
+# расчёт — groupby/массивные операции numpy без циклов по товарам.
+# Результат побитово совпадает со скалярной функцией: суммы повторяют порядок
+# сложения np.add.reduce по тем же строкам в исходном порядке, а меры и заметки
+# берутся из общей recommendation_outcome.
+
+from typing import Dict, Any, List, Tuple, Iterator, Sequence
+
+import numpy as np
+import pandas as pd
+
+from ttr_core.logic import recommendation_outcome
+
+PGC_NONE, PGC_FALSE, PGC_TRUE = -1, 0, 1
+_PGC_VALUE = {PGC_NONE: None, PGC_FALSE: False, PGC_TRUE: True}
+
+SUMMARY_COLUMNS = [
+    "last_year", "share_ns", "delta_ns", "prod_ge_cons", "applied", "wto_bound",
+    "metric_used", "branch", "notes",
+]
+
+
+def _first_per_good(df: pd.DataFrame, ids: np.ndarray, col: str, default) -> np.ndarray:
+    """Значение из первой строки товара (как .iloc[0] в скалярной версии)."""
+    if df is None or not len(df):
+        return np.full(len(ids), default, dtype=object)
+    first = df.drop_duplicates("good_id", keep="first").set_index("good_id")[col]
+    return first.reindex(ids).to_numpy(dtype=object)
+
+
+_PW_BLOCK = 128  # размер блока pairwise-суммирования numpy
+
+
+def _numpy_sums(v: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Суммы отрезков v[s:s+len] (по каждой колонке v) побитово равные np.add.reduce,
+    т.е. Series.sum() в скалярной версии.
+
+    numpy суммирует float попарно: до 8 элементов — подряд от 0.0; до 128 — восемь
+    накопителей по «полосам» k % 8, затем дерево (r0+r1)+(r2+r3)+…, затем хвост n % 8.
+    Здесь то же самое сделано сразу для всех отрезков матрицами (дополнение нулями
+    точное: x + 0.0 == x). Отрезки длиннее 128 (больше 128 стран в году) — редкость,
+    их считаем напрямую — по каждой колонке отдельно: reduce двумерного массива по axis=0
+    складывает строки подряд, а не попарно, и с Series.sum не совпадает.
+    Проверка — tests/test_batch_parity.py (сломается, если numpy сменит порядок сложения).
+    """
+    out = np.empty((len(starts), v.shape[1]))
+    big = lengths > _PW_BLOCK
+    for i in np.flatnonzero(big):
+        rows = v[starts[i]:starts[i] + lengths[i]]
+        out[i] = [np.add.reduce(np.ascontiguousarray(rows[:, j])) for j in range(v.shape[1])]
+    small = np.flatnonzero(~big)
+    if not len(small):
+        return out
+    s, m = starts[small], lengths[small]
+    seg = np.repeat(np.arange(len(small)), m)
+    k = np.arange(len(seg)) - np.repeat(np.cumsum(m) - m, m)
+    vals = v[np.repeat(s, m) + k]
+    mk = m[seg]
+
+    main = (mk >= 8) & (k < mk - mk % 8)
+    blocks = max(1, int(m.max()) // 8)
+    lanes = np.zeros((len(small), 8, blocks, v.shape[1]))
+    lanes[seg[main], k[main] % 8, k[main] // 8] = vals[main]
+    r = lanes[:, :, 0].copy()
+    for b in range(1, blocks):
+        r += lanes[:, :, b]
+    res = ((r[:, 0] + r[:, 1]) + (r[:, 2] + r[:, 3])) + ((r[:, 4] + r[:, 5]) + (r[:, 6] + r[:, 7]))
+    res[m < 8] = 0.0
+
+    tail = ~main
+    tails = np.zeros((len(small), 8, v.shape[1]))
+    tpos = np.where(mk[tail] >= 8, k[tail] - (mk[tail] - mk[tail] % 8), k[tail])
+    tails[seg[tail], tpos] = vals[tail]
+    for j in range(8):
+        res = res + tails[:, j]
+    out[small] = res
+    return out
+
+
+def _grouped_sums(key: np.ndarray, values: np.ndarray, size: int) -> np.ndarray:
+    """Суммы строк values по ключу 0..size-1; строки ключа — в исходном порядке (0.0, если строк нет)."""
+    out = np.zeros((size, values.shape[1]))
+    if not len(key):
+        return out
+    order = np.argsort(key, kind="stable")
+    k, v = key[order], values[order]
+    starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+    lengths = np.diff(np.r_[starts, len(k)])
+    out[k[starts]] = _numpy_sums(v, starts, lengths)
+    return out
+
+
+def _prod_ge_cons(ids: np.ndarray, prod: pd.DataFrame, cons: pd.DataFrame) -> np.ndarray:
+    """P ≥ C в последнем общем году: PGC_TRUE / PGC_FALSE / PGC_NONE."""
+    out = np.full(len(ids), PGC_NONE, dtype=np.int8)
+    if prod is None or cons is None or not len(prod) or not len(cons):
+        return out
+    p = prod.drop_duplicates(["good_id", "year"], keep="first")
+    c = cons.drop_duplicates(["good_id", "year"], keep="first")
+    both = p.merge(c, on=["good_id", "year"], suffixes=("_p", "_c"))
+    if not len(both):
+        return out
+    last = both.loc[both.groupby("good_id")["year"].idxmax()].set_index("good_id")
+    ge = (last["value_usd_mln_p"].astype(float) >= last["value_usd_mln_c"].astype(float))
+    ge = ge.reindex(ids)
+    has = ge.notna().to_numpy()
+    out[has] = np.where(ge[has].astype(bool).to_numpy(), PGC_TRUE, PGC_FALSE)
+    return out
+
+
+def import_features(ids: np.ndarray, imports: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    Показатели импорта по товарам ids (массивы в порядке ids): last_year/has_ly,
+    use_usd (метрика — млн $), share_ns, delta_ns, grew (рост импорта к прошлому году)
+    и top1_ok (топ-1 поставщик последнего года дешевле остальных по СКЦ).
+    """
+    n = len(ids)
+    pos_of = pd.Series(np.arange(n), index=ids)
+    imp = imports if imports is not None else pd.DataFrame(columns=["good_id", "year"])
+    imp = imp[imp["good_id"].isin(ids)]
+    g = imp["good_id"].to_numpy(dtype=np.int64)
+    y = imp["year"].to_numpy(dtype=np.int64)
+    usd = imp["value_usd_mln"].to_numpy(dtype=float) if len(imp) else np.zeros(0)
+    tons = imp["value_tons"].to_numpy(dtype=float) if len(imp) else np.zeros(0)
+    unf = (imp["country_group"] == "unfriendly").to_numpy() if len(imp) else np.zeros(0, bool)
+
+    ly_s = pd.Series(y, index=g).groupby(level=0).max() if len(imp) else pd.Series(dtype=np.int64)
+    has_ly = np.isin(ids, ly_s.index.to_numpy())
+    ly = ly_s.reindex(ids).fillna(0).to_numpy(dtype=np.int64)
+
+    # суммы нужны только за последний (ly) и предыдущий (ly-1) годы товара:
+    # ключ = позиция товара * 2 + (0 — ly, 1 — ly-1); колонки — [млн $, тонны]
+    gpos = pos_of.reindex(g).to_numpy()
+    is_cur = y == ly[gpos]
+    near = is_cur | (y == ly[gpos] - 1)
+    key = gpos[near] * 2 + (~is_cur[near]).astype(np.int64)
+    vals = np.column_stack([usd, tons])[near]
+    tot = _grouped_sums(key, vals, 2 * n).reshape(n, 2, 2)
+    ns = _grouped_sums(key[unf[near]], vals[unf[near]], 2 * n).reshape(n, 2, 2)
+
+    use_usd = tot[:, 0, 0] > 0
+    col = np.where(use_usd, 0, 1)
+    rows = np.arange(n)
+    total_cur, total_prev = tot[rows, 0, col], tot[rows, 1, col]
+    ns_cur, ns_prev = ns[rows, 0, col], ns[rows, 1, col]
+
+    share_ns = np.zeros(n)
+    ok = has_ly & (total_cur > 0)
+    share_ns[ok] = ns_cur[ok] / total_cur[ok] * 100.0
+    delta_ns = np.where(has_ly, ns_cur - ns_prev, 0.0)
+    grew = has_ly & (total_cur > total_prev)
+
+    # ---------- СКЦ: топ-1 последнего года дешевле остальных ----------
+    top1_ok = np.zeros(n, dtype=bool)
+    if len(imp):
+        lpos = gpos[is_cur]
+        lusd, ltons = usd[is_cur], tons[is_cur]
+        lmetric = np.where(use_usd[lpos], lusd, ltons)
+        # позиция строки внутри года товара (в исходном порядке)
+        order = np.argsort(lpos, kind="stable")
+        starts = np.flatnonzero(np.r_[True, lpos[order][1:] != lpos[order][:-1]])
+        rank = np.empty(len(lpos), dtype=np.int64)
+        rank[order] = np.arange(len(lpos)) - np.repeat(starts, np.diff(np.r_[starts, len(lpos)]))
+        cnt = np.bincount(lpos, minlength=n)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            skc = lusd / ltons
+        valid = ltons != 0
+
+        # топ-1: максимум метрики, при равенстве — первая по порядку строка
+        order = np.lexsort((rank, -lmetric, lpos))
+        first = order[np.r_[True, lpos[order][1:] != lpos[order][:-1]]]
+        top_skc = np.full(n, np.nan)
+        top_valid = np.zeros(n, dtype=bool)
+        top_skc[lpos[first]] = skc[first]
+        top_valid[lpos[first]] = valid[first]
+
+        # «остальные» — как rest = last.iloc[1:]: все строки года, кроме первой по порядку
+        others = (rank >= 1) & valid
+        min_others = np.full(n, np.inf)
+        np.minimum.at(min_others, lpos[others], skc[others])
+        has_others = np.bincount(lpos[others], minlength=n) > 0
+
+        top1_ok = (cnt >= 2) & top_valid & has_others & (top_skc < min_others)
+
+    return {"last_year": ly, "has_ly": has_ly, "use_usd": use_usd, "share_ns": share_ns,
+            "delta_ns": delta_ns, "grew": grew, "top1_ok": top1_ok}
+
+
+def select_branch(share_ns, delta_ns, applied, wto, pgc, grew, top1_ok) -> np.ndarray:
+    """Ветка алгоритма (как branch в compute_recommendation) по массивам одинаковой длины."""
+    high = (share_ns >= 30.0) & (delta_ns >= 0)
+    low = ~high & (share_ns < 30.0)
+    gt = wto > applied
+    eq = np.abs(wto - applied) < 1e-12
+    is_t, is_f = pgc == PGC_TRUE, pgc == PGC_FALSE
+    return np.select(
+        [
+            high & is_t, high & is_f, high,
+            low & gt & is_t, low & gt & is_f,
+            low & eq & is_f & grew & top1_ok, low & eq & is_f,
+            low & eq & is_t, low,
+        ],
+        [
+            "prod>=cons & NS>=30% & non-decrease",
+            "prod<cons & NS>=30% & non-decrease",
+            "no P/C & NS>=30% & non-decrease",
+            "bound>applied & prod>=cons",
+            "bound>applied & prod<cons",
+            "applied==bound & prod<cons & growth & top1_skc_ok",
+            "applied==bound & prod<cons & (no growth or no skc cond)",
+            "applied==bound & prod>=cons → non-tariff",
+            "other → non-tariff",
+        ],
+        default="NS>=30% & decrease",
+    )
+
+
+def tariffs_and_flags(goods: np.ndarray, tariffs: pd.DataFrame, flags: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Ставки и флаги (первая строка товара) в порядке goods; товар может повторяться."""
+    n = len(goods)
+    applied = np.array([float(x) for x in _first_per_good(tariffs, goods, "applied_rate", 0.0)])
+    wto = np.array([float(x) for x in _first_per_good(tariffs, goods, "wto_bound_rate", 0.0)])
+    in_tr = np.array([bool(x) for x in _first_per_good(flags, goods, "in_techreg", False)])
+    in_1875 = np.array([bool(x) for x in _first_per_good(flags, goods, "in_pp1875", False)])
+    in_4114 = np.array([bool(x) for x in _first_per_good(flags, goods, "in_order4114", False)])
+    # отсутствие строки → reindex даёт NaN, а bool(NaN) истинно: восстанавливаем значения по умолчанию
+    for arr, df, default in ((applied, tariffs, 0.0), (wto, tariffs, 0.0)):
+        missing = ~np.isin(goods, df["good_id"].to_numpy()) if df is not None and len(df) else np.ones(n, bool)
+        arr[missing] = default
+    missing_flags = ~np.isin(goods, flags["good_id"].to_numpy()) if flags is not None and len(flags) else np.ones(n, bool)
+    in_tr[missing_flags] = in_1875[missing_flags] = in_4114[missing_flags] = False
+    return {"applied": applied, "wto": wto, "in_tr": in_tr, "in_1875": in_1875, "in_4114": in_4114}
+
+
+def assemble_recommendations(index: pd.Index, tf: Dict[str, np.ndarray], pgc: np.ndarray,
+                             f: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """
+    Ветка, меры и summary по готовым показателям (tariffs_and_flags, P/C, import_features):
+    DataFrame с индексом index и колонками measures + SUMMARY_COLUMNS.
+    """
+    applied, wto = tf["applied"], tf["wto"]
+    ly, has_ly, use_usd = f["last_year"], f["has_ly"], f["use_usd"]
+    share_ns, delta_ns = f["share_ns"], f["delta_ns"]
+
+    # ---------- ветка ----------
+    branch = select_branch(share_ns, delta_ns, applied, wto, pgc, f["grew"], f["top1_ok"])
+
+    # ---------- меры и заметки: по уникальным сочетаниям (ветка, P/C, флаги) ----------
+    combos = pd.DataFrame({"branch": branch, "pgc": pgc, "tr": tf["in_tr"], "p1875": tf["in_1875"],
+                           "o4114": tf["in_4114"]})
+    outcomes: Dict[Tuple, Tuple[List[str], List[str]]] = {}
+    measures_col, notes_col = [], []
+    for key in combos.itertuples(index=False, name=None):
+        if key not in outcomes:
+            outcomes[key] = recommendation_outcome(key[0], _PGC_VALUE[key[1]], key[2], key[3], key[4])
+        m, nt = outcomes[key]
+        measures_col.append(list(m))
+        notes_col.append(list(nt))
+
+    return pd.DataFrame({
+        "measures": measures_col,
+        "last_year": [int(v) if h else None for v, h in zip(ly, has_ly)],
+        "share_ns": share_ns,
+        "delta_ns": delta_ns,
+        "prod_ge_cons": [_PGC_VALUE[int(v)] for v in pgc],
+        "applied": applied,
+        "wto_bound": wto,
+        "metric_used": [("value_usd_mln" if u else "value_tons") if h else None for u, h in zip(use_usd, has_ly)],
+        "branch": branch.astype(object),
+        "notes": notes_col,
+    }, index=index)
+
+
+def compute_recommendations_batch(
+    good_ids: Sequence[int],
+    tariffs: pd.DataFrame,
+    production: pd.DataFrame,
+    consumption: pd.DataFrame,
+    imports: pd.DataFrame,
+    flags: pd.DataFrame,
+) -> pd.DataFrame:
+    """
+    Меры по всем товарам за один проход.
+    Возвращает DataFrame с индексом good_id и колонками measures + SUMMARY_COLUMNS
+    (значения — как в summary у compute_recommendation).
+    """
+    ids = np.asarray(list(good_ids), dtype=np.int64)
+    return assemble_recommendations(
+        pd.Index(ids, name="good_id"),
+        tariffs_and_flags(ids, tariffs, flags),
+        _prod_ge_cons(ids, production, consumption),
+        import_features(ids, imports),
+    )
+
+
+def iter_recommendations(result: pd.DataFrame) -> Iterator[Tuple[Any, List[str], Dict[str, Any]]]:
+    """
+    (good_id, measures, summary) — в том же виде, что возвращает compute_recommendation.
+    Для результата бэктеста (индекс good_id, year) первый элемент — пара (good_id, year).
+    """
+    for key, row in zip(result.index, result.itertuples(index=False)):
+        r = row._asdict()
+        summary = {k: r[k] for k in SUMMARY_COLUMNS}
+        # pandas хранит None в числовых/строковых колонках как NaN — возвращаем None
+        summary["last_year"] = None if pd.isna(r["last_year"]) else int(r["last_year"])
+        summary["metric_used"] = None if pd.isna(r["metric_used"]) else str(r["metric_used"])
+        summary["prod_ge_cons"] = None if pd.isna(r["prod_ge_cons"]) else bool(r["prod_ge_cons"])
+        summary["share_ns"] = float(summary["share_ns"])
+        summary["delta_ns"] = float(summary["delta_ns"])
+        summary["applied"] = float(summary["applied"])
+        summary["wto_bound"] = float(summary["wto_bound"])
+        key = tuple(int(k) for k in key) if isinstance(key, tuple) else int(key)
+        yield key, r["measures"], summary
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+# ttr_core/bundle.py — все данные по товару за один запрос к БД
+#
+# Вместо шести SELECT (goods, tariffs, production, consumption, import_values,
+# goods_flags) сервер собирает JSON-объекты подзапросами и отдаёт одну строку.
+# В той же строке приходят версия данных товара и материализованная рекомендация
+# (если она посчитана для текущей версии, см. ttr_core/store.py).
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Iterator, Sequence
+
+import pandas as pd
+
+from ttr_core.db import DB_SCHEMA
+
+TARIFF_COLUMNS = ["applied_rate", "wto_bound_rate"]
+SERIES_COLUMNS = ["year", "value_usd_mln"]
+IMPORT_COLUMNS = ["year", "country", "value_usd_mln", "value_tons", "country_group"]
+FLAG_COLUMNS = ["in_techreg", "in_pp1875", "in_order4114"]
+
+
+@dataclass
+class Recommendation:
+    """Результат алгоритма мер для товара: меры, summary и текст заземления для чата."""
+    measures: List[str]
+    summary: Dict[str, Any]
+    grounding: str
+
+
+@dataclass
+class GoodBundle:
+    """Снимок данных по одному товару (формат совпадает с прежними fetch_*)."""
+    good: Dict[str, Any]
+    tariffs: pd.DataFrame
+    production: pd.DataFrame
+    consumption: pd.DataFrame
+    imports: pd.DataFrame
+    flags: pd.DataFrame
+    data_version: int = 0
+    recommendation: Optional[Recommendation] = field(default=None, repr=False)
+    updated_at: Optional[datetime] = None  # момент последнего изменения данных (ttr.data_version)
+
+    @property
+    def good_id(self) -> int:
+        return int(self.good["id"])
+
+
+BUNDLE_SQL = f"""
+SELECT
+    json_build_object('id', g.id, 'hs_code', g.hs_code, 'name', g.name) AS good,
+    (SELECT COALESCE(json_agg(json_build_object(
+                'applied_rate', t.applied_rate,
+                'wto_bound_rate', t.wto_bound_rate)), '[]'::json)
+       FROM {DB_SCHEMA}.tariffs t WHERE t.good_id = g.id) AS tariffs,
+    (SELECT COALESCE(json_agg(json_build_object(
+                'year', p.year, 'value_usd_mln', p.value_usd_mln) ORDER BY p.year), '[]'::json)
+       FROM {DB_SCHEMA}.production p WHERE p.good_id = g.id) AS production,
+    (SELECT COALESCE(json_agg(json_build_object(
+                'year', c.year, 'value_usd_mln', c.value_usd_mln) ORDER BY c.year), '[]'::json)
+       FROM {DB_SCHEMA}.consumption c WHERE c.good_id = g.id) AS consumption,
+    (SELECT COALESCE(json_agg(json_build_object(
+                'year', i.year,
+                'country', i.country,
+                'value_usd_mln', COALESCE(i.value_usd_mln, 0),
+                'value_tons', COALESCE(i.value_tons, 0),
+                'country_group', i.country_group)), '[]'::json)
+       FROM {DB_SCHEMA}.import_values i WHERE i.good_id = g.id) AS imports,
+    (SELECT COALESCE(json_agg(json_build_object(
+                'in_techreg', f.in_techreg,
+                'in_pp1875', f.in_pp1875,
+                'in_order4114', f.in_order4114)), '[]'::json)
+       FROM {DB_SCHEMA}.goods_flags f WHERE f.good_id = g.id) AS flags,
+    COALESCE(v.version, 0) AS data_version,
+    CASE WHEN r.data_version = COALESCE(v.version, 0) THEN json_build_object(
+        'measures', r.measures, 'summary', r.summary, 'grounding', r.grounding) END AS recommendation,
+    v.updated_at
+FROM {DB_SCHEMA}.goods g
+LEFT JOIN {DB_SCHEMA}.data_version v ON v.good_id = g.id
+LEFT JOIN {DB_SCHEMA}.recommendations r ON r.good_id = g.id
+WHERE g.id = %s
+"""
+
+
+def _frame(rows: Optional[List[Dict[str, Any]]], columns: List[str]) -> pd.DataFrame:
+    # пустой список → пустой DataFrame с нужными колонками (как у pd.read_sql)
+    return pd.DataFrame(rows or [], columns=columns)
+
+
+def bundle_from_row(good, tariffs, production, consumption, imports, flags,
+                    data_version=0, recommendation=None, updated_at=None) -> GoodBundle:
+    return GoodBundle(
+        good=dict(good),
+        tariffs=_frame(tariffs, TARIFF_COLUMNS),
+        production=_frame(production, SERIES_COLUMNS),
+        consumption=_frame(consumption, SERIES_COLUMNS),
+        imports=_frame(imports, IMPORT_COLUMNS),
+        flags=_frame(flags, FLAG_COLUMNS),
+        data_version=int(data_version or 0),
+        recommendation=Recommendation(**recommendation) if recommendation else None,
+        updated_at=updated_at,
+    )
+
+
+def load_good_bundle(conn, good_id: int) -> Optional[GoodBundle]:
+    """Один round-trip к БД; None, если товара нет."""
+    with conn.cursor() as cur:
+        cur.execute(BUNDLE_SQL, (good_id,))
+        row = cur.fetchone()
+    if row is None:
+        return None
+    return bundle_from_row(*row)
+
+
+async def load_good_bundle_async(conn, good_id: int) -> Optional[GoodBundle]:
+    """То же для psycopg.AsyncConnection (async-эндпоинты api.py)."""
+    cur = await conn.execute(BUNDLE_SQL, (good_id,))
+    row = await cur.fetchone()
+    if row is None:
+        return None
+    return bundle_from_row(*row)
+
+
+# =============================
+# Пакетная загрузка (много товаров)
+# =============================
+# Для портфельных запросов — не по запросу на товар, а по одному set-based
+# запросу на таблицу (good_id = ANY(...)) в «длинном» формате с колонкой good_id.
+
+# Префикс ТН ВЭД — буквально (starts_with, а не LIKE: «%» и «_» в hs_prefix — не шаблоны),
+# как в снимке и автономном режиме.
+GOODS_INDEX_SQL = f"""
+SELECT g.id, g.hs_code, g.name,
+       COALESCE(v.version, 0) AS data_version,
+       CASE WHEN r.data_version = COALESCE(v.version, 0) THEN json_build_object(
+           'measures', r.measures, 'summary', r.summary, 'grounding', r.grounding) END AS recommendation
+FROM {DB_SCHEMA}.goods g
+LEFT JOIN {DB_SCHEMA}.data_version v ON v.good_id = g.id
+LEFT JOIN {DB_SCHEMA}.recommendations r ON r.good_id = g.id
+WHERE (%(ids)s::int[] IS NULL OR g.id = ANY(%(ids)s::int[]))
+  AND (%(hs)s::text IS NULL OR starts_with(replace(g.hs_code, ' ', ''), %(hs)s))
+ORDER BY g.id
+LIMIT %(limit)s
+"""
+
+BULK_SQL = {
+    "tariffs": f"""SELECT good_id, applied_rate::float8, wto_bound_rate::float8
+                   FROM {DB_SCHEMA}.tariffs WHERE good_id = ANY(%s)""",
+    "production": f"""SELECT good_id, year, value_usd_mln::float8
+                      FROM {DB_SCHEMA}.production WHERE good_id = ANY(%s) ORDER BY good_id, year""",
+    "consumption": f"""SELECT good_id, year, value_usd_mln::float8
+                       FROM {DB_SCHEMA}.consumption WHERE good_id = ANY(%s) ORDER BY good_id, year""",
+    "imports": f"""SELECT good_id, year, country,
+                          COALESCE(value_usd_mln, 0)::float8 AS value_usd_mln,
+                          COALESCE(value_tons, 0)::float8    AS value_tons,
+                          country_group
+                   FROM {DB_SCHEMA}.import_values WHERE good_id = ANY(%s)""",
+    "flags": f"""SELECT good_id, in_techreg, in_pp1875, in_order4114
+                 FROM {DB_SCHEMA}.goods_flags WHERE good_id = ANY(%s)""",
+}
+
+BULK_COLUMNS = {
+    "tariffs": TARIFF_COLUMNS,
+    "production": SERIES_COLUMNS,
+    "consumption": SERIES_COLUMNS,
+    "imports": IMPORT_COLUMNS,
+    "flags": FLAG_COLUMNS,
+}
+
+
+def normalize_hs(code: Optional[str]) -> str:
+    """'8428 10' и '842810' → '842810'."""
+    return "".join(str(code or "").split())
+
+
+@dataclass
+class BulkData:
+    """Данные по набору товаров в длинном формате (у каждой таблицы есть колонка good_id)."""
+    goods: pd.DataFrame        # id, hs_code, name, data_version, recommendation
+    tariffs: pd.DataFrame
+    production: pd.DataFrame
+    consumption: pd.DataFrame
+    imports: pd.DataFrame
+    flags: pd.DataFrame
+
+    def bundles(self) -> Iterator[GoodBundle]:
+        """Разбивает длинные таблицы на GoodBundle по товарам (порядок — как в goods)."""
+        parts = {}
+        for name, cols in BULK_COLUMNS.items():
+            df = getattr(self, name)
+            parts[name] = {gid: grp[cols].reset_index(drop=True) for gid, grp in df.groupby("good_id", sort=False)}
+        for g in self.goods.itertuples(index=False):
+            gid = int(g.id)
+            frames = {name: parts[name].get(gid, _frame(None, cols)) for name, cols in BULK_COLUMNS.items()}
+            rec = g.recommendation
+            yield GoodBundle(
+                good={"id": gid, "hs_code": g.hs_code, "name": g.name},
+                data_version=int(g.data_version),
+                recommendation=Recommendation(**rec) if rec else None,
+                **frames,
+            )
+
+
+GOODS_INDEX_COLUMNS = ["id", "hs_code", "name", "data_version", "recommendation"]
+
+
+def _index_params(ids, hs_prefix, limit) -> Dict[str, Any]:
+    return {
+        "ids": list(ids) if ids is not None else None,
+        "hs": normalize_hs(hs_prefix) or None,
+        "limit": limit,
+    }
+
+
+def load_goods_index(conn, ids: Optional[Sequence[int]] = None,
+                     hs_prefix: Optional[str] = None, limit: Optional[int] = None) -> pd.DataFrame:
+    """Синхронный вариант load_goods_index_async (psycopg2, для скриптов); limit=None — все товары."""
+    with conn.cursor() as cur:
+        cur.execute(GOODS_INDEX_SQL, _index_params(ids, hs_prefix, limit))
+        rows = cur.fetchall()
+    return pd.DataFrame(rows, columns=GOODS_INDEX_COLUMNS)
+
+
+def load_bulk(conn, goods: pd.DataFrame) -> BulkData:
+    """Синхронный вариант load_bulk_async: те же пять set-based запросов."""
+    ids = [int(x) for x in goods["id"]]
+    frames = {}
+    with conn.cursor() as cur:
+        for name, sql in BULK_SQL.items():
+            cur.execute(sql, (ids,))
+            frames[name] = pd.DataFrame(cur.fetchall(), columns=["good_id"] + BULK_COLUMNS[name])
+    return BulkData(goods=goods, **frames)
+
+
+async def load_goods_index_async(conn, ids: Optional[Sequence[int]] = None,
+                                 hs_prefix: Optional[str] = None, limit: int = 10000) -> pd.DataFrame:
+    """Отбор товаров по списку id и/или префиксу кода ТН ВЭД (пробелы игнорируются)."""
+    cur = await conn.execute(GOODS_INDEX_SQL, _index_params(ids, hs_prefix, limit))
+    rows = await cur.fetchall()
+    return pd.DataFrame(rows, columns=GOODS_INDEX_COLUMNS)
+
+
+async def load_bulk_async(conn, goods: pd.DataFrame) -> BulkData:
+    """
+    Пять set-based запросов по отобранным товарам. Запросы уходят в режиме
+    pipeline psycopg 3 — ответы читаются после отправки всех, без ожидания каждого.
+    """
+    ids = [int(x) for x in goods["id"]]
+    frames = {}
+    async with conn.pipeline():
+        cursors = {}
+        for name, sql in BULK_SQL.items():
+            cursors[name] = conn.cursor()
+            await cursors[name].execute(sql, (ids,))
+        for name, cur in cursors.items():
+            rows = await cur.fetchall()
+            frames[name] = pd.DataFrame(rows, columns=["good_id"] + BULK_COLUMNS[name])
+    return BulkData(goods=goods, **frames)
@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+# ttr_core/cache.py — кэши: в памяти процесса и общие для воркеров
+#
+#   LRUCache    — LRU + TTL с ограничением по числу записей (и, при желании, по байтам);
+#                 потокобезопасный: им пользуются и async-эндпоинты, и threadpool.
+#   SqliteCache — общий кэш воркеров на хосте: файл SQLite (WAL) с бюджетом в байтах;
+#   RedisCache  — общий кэш на Redis-совместимом сервере (необязательно: pip install redis);
+#   TieredCache — уровни по порядку (память → общий): промах верхнего уровня читает
+#                 нижний и поднимает значение наверх; статистика по каждому уровню.
+#   make_cache  — кэш по настройке CACHE_BACKEND: memory | sqlite | redis.
+#   SingleFlight — склейка одинаковых одновременных вычислений в одно (asyncio):
+#                 пока первый запрос считает значение, остальные ждут его результат.
+#
+# При нескольких воркерах uvicorn память у каждого своя и после рестарта холодная,
+# а уровни sqlite/redis общие — значение, посчитанное одним воркером, видят все.
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory").lower()   # memory | sqlite | redis
+CACHE_SQLITE_PATH = os.environ.get(
+    "CACHE_SQLITE_PATH", str(Path(__file__).resolve().parent.parent / ".cache" / "shared.sqlite3"))
+CACHE_SQLITE_MB = float(os.environ.get("CACHE_SQLITE_MB", "256"))
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Словарь с вытеснением давно неиспользуемых записей.
+
+    max_items — предел числа записей; ttl — срок жизни записи в секундах (None — без срока);
+    max_bytes + sizeof — дополнительный предел по суммарному размеру значений.
+    """
+
+    def __init__(self, max_items: int, ttl: Optional[float] = None,
+                 max_bytes: Optional[int] = None, sizeof: Optional[Callable[[Any], int]] = None):
+        self.max_items = max(1, max_items)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof or (lambda v: 0)
+        self._data: "OrderedDict[Hashable, Tuple[Any, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0, "expired": 0}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self._stats["misses"] += 1
+                return default
+            value, expires, _ = item
+            if expires and expires < time.monotonic():
+                self._drop(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        size = self._sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # не помещается вовсе — не вытесняем ради неё весь кэш
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            expires = time.monotonic() + self.ttl if self.ttl else 0.0
+            self._data[key] = (value, expires, size)
+            self._bytes += size
+            self._stats["sets"] += 1
+            while len(self._data) > self.max_items or (
+                    self.max_bytes is not None and self._bytes > self.max_bytes):
+                old = next(iter(self._data))
+                self._drop(old)
+                self._stats["evictions"] += 1
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+
+    def delete_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Удаляет записи, ключ которых удовлетворяет predicate; возвращает их число."""
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys:
+                self._drop(k)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _drop(self, key: Hashable):
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+            s["items"] = len(self._data)
+            s["bytes"] = self._bytes
+        s["max_items"] = self.max_items
+        s["max_bytes"] = self.max_bytes
+        lookups = s["hits"] + s["misses"]
+        s["hit_ratio"] = s["hits"] / lookups if lookups else 0.0
+        return s
+
+
+# =============================
+# Общие уровни: ключ — строка, значение — байты
+# =============================
+def key_str(key: Hashable) -> str:
+    return ":".join(map(str, key)) if isinstance(key, tuple) else str(key)
+
+
+class SqliteCache:
+    """
+    Кэш в файле SQLite, общий для всех процессов на хосте (WAL: читатели не ждут писателя).
+    Бюджет max_bytes на весь файл; при превышении удаляются давно не читанные записи.
+    Ошибки SQLite (блокировка, диск) считаются промахом — кэш не роняет запрос.
+    """
+
+    TOUCH_EVERY_S = 30.0  # время последнего чтения обновляем не чаще — меньше записей
+    PRUNE_EVERY = 64      # проверка бюджета раз в столько записей
+
+    def __init__(self, path: str, max_bytes: int, ttl: Optional[float] = None, namespace: str = ""):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.namespace = namespace
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sets_since_prune = 0
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0, "expired": 0, "errors": 0}
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    ns      TEXT NOT NULL,
+                    key     TEXT NOT NULL,
+                    value   BLOB NOT NULL,
+                    size    INTEGER NOT NULL,
+                    expires REAL NOT NULL,
+                    used    REAL NOT NULL,
+                    PRIMARY KEY (ns, key)
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache(used)")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self._stats[name] += n
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT value, expires, used FROM cache WHERE ns = ? AND key = ?",
+                               (self.namespace, key_str(key))).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            value, expires, used = row
+            if expires and expires < now:
+                conn.execute("DELETE FROM cache WHERE ns = ? AND key = ?", (self.namespace, key_str(key)))
+                self._count("expired")
+                self._count("misses")
+                return None
+            if now - used > self.TOUCH_EVERY_S:
+                conn.execute("UPDATE cache SET used = ? WHERE ns = ? AND key = ?",
+                             (now, self.namespace, key_str(key)))
+        except sqlite3.Error as e:
+            self._count("errors")
+            print(f"[cache] sqlite get: {e}")
+            return None
+        self._count("hits")
+        return bytes(value)
+
+    def set(self, key: Hashable, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        expires = now + self.ttl if self.ttl else 0.0
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO cache(ns, key, value, size, expires, used) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.namespace, key_str(key), sqlite3.Binary(value), len(value), expires, now))
+        except sqlite3.Error as e:
+            self._count("errors")
+            print(f"[cache] sqlite set: {e}")
+            return
+        self._count("sets")
+        with self._lock:
+            self._sets_since_prune += 1
+            prune = self._sets_since_prune >= self.PRUNE_EVERY
+            if prune:
+                self._sets_since_prune = 0
+        if prune:
+            self.prune()
+
+    def delete(self, key: Hashable):
+        try:
+            self._conn().execute("DELETE FROM cache WHERE ns = ? AND key = ?", (self.namespace, key_str(key)))
+        except sqlite3.Error:
+            self._count("errors")
+
+    def prune(self) -> int:
+        """Истёкшие записи и самые давние сверх бюджета (по всему файлу, всех пространств)."""
+        removed = 0
+        try:
+            conn = self._conn()
+            removed += conn.execute("DELETE FROM cache WHERE expires > 0 AND expires < ?",
+                                    (time.time(),)).rowcount
+            total = conn.execute("SELECT COALESCE(sum(size), 0) FROM cache").fetchone()[0]
+            while total > self.max_bytes:
+                rows = conn.execute("SELECT ns, key, size FROM cache ORDER BY used LIMIT 256").fetchall()
+                if not rows:
+                    break
+                batch = []
+                for ns, key, size in rows:
+                    batch.append((ns, key))
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+                conn.executemany("DELETE FROM cache WHERE ns = ? AND key = ?", batch)
+                removed += len(batch)
+        except sqlite3.Error as e:
+            self._count("errors")
+            print(f"[cache] sqlite prune: {e}")
+        self._count("evictions", removed)
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+        try:
+            items, size = self._conn().execute(
+                "SELECT count(*), COALESCE(sum(size), 0) FROM cache WHERE ns = ?", (self.namespace,)).fetchone()
+            s["items"], s["bytes"] = items, size
+        except sqlite3.Error:
+            s["items"] = s["bytes"] = None
+        s["max_bytes"] = self.max_bytes
+        s["path"] = self.path
+        lookups = s["hits"] + s["misses"]
+        s["hit_ratio"] = s["hits"] / lookups if lookups else 0.0
+        return s
+
+
+class RedisCache:
+    """
+    Кэш на Redis-совместимом сервере (Redis, Valkey, KeyDB, Dragonfly).
+    Вытеснение — на стороне сервера (maxmemory-policy allkeys-lru); в stats —
+    счётчик evicted_keys сервера. После ошибки сервер не опрашивается RETRY_S секунд.
+    """
+
+    RETRY_S = 5.0
+
+    def __init__(self, url: str, ttl: Optional[float] = None, namespace: str = ""):
+        if redis is None:
+            raise RuntimeError("для CACHE_BACKEND=redis нужен пакет redis (pip install redis)")
+        self.url = url
+        self.ttl = ttl
+        self.prefix = f"ttr:{namespace}:"
+        self._client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "errors": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _failed(self, op: str, e: Exception):
+        self._down_until = time.monotonic() + self.RETRY_S
+        self._count("errors")
+        print(f"[cache] redis {op}: {e}")
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        if time.monotonic() < self._down_until:
+            self._count("misses")
+            return None
+        try:
+            value = self._client.get(self.prefix + key_str(key))
+        except redis.RedisError as e:
+            self._failed("get", e)
+            self._count("misses")
+            return None
+        self._count("hits" if value is not None else "misses")
+        return value
+
+    def set(self, key: Hashable, value: bytes):
+        if time.monotonic() < self._down_until:
+            return
+        try:
+            self._client.set(self.prefix + key_str(key), value, ex=int(self.ttl) if self.ttl else None)
+        except redis.RedisError as e:
+            self._failed("set", e)
+            return
+        self._count("sets")
+
+    def delete(self, key: Hashable):
+        try:
+            self._client.delete(self.prefix + key_str(key))
+        except redis.RedisError as e:
+            self._failed("delete", e)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+        s["url"] = self.url
+        s["available"] = time.monotonic() >= self._down_until
+        if s["available"]:
+            try:
+                s["evictions"] = int(self._client.info("stats").get("evicted_keys", 0))
+            except redis.RedisError:
+                s["evictions"] = None
+        lookups = s["hits"] + s["misses"]
+        s["hit_ratio"] = s["hits"] / lookups if lookups else 0.0
+        return s
+
+
+# Кодеки значений для общих уровней (там хранятся байты)
+CODECS: Dict[str, Tuple[Callable[[Any], bytes], Callable[[bytes], Any]]] = {
+    "bytes": (bytes, bytes),
+    "json": (lambda v: json.dumps(v, ensure_ascii=False).encode("utf-8"), lambda b: json.loads(b)),
+}
+
+
+class TieredCache:
+    """
+    Уровни кэша по порядку: первый — LRUCache процесса, дальше — общие (байты).
+    get: первый найденный результат поднимается на верхние уровни; set: во все уровни.
+    Общие уровни — блокирующий ввод-вывод: из async-кода — aget/aset (в потоке).
+    """
+
+    def __init__(self, name: str, memory: LRUCache, shared: List[Any], codec: str = "json"):
+        self.name = name
+        self.memory = memory
+        self.shared = shared
+        self._encode, self._decode = CODECS[codec]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        return self._get_shared(key, default)
+
+    def _get_shared(self, key: Hashable, default: Any) -> Any:
+        for i, tier in enumerate(self.shared):
+            data = tier.get(key)
+            if data is None:
+                continue
+            value = self._decode(data)
+            self.memory.set(key, value)
+            for upper in self.shared[:i]:
+                upper.set(key, data)
+            return value
+        return default
+
+    def set(self, key: Hashable, value: Any):
+        self.memory.set(key, value)
+        if self.shared:
+            data = self._encode(value)
+            for tier in self.shared:
+                tier.set(key, data)
+
+    def delete(self, key: Hashable):
+        self.memory.delete(key)
+        for tier in self.shared:
+            tier.delete(key)
+
+    def delete_stale(self, versions: Dict[int, int]) -> int:
+        """
+        Убирает из памяти процесса записи товаров с версией данных ниже новой
+        (ключ вида (вид, good_id, data_version, ...)). Общие уровни не трогаем:
+        ключи там тоже с версией, устаревшие вытесняются по LRU/размеру.
+        """
+        def stale(key: Hashable) -> bool:
+            return (isinstance(key, tuple) and len(key) >= 3 and key[1] in versions
+                    and key[2] < versions[key[1]])
+        return self.memory.delete_where(stale)
+
+    async def aget(self, key: Hashable, default: Any = None) -> Any:
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if not self.shared:
+            return default
+        return await asyncio.to_thread(self._get_shared, key, default)
+
+    async def aset(self, key: Hashable, value: Any):
+        if not self.shared:
+            self.memory.set(key, value)
+        else:
+            await asyncio.to_thread(self.set, key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        tiers = {"memory": self.memory.stats()}
+        for tier in self.shared:
+            tiers[type(tier).__name__.removesuffix("Cache").lower()] = tier.stats()
+        return {"backend": CACHE_BACKEND, "tiers": tiers}
+
+
+def make_cache(name: str, max_items: int, ttl: Optional[float] = None,
+               max_bytes: Optional[int] = None, sizeof: Optional[Callable[[Any], int]] = None,
+               codec: str = "json", backend: Optional[str] = None) -> TieredCache:
+    """
+    Кэш name: память процесса + общий уровень по CACHE_BACKEND (или backend).
+    Если общий уровень недоступен (нет пакета redis и т.п.) — только память.
+    """
+    backend = (backend or CACHE_BACKEND).lower()
+    memory = LRUCache(max_items, ttl=ttl, max_bytes=max_bytes, sizeof=sizeof)
+    shared = []
+    try:
+        if backend == "sqlite":
+            shared.append(SqliteCache(CACHE_SQLITE_PATH, int(CACHE_SQLITE_MB * 1024 * 1024), ttl, name))
+        elif backend == "redis":
+            shared.append(RedisCache(CACHE_REDIS_URL, ttl, name))
+        elif backend != "memory":
+            print(f"[cache] неизвестный CACHE_BACKEND={backend!r}, кэш {name} — только в памяти")
+    except Exception as e:
+        print(f"[cache] общий уровень {backend} для {name} недоступен, только память: {e}")
+    return TieredCache(name, memory, shared, codec)
+
+
+class SingleFlight:
+    """
+    do(key, fn): если такой же ключ уже считается — ждём его результата,
+    иначе запускаем fn() задачей. Результат (или ошибка) достаётся всем ожидающим;
+    отмена одного клиента (разрыв соединения) общий вызов не отменяет.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        return len(self._inflight)
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+# ttr_core/db.py — пулы соединений с PostgreSQL
+#
+# Один пул на процесс: ограниченный min/max, проверка «живости» соединений
+# после простоя, переиспользование одного соединения в рамках запроса и
+# метрики ожидания/насыщения пула.
+#   pool       — синхронный (psycopg2), для скриптов и фоновых задач;
+#   async_pool — асинхронный (psycopg 3), для async-эндпоинтов api.py.
+
+import os
+import time
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, List, Tuple
+
+import psycopg
+import psycopg2
+from psycopg.conninfo import make_conninfo
+from psycopg2 import pool as pg_pool
+
+# =============================
+# Настройки БД (совпадают с app.py)
+# =============================
+DB_HOST = os.environ.get("PGHOST", "localhost")
+DB_PORT = int(os.environ.get("PGPORT", "5433"))
+DB_NAME = os.environ.get("PGDATABASE", "Hackaton")
+DB_USER = os.environ.get("PGUSER", "postgres")
+DB_PASS = os.environ.get("PGPASSWORD", "123")
+DB_SCHEMA = "ttr"
+
+# Параметры пула
+POOL_MIN = int(os.environ.get("PGPOOL_MIN", "1"))
+POOL_MAX = int(os.environ.get("PGPOOL_MAX", "10"))
+POOL_TIMEOUT = float(os.environ.get("PGPOOL_TIMEOUT", "10"))        # сек ожидания свободного соединения
+POOL_CHECK_IDLE = float(os.environ.get("PGPOOL_CHECK_IDLE", "30"))  # сек простоя, после которых делаем SELECT 1
+
+
+class PoolTimeout(Exception):
+    """Свободное соединение не появилось за POOL_TIMEOUT секунд."""
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул поверх psycopg2.ThreadedConnectionPool.
+
+    psycopg2 при исчерпании пула сразу бросает PoolError, поэтому ожидание
+    реализовано семафором на max соединений — заодно это даёт честную метрику
+    времени ожидания.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float, check_idle: float, **dsn):
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._dsn = dsn
+        self._pool: Optional[pg_pool.ThreadedConnectionPool] = None
+        self._sem = threading.BoundedSemaphore(self.maxconn)
+        self._lock = threading.Lock()
+        self._last_used: Dict[int, float] = {}
+        self._stats = {
+            "acquired": 0,
+            "in_use": 0,
+            "in_use_peak": 0,
+            "waiting": 0,
+            "timeouts": 0,
+            "wait_total_s": 0.0,
+            "wait_max_s": 0.0,
+            "health_checks": 0,
+            "reconnects": 0,
+        }
+
+    # ---------- служебное ----------
+    def _ensure_pool(self) -> pg_pool.ThreadedConnectionPool:
+        # создаём лениво: импорт api.py не должен требовать живой БД
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = pg_pool.ThreadedConnectionPool(self.minconn, self.maxconn, **self._dsn)
+        return self._pool
+
+    def _is_alive(self, conn) -> bool:
+        if conn.closed:
+            return False
+        idle = time.monotonic() - self._last_used.get(id(conn), 0.0)
+        if idle < self.check_idle:
+            return True
+        with self._lock:
+            self._stats["health_checks"] += 1
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    # ---------- выдача/возврат ----------
+    def getconn(self):
+        t0 = time.perf_counter()
+        with self._lock:
+            self._stats["waiting"] += 1
+        ok = self._sem.acquire(timeout=self.timeout)
+        waited = time.perf_counter() - t0
+        with self._lock:
+            self._stats["waiting"] -= 1
+            self._stats["wait_total_s"] += waited
+            self._stats["wait_max_s"] = max(self._stats["wait_max_s"], waited)
+            if not ok:
+                self._stats["timeouts"] += 1
+        if not ok:
+            raise PoolTimeout(f"нет свободного соединения за {self.timeout:.1f} c (max={self.maxconn})")
+
+        try:
+            pool = self._ensure_pool()
+            conn = pool.getconn()
+            if not self._is_alive(conn):
+                pool.putconn(conn, close=True)
+                self._last_used.pop(id(conn), None)
+                conn = pool.getconn()
+                with self._lock:
+                    self._stats["reconnects"] += 1
+        except Exception:
+            self._sem.release()
+            raise
+
+        with self._lock:
+            self._stats["acquired"] += 1
+            self._stats["in_use"] += 1
+            self._stats["in_use_peak"] = max(self._stats["in_use_peak"], self._stats["in_use"])
+        return conn
+
+    def putconn(self, conn, close: bool = False):
+        try:
+            if not conn.closed and not close:
+                # только чтение: закрываем неявно открытую транзакцию
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+            self._last_used[id(conn)] = time.monotonic()
+            self._ensure_pool().putconn(conn, close=close or bool(conn.closed))
+            if close or conn.closed:
+                self._last_used.pop(id(conn), None)
+        finally:
+            with self._lock:
+                self._stats["in_use"] -= 1
+            self._sem.release()
+
+    # ---------- контекстные менеджеры ----------
+    @contextmanager
+    def connection(self):
+        """
+        Соединение для одного запроса к БД. Если вызывающий код находится внутри
+        request_scope(), возвращается уже взятое соединение запроса.
+        """
+        conn = _request_conn.get()
+        if conn is not None:
+            yield conn
+            return
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except psycopg2.OperationalError:
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    @contextmanager
+    def request_scope(self):
+        """Одно соединение на весь HTTP-запрос: все fetch_* внутри используют его."""
+        if _request_conn.get() is not None:
+            yield _request_conn.get()
+            return
+        with self.connection() as conn:
+            token = _request_conn.set(conn)
+            try:
+                yield conn
+            finally:
+                _request_conn.reset(token)
+
+    # ---------- метрики ----------
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+        s["min"] = self.minconn
+        s["max"] = self.maxconn
+        s["saturation"] = s["in_use"] / self.maxconn
+        s["wait_avg_s"] = s["wait_total_s"] / s["acquired"] if s["acquired"] else 0.0
+        return s
+
+    def health_check(self) -> bool:
+        try:
+            with self.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                    return cur.fetchone() == (1,)
+        except (psycopg2.Error, PoolTimeout):
+            return False
+
+    def closeall(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                self._last_used.clear()
+
+
+class AsyncConnectionPool:
+    """
+    Асинхронный аналог ConnectionPool на psycopg.AsyncConnection:
+    те же лимиты, проверка после простоя и те же метрики (см. stats()).
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float, check_idle: float, conninfo: str):
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn, self.minconn)
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._conninfo = conninfo
+        self._sem = asyncio.BoundedSemaphore(self.maxconn)
+        self._idle: List[Tuple[psycopg.AsyncConnection, float]] = []
+        self._stats = {
+            "acquired": 0,
+            "in_use": 0,
+            "in_use_peak": 0,
+            "waiting": 0,
+            "timeouts": 0,
+            "wait_total_s": 0.0,
+            "wait_max_s": 0.0,
+            "health_checks": 0,
+            "reconnects": 0,
+        }
+
+    async def open(self):
+        """Прогрев: держим minconn готовых соединений."""
+        while len(self._idle) < self.minconn:
+            self._idle.append((await psycopg.AsyncConnection.connect(self._conninfo), time.monotonic()))
+
+    async def _take_idle(self) -> Optional[psycopg.AsyncConnection]:
+        while self._idle:
+            conn, last_used = self._idle.pop()
+            if conn.closed:
+                continue
+            if time.monotonic() - last_used < self.check_idle:
+                return conn
+            self._stats["health_checks"] += 1
+            try:
+                await conn.execute("SELECT 1")
+                await conn.rollback()
+                return conn
+            except psycopg.Error:
+                self._stats["reconnects"] += 1
+                await conn.close()
+        return None
+
+    async def getconn(self) -> psycopg.AsyncConnection:
+        t0 = time.perf_counter()
+        self._stats["waiting"] += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), timeout=self.timeout)
+            ok = True
+        except asyncio.TimeoutError:
+            ok = False
+        waited = time.perf_counter() - t0
+        self._stats["waiting"] -= 1
+        self._stats["wait_total_s"] += waited
+        self._stats["wait_max_s"] = max(self._stats["wait_max_s"], waited)
+        if not ok:
+            self._stats["timeouts"] += 1
+            raise PoolTimeout(f"нет свободного соединения за {self.timeout:.1f} c (max={self.maxconn})")
+
+        try:
+            conn = await self._take_idle()
+            if conn is None:
+                conn = await psycopg.AsyncConnection.connect(self._conninfo)
+        except BaseException:
+            self._sem.release()
+            raise
+
+        self._stats["acquired"] += 1
+        self._stats["in_use"] += 1
+        self._stats["in_use_peak"] = max(self._stats["in_use_peak"], self._stats["in_use"])
+        return conn
+
+    async def putconn(self, conn: psycopg.AsyncConnection, close: bool = False):
+        try:
+            if not conn.closed and not close:
+                try:
+                    await conn.rollback()
+                except psycopg.Error:
+                    close = True
+            if close or conn.closed:
+                await conn.close()
+            else:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            self._stats["in_use"] -= 1
+            self._sem.release()
+
+    @asynccontextmanager
+    async def connection(self):
+        """Соединение для запроса к БД; внутри request_scope() — соединение текущего запроса."""
+        conn = _async_request_conn.get()
+        if conn is not None:
+            yield conn
+            return
+        conn = await self.getconn()
+        broken = False
+        try:
+            yield conn
+        except psycopg.OperationalError:
+            broken = True
+            raise
+        finally:
+            await self.putconn(conn, close=broken)
+
+    @asynccontextmanager
+    async def request_scope(self):
+        if _async_request_conn.get() is not None:
+            yield _async_request_conn.get()
+            return
+        async with self.connection() as conn:
+            token = _async_request_conn.set(conn)
+            try:
+                yield conn
+            finally:
+                _async_request_conn.reset(token)
+
+    def stats(self) -> Dict[str, Any]:
+        s = dict(self._stats)
+        s["min"] = self.minconn
+        s["max"] = self.maxconn
+        s["idle"] = len(self._idle)
+        s["saturation"] = s["in_use"] / self.maxconn
+        s["wait_avg_s"] = s["wait_total_s"] / s["acquired"] if s["acquired"] else 0.0
+        return s
+
+    async def health_check(self) -> bool:
+        try:
+            async with self.connection() as conn:
+                cur = await conn.execute("SELECT 1")
+                return (await cur.fetchone()) == (1,)
+        except (psycopg.Error, OSError, PoolTimeout):
+            return False
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            await conn.close()
+
+
+_request_conn: ContextVar = ContextVar("ttr_request_conn", default=None)
+_async_request_conn: ContextVar = ContextVar("ttr_async_request_conn", default=None)
+
+pool = ConnectionPool(
+    POOL_MIN, POOL_MAX, POOL_TIMEOUT, POOL_CHECK_IDLE,
+    host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASS,
+)
+
+# строка подключения psycopg 3 (async-пул, подписка LISTEN в ttr_core/events.py)
+DB_CONNINFO = make_conninfo(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASS)
+
+async_pool = AsyncConnectionPool(POOL_MIN, POOL_MAX, POOL_TIMEOUT, POOL_CHECK_IDLE, DB_CONNINFO)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# ttr_core/doccache.py — кэш готовых DOCX (справка, обращение в «Моспром»)
+#
+# Ключ: (вид документа, товар, версия данных товара, версия шаблона).
+#   - память: LRU с бюджетом в байтах (DOC_CACHE_MEM_MB);
+#   - redis:  при CACHE_BACKEND=redis — общий уровень между памятью и диском (ttr_core/cache.py);
+#   - диск:   каталог DOC_CACHE_DIR с бюджетом DOC_CACHE_DISK_MB, переживает рестарт API
+#             и общий для всех воркеров хоста (поэтому уровень sqlite здесь не нужен).
+# Версия данных растёт при каждой загрузке parser.py, поэтому изменившийся товар
+# просто получает новый ключ; старые файлы товара удаляются при записи нового
+# или сразу по уведомлению о загрузке (delete_stale, см. ttr_core/events.py).
+# Версия шаблона — хэш исходного кода функций сборки DOCX: правка шаблона
+# сама инвалидирует кэш.
+
+import os
+import re
+import inspect
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, Tuple
+
+from ttr_core import logic
+from ttr_core.cache import make_cache, CACHE_BACKEND
+
+DOC_CACHE_MEM_MB = float(os.environ.get("DOC_CACHE_MEM_MB", "64"))
+DOC_CACHE_DISK_MB = float(os.environ.get("DOC_CACHE_DISK_MB", "512"))
+DOC_CACHE_DIR = os.environ.get("DOC_CACHE_DIR", str(Path(__file__).resolve().parent.parent / ".cache" / "docx"))
+
+
+def _template_version() -> str:
+    src = "".join(inspect.getsource(f) for f in (
+        logic._tariff_line_for_text, logic.build_brief_docx, logic.build_mosprom_docx,
+    ))
+    return hashlib.sha1(src.encode("utf-8")).hexdigest()[:12]
+
+DOCX_TEMPLATE_VERSION = os.environ.get("DOCX_TEMPLATE_VERSION") or _template_version()
+
+DocKey = Tuple[str, int, int]  # (вид, good_id, data_version)
+
+_DOC_FILE = re.compile(r"^(?P<kind>\w+?)_(?P<good_id>\d+)_v(?P<version>\d+)_")  # см. DocCache._path
+
+# Виды документов: префикс имени файла и функция сборки
+DOC_KINDS = {
+    "report":  ("Spravka", logic.build_brief_docx),
+    "mosprom": ("Mosprom", logic.build_mosprom_docx),
+}
+
+def doc_filename(kind: str, hs_code: str) -> str:
+    return f"{DOC_KINDS[kind][0]}_{(hs_code or '').replace(' ', '')}.docx"
+
+def render_doc(kind: str, good, measures, summary, tariffs, imports) -> bytes:
+    """Сборка DOCX в байты (верхнеуровневая функция — годится для ProcessPoolExecutor)."""
+    return DOC_KINDS[kind][1](good, measures, summary, tariffs, imports).getvalue()
+
+
+class DocCache:
+    """Двухуровневый кэш байтов DOCX: память → диск. Потокобезопасный."""
+
+    def __init__(self, mem_bytes: int, disk_bytes: int, directory: str,
+                 template_version: str = DOCX_TEMPLATE_VERSION):
+        self.template_version = template_version
+        self.mem = make_cache("docx", max_items=100_000, max_bytes=mem_bytes, sizeof=len, codec="bytes",
+                              backend="redis" if CACHE_BACKEND == "redis" else "memory")
+        self.disk_bytes = disk_bytes
+        self.dir = Path(directory)
+        self._lock = threading.Lock()
+        self._stats = {"disk_hits": 0, "disk_misses": 0, "disk_writes": 0, "disk_evictions": 0,
+                       "disk_errors": 0}
+
+    def _path(self, key: DocKey) -> Path:
+        kind, good_id, data_version = key
+        return self.dir / f"{kind}_{good_id}_v{data_version}_{self.template_version}.docx"
+
+    def _mem_key(self, key: DocKey) -> Tuple[str, int, int, str]:
+        # версия шаблона в ключе: общий уровень (redis) переживает рестарт с новым шаблоном
+        return (*key, self.template_version)
+
+    def get(self, key: DocKey) -> Optional[bytes]:
+        data = self.mem.get(self._mem_key(key))
+        if data is not None:
+            return data
+        if self.disk_bytes <= 0:
+            return None
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # mtime = последнее использование (для вытеснения с диска)
+        except FileNotFoundError:
+            with self._lock:
+                self._stats["disk_misses"] += 1
+            return None
+        except OSError as e:
+            print(f"[doccache] не удалось прочитать {key}: {e}")
+            with self._lock:
+                self._stats["disk_errors"] += 1
+            return None
+        with self._lock:
+            self._stats["disk_hits"] += 1
+        self.mem.set(self._mem_key(key), data)
+        return data
+
+    def put(self, key: DocKey, data: bytes):
+        self.mem.set(self._mem_key(key), data)
+        if self.disk_bytes <= 0 or len(data) > self.disk_bytes:
+            return
+        kind, good_id, _ = key
+        path = self._path(key)
+        try:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            # атомарная запись: другой процесс API не увидит недописанный файл
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+            # прежние версии этого документа по товару больше не нужны
+            for old in self.dir.glob(f"{kind}_{good_id}_v*.docx"):
+                if old != path:
+                    old.unlink(missing_ok=True)
+        except OSError as e:
+            print(f"[doccache] не удалось записать {key}: {e}")
+            with self._lock:
+                self._stats["disk_errors"] += 1
+            return
+        with self._lock:
+            self._stats["disk_writes"] += 1
+        self._prune_disk()
+
+    def _prune_disk(self):
+        """Держим каталог в пределах бюджета: удаляем самые давние файлы."""
+        try:
+            files = [(p.stat(), p) for p in self.dir.glob("*.docx")]
+        except OSError:
+            return
+        total = sum(st.st_size for st, _ in files)
+        if total <= self.disk_bytes:
+            return
+        for st, p in sorted(files, key=lambda x: x[0].st_mtime):
+            if total <= self.disk_bytes:
+                break
+            try:
+                p.unlink()
+                total -= st.st_size
+                with self._lock:
+                    self._stats["disk_evictions"] += 1
+            except OSError:
+                pass
+
+    def delete_stale(self, versions: Dict[int, int]) -> int:
+        """Документы товаров по версиям данных ниже новых: из памяти процесса и с диска."""
+        dropped = self.mem.delete_stale(versions)
+        if self.disk_bytes <= 0 or not self.dir.is_dir():
+            return dropped
+        for path in self.dir.glob("*.docx"):
+            m = _DOC_FILE.match(path.name)
+            if m and int(m["good_id"]) in versions and int(m["version"]) < versions[int(m["good_id"])]:
+                try:
+                    path.unlink()
+                    dropped += 1
+                except OSError:
+                    pass
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+        s["tiers"] = self.mem.stats()["tiers"]
+        s["template_version"] = self.template_version
+        s["dir"] = str(self.dir)
+        return s
+
+
+doc_cache = DocCache(
+    mem_bytes=int(DOC_CACHE_MEM_MB * 1024 * 1024),
+    disk_bytes=int(DOC_CACHE_DISK_MB * 1024 * 1024),
+    directory=DOC_CACHE_DIR,
+)
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+# ttr_core/events.py — уведомления об изменении данных (PostgreSQL LISTEN/NOTIFY)
+#
+# parser.py в транзакции загрузки вызывает notify_changed: pg_notify с версиями
+# изменившихся товаров. PostgreSQL доставляет уведомления только после COMMIT
+# (и не доставляет при откате), поэтому подписчик не увидит событие раньше данных.
+# Подписчики сбрасывают кэши только по затронутым товарам, без TTL и рестартов:
+#   DataListener         — asyncio + psycopg 3 (api.py);
+#   ThreadedDataListener — фоновый поток + psycopg2 (app.py, Streamlit).
+# Уведомления, пришедшие во время разрыва соединения, теряются, поэтому после
+# каждого (пере)подключения подписчик получает DataChange(resync=True) — сбросить всё.
+#
+# Формат payload (JSON, ≤ 8000 байт — длинные списки режутся на части):
+#   {"goods": {"<good_id>": <версия данных>, ...}, "catalog": true|false}
+
+import os
+import json
+import time
+import select
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Any, Optional
+
+DATA_CHANNEL = os.environ.get("DATA_CHANNEL", "ttr_data_changed")
+NOTIFY_CHUNK = 400                                            # товаров в одном уведомлении
+LISTEN_RETRY_S = float(os.environ.get("LISTEN_RETRY_S", "5"))  # пауза перед переподключением
+LISTEN_POLL_S = 1.0                                           # период проверки остановки потока
+
+
+@dataclass
+class DataChange:
+    """Событие загрузки: новые версии товаров, изменение справочника, полный сброс."""
+    goods: Dict[int, int] = field(default_factory=dict)  # good_id → новая версия данных
+    catalog: bool = False   # добавились товары / изменились коды и названия
+    resync: bool = False    # уведомления могли потеряться — кэши надо сбросить целиком
+
+
+def notify_changed(cur, versions: Dict[int, int], catalog: bool = False) -> int:
+    """Уведомления в транзакции загрузки (уйдут подписчикам после COMMIT). Возвращает их число."""
+    items = sorted((int(g), int(v)) for g, v in versions.items())
+    if not items and not catalog:
+        return 0
+    chunks = [items[i:i + NOTIFY_CHUNK] for i in range(0, len(items), NOTIFY_CHUNK)] or [[]]
+    for chunk in chunks:
+        payload = json.dumps({"goods": {str(g): v for g, v in chunk}, "catalog": catalog},
+                             separators=(",", ":"))
+        cur.execute("SELECT pg_notify(%s, %s)", (DATA_CHANNEL, payload))
+    return len(chunks)
+
+
+def parse_payload(payload: str) -> DataChange:
+    try:
+        data = json.loads(payload)
+        return DataChange({int(g): int(v) for g, v in (data.get("goods") or {}).items()},
+                          catalog=bool(data.get("catalog")))
+    except (ValueError, TypeError, AttributeError):
+        # незнакомый формат (другая версия загрузчика) — безопаснее сбросить всё
+        return DataChange(resync=True)
+
+
+class _Listener:
+    """Общее: счётчики и вызов обработчика (ошибка обработчика не рвёт подписку)."""
+
+    def __init__(self, handler: Callable[[DataChange], Any], channel: str, name: str):
+        self.handler = handler
+        self.channel = channel
+        self.name = name
+        self._failing = False
+        self._stats: Dict[str, Any] = {"connected": False, "connects": 0, "events": 0, "goods": 0,
+                                       "resyncs": 0, "errors": 0, "last_event_at": None, "last_error": None}
+
+    def _dispatch(self, change: DataChange):
+        self._stats["events"] += 1
+        self._stats["goods"] += len(change.goods)
+        self._stats["resyncs"] += int(change.resync)
+        self._stats["last_event_at"] = time.time()
+        try:
+            self.handler(change)
+        except Exception as e:
+            self._stats["errors"] += 1
+            print(f"[{self.name}] ошибка обработчика уведомления: {e}")
+
+    def _connected(self):
+        self._failing = False
+        self._stats["connected"] = True
+        self._stats["connects"] += 1
+        self._dispatch(DataChange(resync=True))
+
+    def _failed(self, e: Exception):
+        # в лог — только первая ошибка серии, пока БД недоступна, повторы молча
+        if not self._failing:
+            self._failing = True
+            print(f"[{self.name}] подписка на {self.channel} прервана: {str(e).strip()}; "
+                  f"переподключение каждые {LISTEN_RETRY_S:g} c")
+        self._stats["connected"] = False
+        self._stats["errors"] += 1
+        self._stats["last_error"] = str(e).strip()
+
+    @property
+    def connected(self) -> bool:
+        return self._stats["connected"]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"channel": self.channel, **self._stats}
+
+
+class DataListener(_Listener):
+    """Подписка в event loop (psycopg 3): start() → фоновая задача, stop() — отмена."""
+
+    def __init__(self, conninfo: str, handler: Callable[[DataChange], Any], channel: str = DATA_CHANNEL):
+        super().__init__(handler, channel, "events")
+        self.conninfo = conninfo
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> asyncio.Task:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        import psycopg
+        from psycopg import sql
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.conninfo, autocommit=True) as conn:
+                    await conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+                    self._connected()
+                    async for n in conn.notifies():
+                        self._dispatch(parse_payload(n.payload))
+            except asyncio.CancelledError:
+                self._stats["connected"] = False
+                raise
+            except Exception as e:
+                self._failed(e)
+            await asyncio.sleep(LISTEN_RETRY_S)
+
+
+class ThreadedDataListener(_Listener):
+    """Подписка в фоновом потоке (psycopg2): для процессов без event loop (Streamlit)."""
+
+    def __init__(self, connect: Callable[[], Any], handler: Callable[[DataChange], Any],
+                 channel: str = DATA_CHANNEL):
+        super().__init__(handler, channel, "events")
+        self.connect = connect
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "ThreadedDataListener":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="ttr-data-listener", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        from psycopg2 import sql
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self.connect()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+                self._connected()
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], LISTEN_POLL_S) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._dispatch(parse_payload(conn.notifies.pop(0).payload))
+            except Exception as e:
+                self._failed(e)
+                self._stop.wait(LISTEN_RETRY_S)
+            finally:
+                if conn is not None:
+                    conn.close()
+        self._stats["connected"] = False
+
+
+class GoodRevisions:
+    """
+    Счётчики «ревизий» товаров для кэшей, которые нельзя чистить по ключу
+    (st.cache_data): ревизия входит в аргументы кэшируемой функции, событие по
+    товару увеличивает её — пересчитываются только затронутые товары.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._goods: Dict[int, int] = {}
+        self.epoch = 0     # растёт при resync — меняются ревизии всех товаров
+        self.catalog = 0   # ревизия справочника товаров
+
+    def apply(self, change: DataChange):
+        with self._lock:
+            if change.resync:
+                self.epoch += 1
+                self.catalog += 1
+                self._goods.clear()
+                return
+            for g in change.goods:
+                self._goods[g] = self._goods.get(g, 0) + 1
+            if change.catalog:
+                self.catalog += 1
+
+    def of(self, good_id: int) -> tuple:
+        with self._lock:
+            return self.epoch, self._goods.get(int(good_id), 0)
+
+    def catalog_rev(self) -> tuple:
+        with self._lock:
+            return self.epoch, self.catalog
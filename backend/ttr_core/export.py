@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# ttr_core/export.py — потоковая выгрузка строк импорта (ttr.import_values): CSV, Parquet, Arrow IPC
+#
+# GET /api/export/imports?format=csv|parquet|arrow[&ids=..&hs_prefix=..&year_from=..&year_to=..&country_group=..]
+#
+# Строки читаются серверным (именованным) курсором пачками по EXPORT_BATCH и сразу
+# кодируются в выбранный формат — без pandas и без накопления всей выборки: память
+# процесса не зависит от размера таблицы. Выгрузка идёт по отдельному соединению
+# (не из пула API — долгий поток к медленному клиенту не занимает соединения запросов),
+# одновременно не больше EXPORT_MAX_CONCURRENT выгрузок.
+#   csv     — text/csv, с заголовком; пустые значения — пустые поля;
+#   parquet — группа строк (row group) на пачку, подвал файла — в конце потока;
+#   arrow   — Arrow IPC stream: record batch на пачку (pyarrow.ipc.open_stream).
+# Parquet и Arrow — при установленном pyarrow (pip install pyarrow), CSV — всегда; pyarrow
+# с parquet грузится при первой такой выгрузке, а не при старте API (startup.LAZY_MODULES).
+# В автономном режиме (ttr_core/offline.py) строки берутся из снимка в памяти.
+
+import io
+import os
+import csv
+import asyncio
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from ttr_core.db import DB_SCHEMA
+from ttr_core.bundle import normalize_hs
+from ttr_core.admission import Slot
+
+EXPORT_BATCH = int(os.environ.get("EXPORT_BATCH", "50000"))              # строк на пачку курсора
+EXPORT_MAX_CONCURRENT = int(os.environ.get("EXPORT_MAX_CONCURRENT", "2"))
+
+COLUMNS = ["good_id", "hs_code", "year", "country", "country_group", "value_usd_mln", "value_tons"]
+
+EXPORT_SQL = f"""
+SELECT i.good_id, g.hs_code, i.year, i.country, i.country_group,
+       i.value_usd_mln::float8, i.value_tons::float8
+FROM {DB_SCHEMA}.import_values i
+JOIN {DB_SCHEMA}.goods g ON g.id = i.good_id
+WHERE (%(ids)s::int[] IS NULL OR i.good_id = ANY(%(ids)s::int[]))
+  AND (%(hs)s::text IS NULL OR starts_with(replace(g.hs_code, ' ', ''), %(hs)s))
+  AND (%(year_from)s::int IS NULL OR i.year >= %(year_from)s::int)
+  AND (%(year_to)s::int IS NULL OR i.year <= %(year_to)s::int)
+  AND (%(group)s::text IS NULL OR i.country_group = %(group)s::text)
+ORDER BY i.good_id, i.year, i.country
+"""
+
+
+def export_params(ids: Optional[Sequence[int]] = None, hs_prefix: Optional[str] = None,
+                  year_from: Optional[int] = None, year_to: Optional[int] = None,
+                  country_group: Optional[str] = None) -> Dict[str, Any]:
+    return {"ids": list(ids) if ids is not None else None, "hs": normalize_hs(hs_prefix) or None,
+            "year_from": year_from, "year_to": year_to, "group": country_group}
+
+
+class ExportSlots:
+    """
+    Ограничение одновременных выгрузок: try_acquire() проверяет и занимает слот одним
+    шагом (без await — атомарно в event loop); None — все заняты. Slot.release() идемпотентен.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.active = 0
+
+    def try_acquire(self) -> Optional[Slot]:
+        if self.active >= self.limit:
+            return None
+        self.active += 1
+        return Slot(self, "export", 0.0)
+
+    def _release(self, slot: Slot):
+        self.active -= 1
+
+# =============================
+# Форматы
+# =============================
+class _Sink:
+    """Файлоподобный приёмник для pyarrow: записанное забирается после каждой пачки (drain)."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+class CsvEncoder:
+    media_type = "text/csv; charset=utf-8"
+    suffix = "csv"
+
+    def start(self) -> bytes:
+        return self._encode([COLUMNS])
+
+    def batch(self, rows: Sequence[tuple]) -> bytes:
+        return self._encode(rows)
+
+    def finish(self) -> bytes:
+        return b""
+
+    @staticmethod
+    def _encode(rows) -> bytes:
+        buf = io.StringIO()
+        csv.writer(buf, lineterminator="\n").writerows(rows)
+        return buf.getvalue().encode("utf-8")
+
+
+def _pyarrow():
+    """pyarrow с ipc и parquet; ImportError — не установлен."""
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+    return pyarrow
+
+
+class _ArrowEncoder:
+    """Общее для Parquet и Arrow IPC: пачка строк → pyarrow.RecordBatch по схеме SCHEMA."""
+
+    def __init__(self):
+        self.sink = _Sink()
+        self.writer = None
+        self.pa = _pyarrow()
+
+    def schema(self):
+        pa = self.pa
+        return pa.schema([("good_id", pa.int32()), ("hs_code", pa.string()), ("year", pa.int32()),
+                          ("country", pa.string()), ("country_group", pa.string()),
+                          ("value_usd_mln", pa.float64()), ("value_tons", pa.float64())])
+
+    def record_batch(self, rows: Sequence[tuple]):
+        pa = self.pa
+        schema = self.schema()
+        columns = list(zip(*rows))
+        return pa.RecordBatch.from_arrays(
+            [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema)
+
+    def start(self) -> bytes:
+        return self.sink.drain()
+
+    def finish(self) -> bytes:
+        self.writer.close()
+        return self.sink.drain()
+
+
+class ArrowEncoder(_ArrowEncoder):
+    media_type = "application/vnd.apache.arrow.stream"
+    suffix = "arrows"
+
+    def __init__(self):
+        super().__init__()
+        self.writer = self.pa.ipc.new_stream(self.sink, self.schema())
+
+    def batch(self, rows: Sequence[tuple]) -> bytes:
+        self.writer.write_batch(self.record_batch(rows))
+        return self.sink.drain()
+
+
+class ParquetEncoder(_ArrowEncoder):
+    media_type = "application/vnd.apache.parquet"
+    suffix = "parquet"
+
+    def __init__(self):
+        super().__init__()
+        self.writer = self.pa.parquet.ParquetWriter(self.sink, self.schema(), compression="zstd")
+
+    def batch(self, rows: Sequence[tuple]) -> bytes:
+        self.writer.write_batch(self.record_batch(rows))
+        return self.sink.drain()
+
+
+ENCODERS = {"csv": CsvEncoder, "parquet": ParquetEncoder, "arrow": ArrowEncoder}
+
+
+def make_encoder(fmt: str):
+    """Кодировщик формата; LookupError — формат требует pyarrow, а он не установлен."""
+    try:
+        return ENCODERS[fmt]()
+    except ImportError:
+        raise LookupError(f"формат {fmt} требует pyarrow (pip install pyarrow); доступен csv")
+
+# =============================
+# Источники строк
+# =============================
+async def db_batches(conninfo: str, params: Dict[str, Any], batch: int = EXPORT_BATCH) -> AsyncIterator[List[tuple]]:
+    """Пачки строк серверным курсором по отдельному соединению (закрывается по окончании)."""
+    import psycopg
+    async with await psycopg.AsyncConnection.connect(conninfo) as conn:
+        async with conn.transaction():
+            await conn.execute("SET TRANSACTION READ ONLY")
+            async with conn.cursor(name="ttr_export") as cur:
+                cur.itersize = batch
+                await cur.execute(EXPORT_SQL, params)
+                while True:
+                    rows = await cur.fetchmany(batch)
+                    if not rows:
+                        break
+                    yield rows
+
+
+def snapshot_batches(snap, params: Dict[str, Any], batch: int = EXPORT_BATCH) -> Iterator[List[tuple]]:
+    """Те же строки из снимка в памяти (автономный режим): товары по возрастанию id, год, страна."""
+    goods = snap.goods_index(params["ids"], params["hs"])
+    table = snap.tables["imports"]
+    out: List[tuple] = []
+    for gid in goods["id"].tolist():
+        k = snap.position(gid)
+        hs, span = snap.hs_code[k], table.span(k)
+        cols = [table.pylist(c, span) for c in ("year", "country", "country_group", "value_usd_mln", "value_tons")]
+        rows = sorted((r for r in zip(*cols)
+                       if (params["year_from"] is None or r[0] >= params["year_from"])
+                       and (params["year_to"] is None or r[0] <= params["year_to"])
+                       and (params["group"] is None or r[2] == params["group"])),
+                      key=lambda r: (r[0], r[1] is None, r[1] or ""))
+        out.extend((gid, hs, *r) for r in rows)
+        if len(out) >= batch:
+            yield out
+            out = []
+    if out:
+        yield out
+
+
+async def stream(encoder, batches) -> AsyncIterator[bytes]:
+    """
+    Байты ответа: начало формата, пачки, конец. Кодирование (и чтение снимка) — в потоке,
+    чтобы сборка пачки не задерживала event loop; batches — async или обычный итератор.
+    """
+    yield encoder.start()
+    if hasattr(batches, "__aiter__"):
+        # aclosing: при обрыве ответа курсор и соединение закрываются сразу, а не сборщиком мусора
+        async with aclosing(batches):
+            async for rows in batches:
+                yield await asyncio.to_thread(encoder.batch, rows)
+    else:
+        it = iter(batches)
+        while (rows := await asyncio.to_thread(next, it, None)) is not None:
+            yield await asyncio.to_thread(encoder.batch, rows)
+    yield await asyncio.to_thread(encoder.finish)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# ttr_core/jobs.py — очередь фоновых заданий на пакетную генерацию DOCX
+#
+# Задание: список товаров × виды документов → ZIP-архив. Данные грузятся пачками
+# (как в POST /api/goods/dashboards), документы собираются в пуле процессов
+# по числу ядер — CPU-тяжёлая сборка python-docx не делит GIL и потоки
+# с интерактивными эндпоинтами. Готовые байты кладутся и в doc_cache, так что
+# последующие одиночные скачивания тех же документов — попадания в кэш.
+# Если API держит снимок данных (ttr_core/snapshot.py), пачки берутся из него, без БД.
+
+import os
+import time
+import uuid
+import asyncio
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Sequence, Callable
+
+from ttr_core.db import async_pool
+from ttr_core.bundle import load_goods_index_async, load_bulk_async
+from ttr_core.doccache import doc_cache, doc_filename, render_doc
+from ttr_core.metrics import span
+from ttr_core import store
+
+DOC_JOB_WORKERS = int(os.environ.get("DOC_JOB_WORKERS", "0")) or (os.cpu_count() or 2)
+DOC_JOB_CHUNK = int(os.environ.get("DOC_JOB_CHUNK", "100"))          # товаров на пачку загрузки
+DOC_JOB_MAX_GOODS = int(os.environ.get("DOC_JOB_MAX_GOODS", "5000"))
+DOC_JOB_TTL = float(os.environ.get("DOC_JOB_TTL", "3600"))           # сек хранения готового задания
+DOC_JOB_DIR = os.environ.get("DOC_JOB_DIR", str(Path(__file__).resolve().parent.parent / ".cache" / "jobs"))
+
+
+@dataclass
+class DocJob:
+    id: str
+    goods: Optional[List[int]]
+    hs_prefix: Optional[str]
+    kinds: List[str]
+    status: str = "queued"          # queued → running → done | failed
+    total: int = 0                  # документов всего (известно после отбора товаров)
+    done: int = 0
+    failed: int = 0
+    errors: List[str] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    zip_path: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "kinds": self.kinds,
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "progress": round((self.done + self.failed) / self.total, 4) if self.total else 0.0,
+            "errors": self.errors[:20],
+            "elapsed_s": round(elapsed, 3),
+            "docs_per_s": round(self.done / elapsed, 2) if elapsed > 0 else None,
+        }
+
+
+class DocJobManager:
+    """Задания в памяти процесса API + общий пул процессов для сборки."""
+
+    def __init__(self, workers: int, directory: str):
+        self.workers = max(1, workers)
+        self.dir = Path(directory)
+        self.jobs: Dict[str, DocJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # текущий снимок данных (ttr_core/snapshot.py), если API его держит: тогда без БД
+        self.snapshot: Callable[[], Any] = lambda: None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # создаём лениво; spawn — воркеры не наследуют потоки и соединения процесса API
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def submit(self, goods: Optional[Sequence[int]], hs_prefix: Optional[str], kinds: Sequence[str]) -> DocJob:
+        self.purge()
+        job = DocJob(id=uuid.uuid4().hex, goods=list(goods) if goods is not None else None,
+                     hs_prefix=hs_prefix, kinds=list(kinds))
+        self.jobs[job.id] = job
+        self._tasks[job.id] = asyncio.get_running_loop().create_task(self._run(job))
+        return job
+
+    def get(self, job_id: str) -> Optional[DocJob]:
+        return self.jobs.get(job_id)
+
+    def purge(self):
+        """Удаляет завершённые задания старше DOC_JOB_TTL вместе с архивами."""
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished_at and now - job.finished_at > DOC_JOB_TTL:
+                if job.zip_path:
+                    Path(job.zip_path).unlink(missing_ok=True)
+                self.jobs.pop(job_id, None)
+                self._tasks.pop(job_id, None)
+
+    async def _run(self, job: DocJob):
+        job.status = "running"
+        job.started_at = time.time()
+        loop = asyncio.get_running_loop()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        path = self.dir / f"{job.id}.zip"
+        tmp = path.with_suffix(".tmp")
+        names = set()
+        snap = self.snapshot()
+        try:
+            if snap is not None:
+                goods = snap.goods_index(job.goods, job.hs_prefix, limit=DOC_JOB_MAX_GOODS)
+            else:
+                async with async_pool.connection() as conn:
+                    goods = await load_goods_index_async(conn, job.goods, job.hs_prefix,
+                                                         limit=DOC_JOB_MAX_GOODS)
+            job.total = len(goods) * len(job.kinds)
+
+            # DOCX уже сжат (zip внутри) — повторное сжатие только тратит CPU;
+            # документы пишутся в архив по мере готовности, в памяти их не копим
+            with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_STORED) as zf:
+                for start in range(0, len(goods), DOC_JOB_CHUNK):
+                    chunk = goods.iloc[start:start + DOC_JOB_CHUNK]
+                    if snap is not None:
+                        bundles = [snap.bundle(g) for g in chunk["id"].tolist()]
+                    else:
+                        bundles = await self._load_chunk(chunk)
+
+                    pending = [self._render(loop, b, k) for b in bundles for k in job.kinds]
+                    for fut in asyncio.as_completed(pending):
+                        try:
+                            bundle, kind, data = await fut
+                        except Exception as e:
+                            job.failed += 1
+                            job.errors.append(str(e))
+                            continue
+                        name = doc_filename(kind, bundle.good["hs_code"])
+                        if name in names:
+                            name = name.replace(".docx", f"_{bundle.good_id}.docx")
+                        names.add(name)
+                        await loop.run_in_executor(None, zf.writestr, name, data)
+                        job.done += 1
+            os.replace(tmp, path)
+            job.zip_path = str(path)
+            job.status = "failed" if job.total and not job.done else "done"
+        except Exception as e:
+            job.status = "failed"
+            job.errors.append(str(e))
+            tmp.unlink(missing_ok=True)
+            print(f"[jobs] задание {job.id} упало: {e}")
+        finally:
+            job.finished_at = time.time()
+            print(f"[jobs] задание {job.id}: {job.status}, документов {job.done}/{job.total}, "
+                  f"ошибок {job.failed}, {job.finished_at - job.started_at:.1f} c")
+
+    async def _load_chunk(self, chunk) -> List:
+        async with async_pool.connection() as conn:
+            bulk = await load_bulk_async(conn, chunk)
+            bundles = list(bulk.bundles())
+            computed = store.fill_missing(bundles, bulk)
+            if computed:
+                try:
+                    await store.save_many_async(conn, computed)
+                    await conn.commit()
+                except Exception as e:
+                    await conn.rollback()
+                    print(f"[jobs] рекомендации пачки не сохранены: {e}")
+        return bundles
+
+    async def _render(self, loop, bundle, kind: str):
+        """Документ из doc_cache или сборка в пуле процессов (результат — в doc_cache)."""
+        key = (kind, bundle.good_id, bundle.data_version)
+        data = await loop.run_in_executor(None, doc_cache.get, key)
+        if data is None:
+            rec = bundle.recommendation
+            pool = self._pool()
+            try:
+                with span(f"docx_{kind}"):
+                    data = await loop.run_in_executor(
+                        pool, render_doc, kind, bundle.good, rec.measures, rec.summary,
+                        bundle.tariffs, bundle.imports,
+                    )
+            except BrokenProcessPool:
+                # воркер умер (OOM и т.п.) — следующий документ получит новый пул
+                if self._executor is pool:
+                    self._executor = None
+                raise
+            await loop.run_in_executor(None, doc_cache.put, key, data)
+        return bundle, kind, data
+
+    def shutdown(self):
+        for task in self._tasks.values():
+            task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+doc_jobs = DocJobManager(DOC_JOB_WORKERS, DOC_JOB_DIR)
@@ -4,19 +4,30 @@
 import os
 import io
 import re
+import json
 import random
-from typing import List, Tuple, Optional, Dict, Any
+import bisect
+import hashlib
+from typing import List, Tuple, Optional, Dict, Any, AsyncIterator, TYPE_CHECKING
 
 import numpy as np
 import pandas as pd
-import requests
-from docx import Document
+
+# python-docx, requests и httpx импортируются при первом использовании (сборка DOCX,
+# запрос к LLM): модуль подключают и API, и CLI, и старт не должен платить за них
+if TYPE_CHECKING:
+    import httpx
 
 # =============================
 # Настройки LLM (как в app.py)
 # =============================
 OPENAI_BASE = os.environ.get("OPENAI_BASE", "http://26.81.18.206:1234/v1")
 CHAT_MODEL  = os.environ.get("CHAT_MODEL", "meta-llama-3.1-8b-instruct")
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "120"))
+# Детерминированный режим: фиксированные параметры сэмплинга и seed — одинаковый
+# запрос даёт одинаковый ответ, поэтому ответы можно кэшировать (см. api.py)
+LLM_DETERMINISTIC = os.environ.get("LLM_DETERMINISTIC", "0") == "1"
+LLM_SEED = int(os.environ.get("LLM_SEED", "42"))
 
 # Глобальные параметры ответа
 MAX_WORDS_DEFAULT = 160  # лимит слов на ответ (подправь при необходимости)
@@ -78,6 +89,43 @@ def non_tariff_analysis(prod_ge_cons, in_tr, in_1875, in_4114):
 
     return measures, notes
 
+# Ветки с единственной мерой: ветка → (мера, заметка)
+BRANCH_OUTCOMES = {
+    "prod>=cons & NS>=30% & non-decrease":
+        ("Мера 2", "Производство ≥ потреблению, доля «НС» ≥ 30% и не падает → Мера 2"),
+    "prod<cons & NS>=30% & non-decrease":
+        ("Мера 6", "Производство < потребления при доле «НС» ≥ 30% → Мера 6"),
+    "no P/C & NS>=30% & non-decrease":
+        ("Мера 6", "Нет данных по P/C при доле «НС» ≥ 30% → Мера 6"),
+    "bound>applied & prod>=cons":
+        ("Мера 1", "Bound > Applied и производство ≥ потреблению → Мера 1"),
+    "bound>applied & prod<cons":
+        ("Мера 6", "Bound > Applied и производство < потребления → Мера 6"),
+    "applied==bound & prod<cons & growth & top1_skc_ok":
+        ("Мера 3", "Импорт растёт и СКЦ топ-1 ниже других → Мера 3"),
+    "applied==bound & prod<cons & (no growth or no skc cond)":
+        ("Мера 6", "Условие роста/СКЦ не выполнено → Мера 6"),
+    "NS>=30% & decrease":
+        ("Мера 6", "Доля «НС» ≥ 30%, но объём снижается; эскалация не обоснована → Мера 6"),
+}
+
+def recommendation_outcome(branch: str, prod_ge_cons, in_tr, in_1875, in_4114) -> Tuple[List[str], List[str]]:
+    """Меры и заметки по ветке алгоритма (общая часть скалярного и пакетного расчёта)."""
+    if branch in BRANCH_OUTCOMES:
+        m, n = BRANCH_OUTCOMES[branch]
+        measures, notes = [m], [n]
+    elif branch == "applied==bound & prod>=cons → non-tariff":
+        measures, notes = non_tariff_analysis(prod_ge_cons, in_tr, in_1875, in_4114)
+    else:
+        nt_m, nt_n = non_tariff_analysis(prod_ge_cons, in_tr, in_1875, in_4114)
+        measures = nt_m
+        notes = ["Случай вне прямых правил (например bound < applied) → нетарифные варианты"] + nt_n
+
+    # Убираем дубликаты мер и любые вне диапазона 1–6
+    seen = set()
+    measures = [m for m in measures if (m in {f"Мера {i}" for i in range(1,7)}) and not (m in seen or seen.add(m))]
+    return measures, notes
+
 def compute_recommendation(
     tariffs: pd.DataFrame,
     prod_df: pd.DataFrame,
@@ -117,27 +165,20 @@ def compute_recommendation(
     in_1875 = bool(flags_df["in_pp1875"].iloc[0])  if len(flags_df) else False
     in_4114 = bool(flags_df["in_order4114"].iloc[0]) if len(flags_df) else False
 
-    measures, notes = [], []
-
-    # I. Тарифы
+    # I. Тарифы (ветка определяет меры и заметки — см. recommendation_outcome)
     if share_ns >= 30.0 and delta_ns >= 0:
         if prod_ge_cons is True:
-            measures.append("Мера 2"); branch = "prod>=cons & NS>=30% & non-decrease"
-            notes.append("Производство ≥ потреблению, доля «НС» ≥ 30% и не падает → Мера 2")
+            branch = "prod>=cons & NS>=30% & non-decrease"
         elif prod_ge_cons is False:
-            measures.append("Мера 6"); branch = "prod<cons & NS>=30% & non-decrease"
-            notes.append("Производство < потребления при доле «НС» ≥ 30% → Мера 6")
+            branch = "prod<cons & NS>=30% & non-decrease"
         else:
-            measures.append("Мера 6"); branch = "no P/C & NS>=30% & non-decrease"
-            notes.append("Нет данных по P/C при доле «НС» ≥ 30% → Мера 6")
+            branch = "no P/C & NS>=30% & non-decrease"
 
     elif share_ns < 30.0:
         if wto > applied and (prod_ge_cons is True):
-            measures.append("Мера 1"); branch = "bound>applied & prod>=cons"
-            notes.append("Bound > Applied и производство ≥ потреблению → Мера 1")
+            branch = "bound>applied & prod>=cons"
         elif wto > applied and (prod_ge_cons is False):
-            measures.append("Мера 6"); branch = "bound>applied & prod<cons"
-            notes.append("Bound > Applied и производство < потребления → Мера 6")
+            branch = "bound>applied & prod<cons"
         elif abs(wto - applied) < 1e-12 and (prod_ge_cons is False):
             grew = False
             if ly is not None:
@@ -149,7 +190,8 @@ def compute_recommendation(
             if ly is not None and len(imp_df):
                 last = imp_df[imp_df["year"] == ly].copy()
                 metric = choose_metric(last)
-                top1 = last.sort_values(metric, ascending=False).head(1)
+                # устойчивая сортировка: при равных объёмах топ-1 — первая по порядку строка
+                top1 = last.sort_values(metric, ascending=False, kind="mergesort").head(1)
                 rest = last.iloc[1:].copy()
                 if len(top1) and len(rest):
                     skc_top = calc_skc(float(top1["value_usd_mln"].iloc[0]), float(top1["value_tons"].iloc[0]))
@@ -161,31 +203,20 @@ def compute_recommendation(
                         top1_ok = skc_top < min(skc_others)
 
             if grew and top1_ok:
-                measures.append("Мера 3"); branch = "applied==bound & prod<cons & growth & top1_skc_ok"
-                notes.append("Импорт растёт и СКЦ топ-1 ниже других → Мера 3")
+                branch = "applied==bound & prod<cons & growth & top1_skc_ok"
             else:
-                measures.append("Мера 6"); branch = "applied==bound & prod<cons & (no growth or no skc cond)"
-                notes.append("Условие роста/СКЦ не выполнено → Мера 6")
+                branch = "applied==bound & prod<cons & (no growth or no skc cond)"
 
         elif abs(wto - applied) < 1e-12 and (prod_ge_cons is True):
-            nt_m, nt_n = non_tariff_analysis(prod_ge_cons, in_tr, in_1875, in_4114)
-            measures.extend(nt_m); branch = "applied==bound & prod>=cons → non-tariff"
-            notes.extend(nt_n)
+            branch = "applied==bound & prod>=cons → non-tariff"
         else:
-            nt_m, nt_n = non_tariff_analysis(prod_ge_cons, in_tr, in_1875, in_4114)
-            measures.extend(nt_m); branch = "other → non-tariff"
-            notes.append("Случай вне прямых правил (например bound < applied) → нетарифные варианты")
-            notes.extend(nt_n)
+            branch = "other → non-tariff"
 
     else:
         # НС ≥ 30% и падение (delta_ns < 0): консервативный выбор — Мера 6
-        measures.append("Мера 6")
         branch = "NS>=30% & decrease"
-        notes.append("Доля «НС» ≥ 30%, но объём снижается; эскалация не обоснована → Мера 6")
 
-    # Убираем дубликаты мер и любые вне диапазона 1–6
-    seen = set()
-    measures = [m for m in measures if (m in {f"Мера {i}" for i in range(1,7)}) and not (m in seen or seen.add(m))]
+    measures, notes = recommendation_outcome(branch, prod_ge_cons, in_tr, in_1875, in_4114)
 
     summary = {
         "last_year": int(ly) if ly is not None else None,
@@ -224,6 +255,9 @@ SYSTEM_PROMPT = (
 """
 )
 
+# Версия промта: меняется вместе с текстом SYSTEM_PROMPT (входит в ключ кэша ответов)
+PROMPT_VERSION = hashlib.sha1(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+
 FORBIDDEN_PATTERNS = [
     r"(?is)Данные,?\s*использован[ыо]\s*в\s*расч[её]те.*",
     r"(?is)Неопредел[её]нност[ьи].*",
@@ -317,7 +351,163 @@ def clamp_measures_in_text(text: str, measures: List[str]) -> str:
         text = re.sub(r"Мера\s*([1-6])", repl_only, text)
     return text
 
-def chat_completion(messages, temperature=0.15, max_tokens=900, style_seed: Optional[int] = None) -> str:
+class StreamSanitizer:
+    """
+    Потоковый вариант clamp_measures_in_text(sanitize_ai(text), measures).
+
+    feed(delta) принимает очередной кусок ответа модели и возвращает текст, готовый
+    к отправке клиенту (может быть пустым), finish() — остаток в конце потока.
+    Текст выпускается целыми предложениями/строками, длинный кусок без границы —
+    по пробелу. Разрез никогда не попадает внутрь запретной фразы, номера ветки или
+    «Мера N» (_GUARDS): после него держим не меньше _HOLDBACK_WORDS слов, так что
+    начатый до разреза шаблон виден целиком. Правила те же:
+      - запретная фраза обрывает ответ (stopped = True — дальше модель можно не читать);
+      - «НС» расшифровывается, пока расшифровка не встретилась в тексте;
+      - лимит слов — по границе предложения, как в _smart_sentence_trim (за 60% лимита
+        текст выпускается только до конца предложения);
+      - меры клампятся к фактическому списку.
+    Отличия от пакетной версии: решение про «НС» принимается по уже выпущенному
+    тексту; если лимит слов сработал, пакетная обрезка склеивает слова через пробел,
+    а в потоке уже выпущенные переводы строк остаются. Итоговый ответ стоит досчитать
+    sanitize_ai целиком.
+    """
+
+    _BOUNDARY = re.compile(r"(?:[\.!\?…]\s|\n)")
+    _SENTENCE_END = re.compile(r"[\.!\?…]\s*$")
+    _MAX_PENDING = 400   # без границы предложения дольше не ждём — режем по пробелу
+    _HOLDBACK_WORDS = 4  # слов после разреза: самый длинный шаблон («согласно данным из БД») — 4
+    # шаблоны, внутри которых резать нельзя: запретные фразы (без хвоста .*), «Мера N»,
+    # номера веток (remove_branch_numbers), «НС»
+    _GUARDS = [re.compile(p[:-2] if p.endswith(".*") else p) for p in FORBIDDEN_PATTERNS] + [
+        re.compile(r"Мера\s*[0-9]+"), re.compile(r"(?<!\d)\d+(?:\.\d+)+(?!\d)"), re.compile(r"\bНС\b")]
+
+    def __init__(self, measures: List[str], max_words: int = MAX_WORDS_DEFAULT):
+        self.measures = measures
+        self.max_words = max_words
+        self.raw = ""        # весь полученный текст модели
+        self.stopped = False
+        self._pos = 0        # сколько сырого текста уже обработано
+        self._clean = ""     # обработанный текст до расшифровки НС (для проверки «уже расшифровано»)
+        self._words = 0
+        self._sentence_end = False
+        self._ws = ""        # пробелы между предложениями: отдаём только вместе со следующим текстом
+        self._tail = ""      # последние символы выпущенного текста (склейка переводов строк)
+        self._started = False
+
+    def feed(self, delta: str) -> str:
+        if self.stopped or not delta:
+            return ""
+        self.raw += delta
+        pending = self.raw[self._pos:]
+        cut = self._cut(pending)
+        if cut <= 0:
+            return ""
+        self._pos += cut
+        return self._emit(pending[:cut])
+
+    def _cut(self, pending: str) -> int:
+        """Длина выпускаемого начала pending: последняя граница предложения (или пробел,
+        если кусок длиннее _MAX_PENDING), вне шаблонов и с _HOLDBACK_WORDS словами после."""
+        if len(pending) <= self._MAX_PENDING and not self._BOUNDARY.search(pending):
+            return 0
+        words = [m.start() for m in re.finditer(r"\S+", pending)]
+        if len(words) <= self._HOLDBACK_WORDS:
+            return 0
+        limit = words[-self._HOLDBACK_WORDS]
+        # за 60% лимита — только по концу предложения: если лимит сработает, пакетная
+        # обрезка откатит текст к последнему из них, и лишнего выпущено не будет
+        room = int(self.max_words * 0.6) - self._words
+        spans = None
+
+        def safe(cut: int) -> bool:
+            nonlocal spans
+            if bisect.bisect_left(words, cut) > room and not self._SENTENCE_END.search(pending, 0, cut):
+                return False
+            if spans is None:
+                spans = [m.span() for g in self._GUARDS for m in g.finditer(pending)]
+            return not any(s < cut < e for s, e in spans)
+
+        cuts = [m.end() for m in self._BOUNDARY.finditer(pending, 0, limit)]
+        cut = next((c for c in reversed(cuts) if safe(c)), 0)
+        if not cut and len(pending) > self._MAX_PENDING and room > 0:
+            # пробел перед словом номер room — дальше без конца предложения нельзя
+            space = pending.rfind(" ", 0, min(limit, words[room]) if room < len(words) else limit)
+            while space >= 0 and not safe(space + 1):
+                space = pending.rfind(" ", 0, space)
+            cut = space + 1
+        return cut
+
+    def finish(self) -> str:
+        if self.stopped:
+            return ""
+        self.stopped = True
+        out = self._emit(self.raw[self._pos:])
+        self._pos = len(self.raw)
+        return out
+
+    def _emit(self, seg: str) -> str:
+        # запретные фразы: «…» + всё после неё вырезается (как re.sub с .* в sanitize_ai)
+        for pat in FORBIDDEN_PATTERNS:
+            if pat.endswith(".*"):
+                m = re.search(pat, seg)
+                if m:
+                    seg = seg[:m.start()]
+                    self.stopped = True
+            else:
+                seg = re.sub(pat, "", seg)
+        self._clean += seg
+        if "НС" in seg and "недружественные страны" not in self._clean.lower():
+            seg = re.sub(r"\bНС\b", "НС (недружественные страны)", seg)
+
+        # ведущие пробелы/переводы строк сохраняем: remove_branch_numbers делает strip()
+        lead = seg[:len(seg) - len(seg.lstrip())] if self._started else ""
+        core = remove_branch_numbers(seg)
+        if not core:
+            if self._started and not self.stopped:
+                self._ws += seg
+            return ""
+
+        # лимит слов: предложение целиком или, если выпущено мало, обрезка по словам
+        words = re.findall(r"\S+", core)
+        if self._words + len(words) > self.max_words:
+            self.stopped = True
+            cut = " ".join(words[:self.max_words - self._words])
+            min_words = int(self.max_words * 0.6)
+            m = re.search(r"(?s)^(.*[\.!\?…])[^\.!\?…]*$", cut)
+            if m and self._words + len(m.group(1).split()) >= min_words:
+                core = m.group(1).strip()
+            elif not m and self._sentence_end and self._words >= min_words:
+                return ""
+            else:
+                core = cut.rstrip(",;:—- ").strip()
+            if not core:
+                return ""  # лимит исчерпан ровно на предыдущем куске — пробелы не выпускаем
+            words = core.split()
+        self._words += len(words)
+        self._sentence_end = core.endswith((".", "!", "?", "…"))
+
+        core = clamp_measures_in_text(core, self.measures)
+        out = self._ws + lead + core
+        self._started = True
+        self._ws = "" if self.stopped else seg[len(seg.rstrip()):]
+        # схлопывание пробелов и пустых строк — с учётом уже выпущенного хвоста
+        joined = re.sub(r"\n{3,}", "\n\n", re.sub(r"[ \t]{2,}", " ", self._tail + out))
+        out = joined[len(self._tail):] if joined.startswith(self._tail) else joined[len(self._tail):].lstrip(" \n")
+        self._tail = (self._tail + out)[-2:]
+        return out
+
+def _chat_payload(messages, temperature=0.15, max_tokens=900, style_seed: Optional[int] = None,
+                  deterministic: bool = False) -> Dict[str, Any]:
+    if deterministic:
+        # без стохастики: greedy-декодирование и фиксированный seed
+        return {
+            "model": CHAT_MODEL,
+            "messages": messages,
+            "temperature": 0.0,
+            "top_p": 1.0,
+            "seed": LLM_SEED,
+            "max_tokens": max_tokens
+        }
     # Лёгкая стохастика параметров для разнообразия ответов
     rnd = random.Random(style_seed) if style_seed is not None else random
     temperature = max(0.1, min(0.8, temperature + rnd.uniform(-0.05, 0.25)))
@@ -325,8 +515,8 @@ def chat_completion(messages, temperature=0.15, max_tokens=900, style_seed: Opti
     presence_penalty = round(rnd.uniform(0.2, 0.6), 2)
     frequency_penalty = round(rnd.uniform(0.2, 0.7), 2)
 
-    url = f"{OPENAI_BASE}/chat/completions"
-    payload = {
+    # Если твой сервер не принимает некоторые поля — убери их из payload
+    return {
         "model": CHAT_MODEL,
         "messages": messages,
         "temperature": temperature,
@@ -335,11 +525,68 @@ def chat_completion(messages, temperature=0.15, max_tokens=900, style_seed: Opti
         "frequency_penalty": frequency_penalty,
         "max_tokens": max_tokens
     }
-    # Если твой сервер не принимает некоторые поля — убери их из payload
-    r = requests.post(url, json=payload, timeout=120)
+
+def chat_completion(messages, temperature=0.15, max_tokens=900, style_seed: Optional[int] = None,
+                   deterministic: bool = False) -> str:
+    url = f"{OPENAI_BASE}/chat/completions"
+    payload = _chat_payload(messages, temperature, max_tokens, style_seed, deterministic)
+    import requests
+    r = requests.post(url, json=payload, timeout=LLM_TIMEOUT)
     r.raise_for_status()
     return r.json()["choices"][0]["message"]["content"]
 
+# Общий async-клиент: keep-alive соединения к LLM-серверу переиспользуются между запросами
+_async_http: Optional["httpx.AsyncClient"] = None
+
+def get_async_http() -> "httpx.AsyncClient":
+    global _async_http
+    if _async_http is None or _async_http.is_closed:
+        import httpx
+        _async_http = httpx.AsyncClient(timeout=LLM_TIMEOUT)
+    return _async_http
+
+async def close_async_http():
+    global _async_http
+    if _async_http is not None:
+        await _async_http.aclose()
+        _async_http = None
+
+async def chat_completion_async(messages, temperature=0.15, max_tokens=900, style_seed: Optional[int] = None,
+                               deterministic: bool = False) -> str:
+    """Асинхронный вариант chat_completion: ожидание LLM не занимает поток."""
+    url = f"{OPENAI_BASE}/chat/completions"
+    payload = _chat_payload(messages, temperature, max_tokens, style_seed, deterministic)
+    r = await get_async_http().post(url, json=payload)
+    r.raise_for_status()
+    return r.json()["choices"][0]["message"]["content"]
+
+async def chat_completion_stream_async(messages, temperature=0.15, max_tokens=900,
+                                      style_seed: Optional[int] = None,
+                                      deterministic: bool = False) -> AsyncIterator[str]:
+    """
+    Потоковый ответ модели (stream=true, OpenAI-совместимый SSE): отдаёт куски текста
+    по мере генерации. Закрытие генератора (aclose) закрывает и HTTP-поток к серверу.
+    """
+    url = f"{OPENAI_BASE}/chat/completions"
+    payload = _chat_payload(messages, temperature, max_tokens, style_seed, deterministic)
+    payload["stream"] = True
+    async with get_async_http().stream("POST", url, json=payload) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            choices = chunk.get("choices") or []
+            delta = (choices[0].get("delta") or {}).get("content") if choices else None
+            if delta:
+                yield delta
+
 def make_grounding_message(good_row: Dict[str, Any], measures: List[str], summary: Dict[str, Any]) -> str:
     notes = summary.get("notes", []) or []
     ly = summary.get("last_year")
@@ -400,6 +647,7 @@ def build_brief_docx(
     """
     «Справка по товару …» — кратко и по делу.
     """
+    from docx import Document
     doc = Document()
     title = f"Справка по товару: {good['name']} ({good['hs_code']})"
     doc.add_heading(title, level=1)
@@ -465,6 +713,7 @@ def build_mosprom_docx(
     """
     «Обращение в АНО “Моспром”» — кратко и по делу.
     """
+    from docx import Document
     doc = Document()
     doc.add_heading("Обращение в АНО «Моспром»", level=1)
     doc.add_paragraph("От: [Наименование предприятия]")
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+# ttr_core/metrics.py — задержки по этапам запросов API, /metrics (Prometheus), id запроса в логах
+#
+# RequestMetrics — ASGI-middleware api.py. На каждый HTTP-запрос:
+#   - берёт X-Request-ID клиента (или выдаёт новый) и возвращает его заголовком ответа;
+#   - меряет время до последнего байта ответа (потоковые ответы — целиком);
+#   - кладёт контекст запроса в contextvar: его видят span() этого запроса, в том числе
+#     в threadpool (run_in_threadpool и asyncio.to_thread копируют контекст).
+# span("этап") / @timed("этап") — время этапа (чтение из БД/снимка, расчёт мер, заземление,
+# LLM, фильтры ответа, сборка DOCX) в гистограмму по (эндпоинт, этап); вне запроса эндпоинт — "-".
+# log() — print с id текущего запроса; запросы дольше METRICS_SLOW_MS попадают в лог
+# с разбивкой времени по этапам (этапы вложены, поэтому суммы не складываются).
+#
+# Метрики (текстовый формат Prometheus, GET /metrics) — на процесс: у каждого воркера uvicorn
+# свои, суммирует Prometheus по инстансам:
+#   ttr_http_request_duration_seconds{endpoint,method,status}  — гистограмма
+#   ttr_stage_duration_seconds{endpoint,stage}                  — гистограмма
+#   ttr_http_requests_in_flight                                 — запросы в работе
+# endpoint — шаблон пути FastAPI (/api/goods/{good_id}/dashboard), не сам путь: число рядов
+# ограничено числом эндпоинтов.
+
+import os
+import re
+import time
+import uuid
+import bisect
+import inspect
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+METRICS_SLOW_MS = float(os.environ.get("METRICS_SLOW_MS", "1000"))  # порог записи запроса в лог
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# Границы корзин гистограмм, секунды: от попаданий в кэш до ответов LLM
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")  # id клиента — только если безопасен для логов
+
+
+class Histogram:
+    """Гистограмма Prometheus: счётчики по корзинам и сумма на каждый набор меток. Потокобезопасная."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}  # метки → [счётчики корзин + «+Inf», сумма]
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        i = bisect.bisect_left(self.buckets, value)  # первая корзина с le >= value
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, labels))
+            cumulative = 0
+            for le, n in zip((*self.buckets, "+Inf"), counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{base},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram("ttr_http_request_duration_seconds",
+                            "Время HTTP-запроса до последнего байта ответа", ("endpoint", "method", "status"))
+STAGE_SECONDS = Histogram("ttr_stage_duration_seconds",
+                          "Время этапа обработки запроса", ("endpoint", "stage"))
+_in_flight = 0
+
+# =============================
+# Контекст запроса и этапы
+# =============================
+@dataclass
+class RequestContext:
+    request_id: str
+    scope: Dict[str, Any]
+    started: float
+    stages: Dict[str, float] = field(default_factory=dict)  # этап → суммарное время в запросе, с
+
+    @property
+    def endpoint(self) -> str:
+        # маршрут FastAPI кладёт в scope при сопоставлении — до этого (и для 404) шаблона нет
+        route = self.scope.get("route")
+        return getattr(route, "path", None) or "unmatched"
+
+
+_current: ContextVar[Optional[RequestContext]] = ContextVar("ttr_request", default=None)
+
+
+def current_request_id() -> Optional[str]:
+    ctx = _current.get()
+    return ctx.request_id if ctx is not None else None
+
+
+def observe(stage: str, seconds: float):
+    """Время этапа — в гистограмму (эндпоинт текущего запроса или "-") и в разбивку запроса."""
+    ctx = _current.get()
+    STAGE_SECONDS.observe((ctx.endpoint if ctx is not None else "-", stage), seconds)
+    if ctx is not None:
+        ctx.stages[stage] = ctx.stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage: str):
+    """Замер блока; годится и вокруг await (меряется время до выхода из блока)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - t0)
+
+
+def timed(stage: str):
+    """Декоратор: span вокруг вызова функции (обычной или async)."""
+    def wrap(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return wrap
+
+
+def log(message: str):
+    """print с id текущего запроса (вне запроса — как есть)."""
+    request_id = current_request_id()
+    print(f"{message} rid={request_id}" if request_id else message)
+
+# =============================
+# Middleware и выдача
+# =============================
+def _request_id(scope: Dict[str, Any]) -> str:
+    header = REQUEST_ID_HEADER.lower().encode()
+    for name, value in scope.get("headers") or ():
+        if name == header:
+            candidate = value.decode("latin-1").strip()
+            if _REQUEST_ID.match(candidate):
+                return candidate
+            break
+    return uuid.uuid4().hex[:16]
+
+
+class RequestMetrics:
+    """ASGI-middleware: id запроса, контекст для span(), время запроса, лог медленных запросов."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _in_flight
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        ctx = RequestContext(_request_id(scope), scope, time.perf_counter())
+        token = _current.set(ctx)
+        status = 500  # если приложение упало до начала ответа
+        header = (REQUEST_ID_HEADER.lower().encode(), ctx.request_id.encode())
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": [*message.get("headers", ()), header]}
+            await send(message)
+
+        _in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _in_flight -= 1
+            _current.reset(token)
+            self._finish(ctx, scope["method"], status)
+
+    @staticmethod
+    def _finish(ctx: RequestContext, method: str, status: int):
+        elapsed = time.perf_counter() - ctx.started
+        REQUEST_SECONDS.observe((ctx.endpoint, method, str(status)), elapsed)
+        if elapsed * 1000 >= METRICS_SLOW_MS:
+            stages = ", ".join(f"{stage} {s * 1000:.0f} мс"
+                               for stage, s in sorted(ctx.stages.items(), key=lambda kv: -kv[1]))
+            print(f"[api] медленный запрос {method} {ctx.endpoint} → {status}: {elapsed * 1000:.0f} мс"
+                  f"{f' ({stages})' if stages else ''} rid={ctx.request_id}")
+
+
+def render() -> str:
+    """Все метрики процесса в текстовом формате Prometheus (version 0.0.4)."""
+    lines = [*REQUEST_SECONDS.render(), *STAGE_SECONDS.render(),
+             "# HELP ttr_http_requests_in_flight HTTP-запросы в работе",
+             "# TYPE ttr_http_requests_in_flight gauge",
+             f"ttr_http_requests_in_flight {_in_flight}"]
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
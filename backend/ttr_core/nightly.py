@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# ttr_core/nightly.py — ночной пакетный прогон по всем товарам (без api.py)
+#
+#   python -m ttr_core.nightly --out ./out                       # все товары, оба документа
+#   python -m ttr_core.nightly --out ./out --hs 8428 --workers 8
+#   python -m ttr_core.nightly --out ./out --fresh                # начать заново, без возобновления
+#
+# Что делает:
+#   1) грузит товары пачками set-based запросами (ttr_core/bundle.py);
+#   2) считает меры векторно (ttr_core/batch.py) для товаров без актуальной
+#      рекомендации и сохраняет их в ttr.recommendations;
+#   3) собирает «Справку» и «Обращение в Моспром» в пуле процессов и пишет файлы
+#      в --out/docs;
+#   4) ведёт --out/manifest.jsonl: строка на товар после того, как все его файлы
+#      записаны. Это и есть чекпоинт: после падения повторный запуск пропускает
+#      товары, уже записанные для той же версии данных;
+#   5) в конце пишет --out/manifest.json (сводка) и печатает скорость (товаров/с).
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Any, List, Tuple
+
+from ttr_core.db import pool
+from ttr_core.bundle import load_goods_index, load_bulk
+from ttr_core.doccache import DOC_KINDS, DOCX_TEMPLATE_VERSION, doc_filename, render_doc
+from ttr_core import store
+
+MANIFEST_LOG = "manifest.jsonl"
+MANIFEST = "manifest.json"
+
+
+def render_to_file(kind: str, good, measures, summary, tariffs, imports, path: str) -> Tuple[str, int, str]:
+    """Воркер пула: собирает DOCX и атомарно пишет файл. Возвращает (путь, размер, sha256)."""
+    data = render_doc(kind, good, measures, summary, tariffs, imports)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return path, len(data), hashlib.sha256(data).hexdigest()
+
+
+def read_checkpoint(out: Path) -> Dict[int, Dict[str, Any]]:
+    """Уже обработанные товары из manifest.jsonl (последняя запись по товару побеждает)."""
+    done = {}
+    log = out / MANIFEST_LOG
+    if not log.exists():
+        return done
+    with open(log, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # недописанная строка — процесс упал посреди записи
+            done[int(rec["good_id"])] = rec
+    return done
+
+
+def _is_done(rec: Dict[str, Any], data_version: int, kinds: List[str], docs: Path) -> bool:
+    return (rec.get("data_version") == data_version
+            and rec.get("template_version") == DOCX_TEMPLATE_VERSION
+            and all(k in rec.get("files", {}) and (docs / rec["files"][k]["file"]).exists() for k in kinds))
+
+
+def run(out: Path, kinds: List[str], hs_prefix: str = None, workers: int = 0, chunk: int = 200,
+        fresh: bool = False) -> Dict[str, Any]:
+    docs = out / "docs"
+    docs.mkdir(parents=True, exist_ok=True)
+    if fresh:
+        (out / MANIFEST_LOG).unlink(missing_ok=True)
+    checkpoint = read_checkpoint(out)
+
+    t0 = time.perf_counter()
+    with pool.connection() as conn:
+        goods = load_goods_index(conn, hs_prefix=hs_prefix)
+    todo = goods[[not (int(g.id) in checkpoint and _is_done(checkpoint[int(g.id)], int(g.data_version), kinds, docs))
+                  for g in goods.itertuples(index=False)]]
+    print(f"[nightly] товаров: {len(goods)}, уже готово (чекпоинт): {len(goods) - len(todo)}, "
+          f"к обработке: {len(todo)}; документы: {', '.join(kinds)}")
+
+    workers = workers or (os.cpu_count() or 2)
+    processed = failed = computed_total = 0
+    with open(out / MANIFEST_LOG, "a", encoding="utf-8") as log, \
+            ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        for start in range(0, len(todo), chunk):
+            part = todo.iloc[start:start + chunk]
+            with pool.connection() as conn:
+                bulk = load_bulk(conn, part)
+                bundles = list(bulk.bundles())
+                computed = store.fill_missing(bundles, bulk)
+                if computed:
+                    with conn.cursor() as cur:
+                        store.save_many(cur, computed)
+                    conn.commit()
+            computed_total += len(computed)
+
+            futures = {}
+            for b in bundles:
+                rec = b.recommendation
+                for kind in kinds:
+                    name = doc_filename(kind, b.good["hs_code"]).replace(".docx", f"_{b.good_id}.docx")
+                    fut = executor.submit(render_to_file, kind, b.good, rec.measures, rec.summary,
+                                          b.tariffs, b.imports, str(docs / name))
+                    futures[fut] = (b, kind)
+
+            results: Dict[int, Dict[str, Any]] = {}
+            errors: Dict[int, str] = {}
+            for fut in as_completed(futures):
+                b, kind = futures[fut]
+                try:
+                    path, size, sha = fut.result()
+                    results.setdefault(b.good_id, {})[kind] = {"file": Path(path).name, "bytes": size, "sha256": sha}
+                except Exception as e:
+                    errors[b.good_id] = f"{kind}: {e}"
+
+            # чекпоинт: товар попадает в манифест только когда записаны все его документы
+            for b in bundles:
+                if b.good_id in errors:
+                    failed += 1
+                    print(f"[nightly] good_id={b.good_id}: ошибка сборки: {errors[b.good_id]}")
+                    continue
+                log.write(json.dumps({
+                    "good_id": b.good_id,
+                    "hs_code": b.good["hs_code"],
+                    "name": b.good["name"],
+                    "data_version": b.data_version,
+                    "template_version": DOCX_TEMPLATE_VERSION,
+                    "measures": b.recommendation.measures,
+                    "files": results[b.good_id],
+                }, ensure_ascii=False) + "\n")
+                processed += 1
+            log.flush()
+            os.fsync(log.fileno())
+
+            elapsed = time.perf_counter() - t0
+            rate = processed / elapsed if elapsed > 0 else 0.0
+            left = len(todo) - start - len(part)
+            eta = f", осталось ~{left / rate:.0f} c" if rate > 0 and left else ""
+            print(f"[nightly] {start + len(part)}/{len(todo)} товаров, {rate:.1f} товаров/с{eta}")
+
+    elapsed = time.perf_counter() - t0
+    entries = read_checkpoint(out)
+    summary = {
+        "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "template_version": DOCX_TEMPLATE_VERSION,
+        "kinds": kinds,
+        "goods_total": len(goods),
+        "goods_processed": processed,
+        "goods_skipped": len(goods) - len(todo),
+        "goods_failed": failed,
+        "recommendations_computed": computed_total,
+        "elapsed_s": round(elapsed, 3),
+        "goods_per_s": round(processed / elapsed, 2) if elapsed > 0 else None,
+        "goods": [entries[int(g)] for g in goods["id"] if int(g) in entries],
+    }
+    tmp = out / (MANIFEST + ".tmp")
+    tmp.write_text(json.dumps(summary, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, out / MANIFEST)
+    print(f"[nightly] готово: {processed} товаров за {elapsed:.1f} c "
+          f"({summary['goods_per_s']} товаров/с), пропущено {summary['goods_skipped']}, ошибок {failed}")
+    return summary
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Ночной прогон: меры + DOCX по всем товарам")
+    ap.add_argument("--out", required=True, help="каталог для документов и манифеста")
+    ap.add_argument("--kinds", default=",".join(DOC_KINDS), help=f"виды документов через запятую ({', '.join(DOC_KINDS)})")
+    ap.add_argument("--hs", default=None, help="только товары с этим префиксом кода ТН ВЭД")
+    ap.add_argument("--workers", type=int, default=0, help="процессов сборки (по умолчанию — число ядер)")
+    ap.add_argument("--chunk", type=int, default=200, help="товаров на пачку загрузки")
+    ap.add_argument("--fresh", action="store_true", help="игнорировать чекпоинт и пересобрать всё")
+    args = ap.parse_args(argv)
+
+    kinds = [k.strip() for k in args.kinds.split(",") if k.strip()]
+    unknown = [k for k in kinds if k not in DOC_KINDS]
+    if unknown:
+        ap.error(f"неизвестные виды документов: {unknown}")
+    summary = run(Path(args.out), kinds, hs_prefix=args.hs, workers=args.workers,
+                  chunk=max(1, args.chunk), fresh=args.fresh)
+    return 0 if not summary["goods_failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
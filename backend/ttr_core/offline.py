@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+# ttr_core/offline.py — автономный режим: схема ttr в одном файле SQLite, без сервера PostgreSQL
+#
+#   python -m ttr_core.offline export ttr_bundle.sqlite    # выгрузка из PostgreSQL (PG* — как у API)
+#   python -m ttr_core.offline info ttr_bundle.sqlite      # что внутри
+#   TTR_OFFLINE_BUNDLE=ttr_bundle.sqlite uvicorn api:app    # API из файла
+#   TTR_OFFLINE_BUNDLE=ttr_bundle.sqlite streamlit run app.py
+#
+# Файл — выгрузка снимка (ttr_core/snapshot.py): те же строки, что снимок читает из БД,
+# в таблицах с именами схемы ttr — goods, data_version, recommendations, tariffs, production,
+# consumption, import_values (пустые стоимость/тонны — 0, как их читают API и app.py),
+# goods_flags, import_by_year, import_by_country (топ-50 стран, как в снимке).
+# Рекомендации выгружаются для всех товаров (недостающие досчитаны при сборке снимка),
+# поэтому при старте из файла ничего не считается, а ответы те же, что с PostgreSQL.
+#
+# Файл подключается только для чтения как схема ttr (ATTACH ... AS ttr) и читается
+# через отображение в память (PRAGMA mmap_size); курсор принимает плейсхолдеры %s,
+# поэтому SQL загрузчиков app.py работает без изменений.
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import asyncio
+import argparse
+from contextlib import closing
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from ttr_core.snapshot import Snapshot, TABLES, TABLE_COLUMNS, load_snapshot_async
+
+OFFLINE_BUNDLE = os.environ.get("TTR_OFFLINE_BUNDLE") or None
+OFFLINE_MMAP_MB = int(os.environ.get("TTR_OFFLINE_MMAP_MB", "1024"))
+BUNDLE_FORMAT = 1  # растёт при несовместимом изменении структуры файла
+
+# Таблица снимка → таблица схемы ttr в файле
+TABLE_NAMES = {
+    "tariffs": "tariffs",
+    "production": "production",
+    "consumption": "consumption",
+    "imports": "import_values",
+    "flags": "goods_flags",
+    "import_years": "import_by_year",
+    "import_tops": "import_by_country",
+}
+
+# Тип колонки SQLite по типу колонки снимка; BOOLEAN, TIMESTAMPTZ и JSON читаются конвертерами ниже
+_DECL = {"f": "REAL", "i": "INTEGER", "c": "TEXT", "o": ""}
+BOOL_COLUMNS = {"in_techreg", "in_pp1875", "in_order4114"}
+
+sqlite3.register_converter("BOOLEAN", lambda b: b not in (b"0", b""))
+sqlite3.register_converter("TIMESTAMPTZ", lambda b: datetime.fromisoformat(b.decode()))
+sqlite3.register_converter("JSON", json.loads)
+
+GOODS_SQL = """
+SELECT g.id, g.hs_code, g.name, COALESCE(v.version, 0), v.updated_at, r.measures, r.summary, r.grounding
+FROM ttr.goods g
+LEFT JOIN ttr.data_version v ON v.good_id = g.id
+LEFT JOIN ttr.recommendations r ON r.good_id = g.id
+ORDER BY g.id
+"""
+
+
+def _schema() -> List[str]:
+    ddl = [
+        "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)",
+        "CREATE TABLE goods (id INTEGER PRIMARY KEY, hs_code TEXT, name TEXT)",
+        "CREATE TABLE data_version (good_id INTEGER PRIMARY KEY, version INTEGER, updated_at TIMESTAMPTZ)",
+        "CREATE TABLE recommendations (good_id INTEGER PRIMARY KEY, data_version INTEGER, "
+        "measures JSON, summary JSON, grounding TEXT)",
+    ]
+    for name, table in TABLE_NAMES.items():
+        columns = ", ".join(f"{c} {'BOOLEAN' if c in BOOL_COLUMNS else _DECL[k]}".rstrip()
+                            for c, k in zip(TABLE_COLUMNS[name], TABLES[name][1]))
+        ddl.append(f"CREATE TABLE {table} (good_id INTEGER, {columns})")
+        ddl.append(f"CREATE INDEX {table}_good_id ON {table} (good_id)")
+    return ddl
+
+
+def _dump_signature(signature: tuple) -> str:
+    # время последней загрузки — с пометкой типа, чтобы при чтении вернулся datetime, а не строка
+    return json.dumps([{"datetime": v.isoformat()} if isinstance(v, datetime) else v for v in signature])
+
+
+def _load_signature(text: str) -> tuple:
+    return tuple(datetime.fromisoformat(v["datetime"]) if isinstance(v, dict) else v for v in json.loads(text))
+
+
+# =============================
+# Выгрузка
+# =============================
+def write_bundle(snap: Snapshot, path) -> Dict[str, Any]:
+    """Пишет снимок в файл (через временный — читатели не увидят недописанный)."""
+    t0 = time.perf_counter()
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    ids, versions = snap.ids.tolist(), snap.version.tolist()
+    with closing(sqlite3.connect(tmp)) as conn:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        for stmt in _schema():
+            conn.execute(stmt)
+        conn.executemany("INSERT INTO goods VALUES (?, ?, ?)", snap.goods_rows())
+        conn.executemany("INSERT INTO data_version VALUES (?, ?, ?)",
+                         [(g, v, u.isoformat() if u is not None else None)
+                          for g, v, u in zip(ids, versions, snap.updated_at)])
+        conn.executemany("INSERT INTO recommendations VALUES (?, ?, ?, ?, ?)",
+                         [(g, v, json.dumps(r.measures, ensure_ascii=False),
+                           json.dumps(r.summary, ensure_ascii=False), r.grounding)
+                          for g, v, r in zip(ids, versions, snap.recommendations)])
+        for name, table in TABLE_NAMES.items():
+            marks = ", ".join("?" * (len(TABLE_COLUMNS[name]) + 1))
+            conn.executemany(f"INSERT INTO {table} VALUES ({marks})", snap.tables[name].rows())
+        meta = {
+            "format": BUNDLE_FORMAT,
+            "exported_at": datetime.now(timezone.utc).isoformat(),
+            "signature": _dump_signature(snap.signature),
+            "goods": len(snap),
+        }
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", [(k, str(v)) for k, v in meta.items()])
+        conn.commit()
+    os.replace(tmp, path)
+    return {"path": str(path), "goods": len(snap), "bytes": path.stat().st_size,
+            "write_s": round(time.perf_counter() - t0, 3)}
+
+
+async def export_async(path) -> Dict[str, Any]:
+    """Снимок из PostgreSQL (одна транзакция REPEATABLE READ) → файл."""
+    import psycopg
+    from ttr_core.db import DB_CONNINFO
+    async with await psycopg.AsyncConnection.connect(DB_CONNINFO) as conn:
+        snap = await load_snapshot_async(conn)
+    info = await asyncio.to_thread(write_bundle, snap, path)
+    info.update(load_s=round(snap.load_s, 3), build_s=round(snap.build_s, 3))
+    return info
+
+
+# =============================
+# Чтение
+# =============================
+class _Cursor(sqlite3.Cursor):
+    """Плейсхолдеры psycopg2 (%s) → SQLite (?): те же тексты SQL, что для PostgreSQL."""
+
+    def execute(self, sql, parameters=()):
+        return super().execute(sql.replace("%s", "?"), parameters)
+
+
+class _Connection(sqlite3.Connection):
+    def cursor(self, factory=_Cursor):
+        return super().cursor(factory)
+
+
+def connect(path=None, mmap_mb: int = OFFLINE_MMAP_MB) -> sqlite3.Connection:
+    """Соединение с файлом-выгрузкой: схема ttr, только чтение, mmap."""
+    path = Path(path or OFFLINE_BUNDLE or "")
+    if not path.is_file():
+        raise FileNotFoundError(f"нет файла выгрузки ttr: {path}")
+    conn = sqlite3.connect(":memory:", uri=True, detect_types=sqlite3.PARSE_DECLTYPES,
+                           factory=_Connection, check_same_thread=False)
+    conn.execute("ATTACH DATABASE ? AS ttr", (f"{path.resolve().as_uri()}?mode=ro",))
+    conn.execute(f"PRAGMA ttr.mmap_size = {mmap_mb * 1024 * 1024}")
+    return conn
+
+
+def read_meta(conn: sqlite3.Connection) -> Dict[str, str]:
+    meta = dict(conn.execute("SELECT key, value FROM ttr.meta"))
+    if meta.get("format") != str(BUNDLE_FORMAT):
+        raise ValueError(f"формат выгрузки {meta.get('format')!r} не поддерживается "
+                         f"(нужен {BUNDLE_FORMAT}) — выгрузите файл заново")
+    return meta
+
+
+def load_bundle(path=None) -> Snapshot:
+    """Снимок из файла — тот же объект, что API строит из PostgreSQL."""
+    t0 = time.perf_counter()
+    with closing(connect(path)) as conn:
+        meta = read_meta(conn)
+        goods = [(g, hs, name, v, u, {"measures": m, "summary": s, "grounding": gr} if m is not None else None)
+                 for g, hs, name, v, u, m, s, gr in conn.execute(GOODS_SQL)]
+        tables = {name: conn.execute(f"SELECT good_id, {', '.join(TABLE_COLUMNS[name])} "
+                                     f"FROM ttr.{table} ORDER BY rowid").fetchall()
+                  for name, table in TABLE_NAMES.items()}
+    return Snapshot(goods, tables, _load_signature(meta["signature"]), time.perf_counter() - t0)
+
+
+def info(path) -> Dict[str, Any]:
+    with closing(connect(path)) as conn:
+        meta = read_meta(conn)
+        rows = {table: conn.execute(f"SELECT count(*) FROM ttr.{table}").fetchone()[0]
+                for table in ("goods", "recommendations", *TABLE_NAMES.values())}
+    return {"path": str(path), "bytes": Path(path).stat().st_size, "exported_at": meta.get("exported_at"),
+            "format": int(meta["format"]), "rows": rows}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Автономная выгрузка схемы ttr в файл SQLite")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("export", help="выгрузить из PostgreSQL").add_argument("path")
+    sub.add_parser("info", help="показать содержимое файла").add_argument("path")
+    args = ap.parse_args(argv)
+    if args.command == "export":
+        result = asyncio.run(export_async(args.path))
+        print(f"[offline] {result['path']}: {result['goods']} товаров, {result['bytes'] / 1e6:.1f} МБ "
+              f"(чтение {result['load_s']:.2f} c, сборка {result['build_s']:.2f} c, запись {result['write_s']:.2f} c)")
+    else:
+        print(json.dumps(info(args.path), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
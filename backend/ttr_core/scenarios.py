@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+# ttr_core/scenarios.py — «что если»: карта мер по сетке сценариев для одного товара
+#
+# Аналитик задаёт оси (значения списком или диапазоном from/to/step):
+#   applied_rate, wto_bound_rate — тарифы (в тех же единицах, что в ttr.tariffs);
+#   unfriendly_share_pct         — доля НС в импорте последнего года, %: импорт
+#                                  перераспределяется между группами стран, итог
+#                                  года не меняется (строки группы масштабируются
+#                                  пропорционально, СКЦ стран сохраняется);
+#   import_change_pct            — изменение всего импорта последнего года, %;
+#   production_change_pct,
+#   consumption_change_pct       — изменение производства / потребления, %.
+# Результат — компактная карта решений: оси, форма сетки, легенда исходов (набор мер)
+# и плоский (C-порядок) массив номеров исходов. Исход 0 — текущие меры товара.
+#
+# Расчёт векторный и повторяет batch.py (те же import_features / select_branch):
+# импорт пересчитывается только для уникальных сочетаний «импортных» осей (каждое —
+# виртуальный товар для import_features), остальные оси — трансляция массивов numpy.
+# Меры — recommendation_outcome по уникальным (ветка, P/C). Тысячи сценариев — миллисекунды.
+
+import os
+import time
+from typing import Dict, Any, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ttr_core.batch import (
+    PGC_NONE, PGC_FALSE, PGC_TRUE, _PGC_VALUE, import_features, select_branch,
+    compute_recommendations_batch, iter_recommendations,
+)
+from ttr_core.bundle import GoodBundle
+from ttr_core.logic import recommendation_outcome, production_ge_consumption
+
+SCENARIO_MAX = int(os.environ.get("SCENARIO_MAX", "200000"))   # точек сетки на запрос
+AXIS_MAX = int(os.environ.get("SCENARIO_AXIS_MAX", "1001"))    # значений на одну ось
+
+TARIFF_AXES = ("applied_rate", "wto_bound_rate")
+IMPORT_AXES = ("unfriendly_share_pct", "import_change_pct")
+BALANCE_AXES = ("production_change_pct", "consumption_change_pct")
+AXES = TARIFF_AXES + IMPORT_AXES + BALANCE_AXES
+
+SYNTHETIC_COUNTRY = {True: "сценарий: недружественные", False: "сценарий: прочие"}
+
+
+def axis_values(name: str, spec: Any) -> np.ndarray:
+    """Значения оси: список чисел или {"from", "to", "step"} (включая to)."""
+    if isinstance(spec, dict):
+        try:
+            lo, hi, step = float(spec["from"]), float(spec["to"]), float(spec["step"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"{name}: ожидается {{'from', 'to', 'step'}} с числами")
+        if step <= 0 or hi < lo:
+            raise ValueError(f"{name}: нужно step > 0 и from <= to")
+        count = int(np.floor((hi - lo) / step + 1e-9)) + 1
+        if count > AXIS_MAX:
+            raise ValueError(f"{name}: {count} значений, максимум {AXIS_MAX}")
+        # округление убирает хвосты вида 0.30000000000000004
+        values = np.round(lo + step * np.arange(count), 12)
+    elif isinstance(spec, (list, tuple)):
+        try:
+            values = np.asarray([float(v) for v in spec])
+        except (TypeError, ValueError):
+            raise ValueError(f"{name}: значения должны быть числами")
+        if len(values) > AXIS_MAX:
+            raise ValueError(f"{name}: {len(values)} значений, максимум {AXIS_MAX}")
+    else:
+        raise ValueError(f"{name}: ожидается список или {{'from', 'to', 'step'}}")
+    if not len(values) or not np.isfinite(values).all():
+        raise ValueError(f"{name}: нужны конечные числа")
+    if name == "unfriendly_share_pct" and ((values < 0) | (values > 100)).any():
+        raise ValueError(f"{name}: доля от 0 до 100")
+    if name.endswith("_change_pct") and (values < -100).any():
+        raise ValueError(f"{name}: изменение не меньше -100%")
+    return values
+
+
+def parse_axes(spec: Dict[str, Any]) -> List[Tuple[str, np.ndarray]]:
+    """[(ось, значения)] в порядке запроса; проверка имён и размера сетки."""
+    if not isinstance(spec, dict) or not spec:
+        raise ValueError(f"axes: нужна хотя бы одна ось из {list(AXES)}")
+    unknown = [k for k in spec if k not in AXES]
+    if unknown:
+        raise ValueError(f"неизвестные оси: {unknown}; допустимы: {list(AXES)}")
+    axes = [(name, axis_values(name, values)) for name, values in spec.items()]
+    total = int(np.prod([len(v) for _, v in axes]))
+    if total > SCENARIO_MAX:
+        raise ValueError(f"сценариев {total}, максимум {SCENARIO_MAX}")
+    return axes
+
+
+# =============================
+# Варианты импорта
+# =============================
+def _import_variants(imports: pd.DataFrame, shares: np.ndarray, changes: np.ndarray,
+                     notes: List[str]) -> pd.DataFrame:
+    """
+    Длинная таблица импорта для вариантов (доля НС × изменение импорта): good_id —
+    номер варианта (share_idx * len(changes) + change_idx), строки вариантов — в
+    исходном порядке. shares содержит NaN для «доля как есть».
+    """
+    v_count = len(shares) * len(changes)
+    imp = imports.reset_index(drop=True)
+    if not len(imp):
+        return imp.assign(good_id=pd.Series(dtype=np.int64))
+    ly = int(imp["year"].max())
+    # нужны только последний и предыдущий годы (как в алгоритме)
+    imp = imp[imp["year"] >= ly - 1].reset_index(drop=True)
+    usd = imp["value_usd_mln"].to_numpy(dtype=float)
+    tons = imp["value_tons"].to_numpy(dtype=float)
+    unf = (imp["country_group"] == "unfriendly").to_numpy()
+    cur = (imp["year"] == ly).to_numpy()
+
+    use_usd = usd[cur].sum() > 0
+    metric = usd if use_usd else tons
+    total = metric[cur].sum()
+    ns = metric[cur & unf].sum()
+    other = total - ns
+
+    share = np.repeat(shares, len(changes))
+    change = np.tile(1.0 + changes / 100.0, len(shares))
+    target = ~np.isnan(share)
+    if target.any() and total <= 0:
+        notes.append("за последний год нет импорта — ось unfriendly_share_pct не влияет на расчёт")
+        target[:] = False
+    p = np.where(target, share, 0.0) / 100.0
+    # множители для строк НС и прочих стран последнего года; группа без строк → синтетическая строка
+    with np.errstate(divide="ignore", invalid="ignore"):
+        f_ns = np.where(target, np.where(ns > 0, p * total / ns, 0.0), 1.0)
+        f_other = np.where(target, np.where(other > 0, (1 - p) * total / other, 0.0), 1.0)
+    add_ns = target & (ns <= 0) & (p > 0)
+    add_other = target & (other <= 0) & (p < 1)
+    if add_ns.any() or add_other.any():
+        notes.append("в одной из групп стран нет импорта за последний год — для сценариев "
+                     f"добавлена строка «{SYNTHETIC_COUNTRY[True] if add_ns.any() else SYNTHETIC_COUNTRY[False]}» "
+                     "со средней СКЦ года")
+
+    factor = np.ones((v_count, len(imp)))
+    factor[:, cur & unf] = f_ns[:, None]
+    factor[:, cur & ~unf] = f_other[:, None]
+    factor[:, cur] *= change[:, None]
+    frame = pd.DataFrame({
+        "good_id": np.repeat(np.arange(v_count), len(imp)),
+        "year": np.tile(imp["year"].to_numpy(), v_count),
+        "country": np.tile(imp["country"].to_numpy(dtype=object), v_count),
+        "value_usd_mln": (factor * usd).ravel(),
+        "value_tons": (factor * tons).ravel(),
+        "country_group": np.tile(imp["country_group"].to_numpy(dtype=object), v_count),
+    })
+
+    extra = []
+    for mask, is_ns, amount in ((add_ns, True, p * total), (add_other, False, (1 - p) * total)):
+        vi = np.flatnonzero(mask)
+        if not len(vi):
+            continue
+        value = amount[vi] * change[vi]
+        # синтетическая строка — со средней ценой года, чтобы СКЦ был определён
+        price = (tons[cur].sum() / total) if use_usd else (usd[cur].sum() / total)
+        extra.append(pd.DataFrame({
+            "good_id": vi, "year": ly, "country": SYNTHETIC_COUNTRY[is_ns],
+            "value_usd_mln": value if use_usd else value * price,
+            "value_tons": value * price if use_usd else value,
+            "country_group": "unfriendly" if is_ns else "friendly",
+        }))
+    if extra:
+        # после исходных строк варианта: порядок строк важен для топ-1 (см. batch.import_features)
+        frame = pd.concat([frame, *extra], ignore_index=True)
+        frame = frame.iloc[np.argsort(frame["good_id"].to_numpy(), kind="stable")].reset_index(drop=True)
+    return frame
+
+
+# =============================
+# Перебор
+# =============================
+def sweep(bundle: GoodBundle, axes_spec: Dict[str, Any]) -> Dict[str, Any]:
+    """Карта мер для товара по сетке осей (см. описание модуля)."""
+    t0 = time.perf_counter()
+    axes = parse_axes(axes_spec)
+    given = dict(axes)
+    shape = tuple(len(v) for _, v in axes)
+    n = int(np.prod(shape))
+    notes: List[str] = []
+
+    # текущее состояние — тем же пакетным расчётом (исход 0 легенды)
+    gid = bundle.good_id
+    frames = {name: getattr(bundle, name).assign(good_id=gid)
+              for name in ("tariffs", "production", "consumption", "imports", "flags")}
+    _, base_measures, base = next(iter_recommendations(compute_recommendations_batch([gid], **frames)))
+
+    # номер значения каждой оси для каждой точки сетки (C-порядок)
+    idx = dict(zip([name for name, _ in axes], np.indices(shape).reshape(len(axes), n)))
+
+    def column(name: str, default: float) -> np.ndarray:
+        return given[name][idx[name]] if name in given else np.full(n, default)
+
+    applied = column("applied_rate", base["applied"])
+    wto = column("wto_bound_rate", base["wto_bound"])
+
+    # ---------- P/C ----------
+    ge, _, pc = production_ge_consumption(bundle.production, bundle.consumption)
+    if ge is None:
+        pgc = np.full(n, PGC_NONE, dtype=np.int8)
+        if any(a in given for a in BALANCE_AXES):
+            notes.append("нет общего года производства и потребления — оси P/C не влияют на расчёт")
+    else:
+        p = pc[0] * (1.0 + column("production_change_pct", 0.0) / 100.0)
+        c = pc[1] * (1.0 + column("consumption_change_pct", 0.0) / 100.0)
+        pgc = np.where(p >= c, PGC_TRUE, PGC_FALSE).astype(np.int8)
+
+    # ---------- импорт: уникальные варианты ----------
+    shares = given.get("unfriendly_share_pct", np.array([np.nan]))
+    changes = given.get("import_change_pct", np.array([0.0]))
+    variants = _import_variants(bundle.imports, shares, changes, notes)
+    f = import_features(np.arange(len(shares) * len(changes)), variants)
+    vi = (idx["unfriendly_share_pct"] if "unfriendly_share_pct" in idx else 0) * len(changes) \
+        + (idx["import_change_pct"] if "import_change_pct" in idx else 0)
+    vi = np.broadcast_to(vi, (n,))
+
+    branch = select_branch(f["share_ns"][vi], f["delta_ns"][vi], applied, wto, pgc,
+                           f["grew"][vi], f["top1_ok"][vi])
+
+    # ---------- исходы: уникальные (ветка, P/C) → меры ----------
+    flags = bundle.flags
+    in_tr = bool(flags["in_techreg"].iloc[0]) if len(flags) else False
+    in_1875 = bool(flags["in_pp1875"].iloc[0]) if len(flags) else False
+    in_4114 = bool(flags["in_order4114"].iloc[0]) if len(flags) else False
+
+    legend: Dict[Tuple[str, ...], int] = {tuple(base_measures): 0}
+    outcomes = [{"measures": list(base_measures), "branches": [], "count": 0}]
+    names, br_inv = np.unique(branch, return_inverse=True)
+    combos, inverse = np.unique(br_inv.ravel() * 3 + (pgc + 1), return_inverse=True)
+    codes = np.empty(len(combos), dtype=np.int32)
+    for k, combo in enumerate(combos):
+        br = str(names[combo // 3])
+        measures, _ = recommendation_outcome(br, _PGC_VALUE[int(combo % 3) - 1], in_tr, in_1875, in_4114)
+        key = tuple(measures)
+        if key not in legend:
+            legend[key] = len(outcomes)
+            outcomes.append({"measures": list(measures), "branches": [], "count": 0})
+        codes[k] = legend[key]
+        if br not in outcomes[codes[k]]["branches"]:
+            outcomes[codes[k]]["branches"].append(br)
+    grid = codes[inverse.ravel()]
+    counts = np.bincount(grid, minlength=len(outcomes))
+    for o, cnt in zip(outcomes, counts):
+        o["count"] = int(cnt)
+
+    return {
+        "good_id": gid,
+        "data_version": bundle.data_version,
+        "base": {"measures": list(base_measures),
+                 **{k: base[k] for k in ("applied", "wto_bound", "share_ns", "delta_ns",
+                                         "prod_ge_cons", "last_year", "metric_used")}},
+        "axes": [{"name": name, "values": values.tolist()} for name, values in axes],
+        "shape": list(shape),
+        "scenarios": n,
+        "outcomes": outcomes,
+        "grid": grid.tolist(),
+        "changed_share": float((grid != 0).mean()) if n else 0.0,
+        "notes": notes,
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000, 2),
+    }
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# ttr_core/search.py — поиск товаров в памяти (код ТН ВЭД и название)
+#
+#   - код: отсортированный массив нормализованных кодов (без пробелов) — префикс
+#     ищется двумя bisect'ами, «8428 10» и «842810» эквивалентны;
+#   - название: триграммный индекс (n-gram) — устойчив к опечаткам («лефты» → «Лифты»)
+#     и находит начала слов («маш» → «Машины»); подсчёт совпадений по всем товарам —
+#     один np.bincount.
+# Индекс неизменяемый: при обновлении справочника строится новый и подменяет старый.
+
+import re
+import time
+from bisect import bisect_left, bisect_right
+from typing import Dict, Any, List, Sequence, Tuple
+
+import numpy as np
+
+from ttr_core.bundle import normalize_hs
+
+MIN_SCORE = 0.5  # порог: доля триграмм запроса, найденных в названии (0..1)
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize_name(text: str) -> str:
+    return " ".join(_WORD.findall((text or "").lower().replace("ё", "е")))
+
+
+def trigrams(text: str) -> List[str]:
+    """Триграммы по словам с краевыми пробелами (как pg_trgm): «лифт» → « л», «ли», «иф», …"""
+    grams = set()
+    for word in normalize_name(text).split():
+        w = f"  {word} "
+        grams.update(w[i:i + 3] for i in range(len(w) - 2))
+    return sorted(grams)
+
+
+class GoodsIndex:
+    """Индекс по списку товаров (id, hs_code, name)."""
+
+    def __init__(self, goods: Sequence[Tuple[int, str, str]]):
+        t0 = time.perf_counter()
+        self.goods = [(int(i), hs or "", name or "") for i, hs, name in goods]
+
+        # код ТН ВЭД: (нормализованный код, позиция) по возрастанию
+        order = sorted(range(len(self.goods)), key=lambda k: normalize_hs(self.goods[k][1]))
+        self._codes = [normalize_hs(self.goods[k][1]) for k in order]
+        self._code_pos = order
+
+        # названия: триграмма → массив позиций товаров
+        postings: Dict[str, List[int]] = {}
+        self._names = []
+        sizes = np.zeros(len(self.goods), dtype=np.int32)
+        for k, (_, _, name) in enumerate(self.goods):
+            self._names.append(normalize_name(name))
+            grams = trigrams(name)
+            sizes[k] = len(grams)
+            for g in grams:
+                postings.setdefault(g, []).append(k)
+        self._postings = {g: np.asarray(p, dtype=np.int32) for g, p in postings.items()}
+        self._sizes = sizes
+        self.build_s = time.perf_counter() - t0
+
+    def __len__(self) -> int:
+        return len(self.goods)
+
+    def _item(self, k: int, score: float, match: str) -> Dict[str, Any]:
+        gid, hs, name = self.goods[k]
+        return {"id": gid, "hs_code": hs, "name": name, "score": round(score, 4), "match": match}
+
+    def by_code(self, prefix: str) -> List[int]:
+        p = normalize_hs(prefix)
+        lo = bisect_left(self._codes, p)
+        hi = bisect_right(self._codes, p + "￿")
+        return self._code_pos[lo:hi]
+
+    def by_name(self, query: str, top: int) -> Tuple[int, np.ndarray, np.ndarray]:
+        """
+        (всего найдено, позиции, оценки) — позиции/оценки только для первых top результатов.
+        Оценка — доля триграмм запроса, найденных в названии (опечатка в слове съедает
+        2–3 из них); при равенстве выше более близкое по длине название (коэффициент Дайса).
+        """
+        grams = trigrams(query)
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0)
+        lists = [self._postings[g] for g in grams if g in self._postings]
+        if not lists:
+            return 0, *empty
+        common = np.bincount(np.concatenate(lists), minlength=len(self.goods))
+        cand = np.flatnonzero(common >= MIN_SCORE * len(grams))
+        if not len(cand):
+            return 0, *empty
+        # Порядок (оценка ↓, Дайс ↓, позиция ↑) — это (общие триграммы ↓, триграммы названия ↑,
+        # позиция ↑): при равной оценке Дайс выше у названия короче. Целые упакованы в один
+        # уникальный ключ, поэтому первые top отбираются без равенств — страницы с разным
+        # offset режут один и тот же порядок, не пересекаются и ничего не пропускают.
+        n, width = len(self.goods), int(self._sizes.max()) + 1
+        key = ((len(grams) - common[cand]).astype(np.int64) * width + self._sizes[cand]) * n + cand
+        if len(cand) > top:
+            # полная сортировка не нужна — только первые top
+            part = np.argpartition(key, top - 1)[:top]
+        else:
+            part = np.arange(len(cand))
+        order = part[np.argsort(key[part])]
+        return len(cand), cand[order], common[cand[order]] / len(grams)
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+        """
+        Код (цифры и пробелы) → префиксный поиск по ТН ВЭД, иначе — нечёткий по названию.
+        Возвращает {"total", "items", "mode"}; items — страница [offset, offset+limit).
+        """
+        q = (query or "").strip()
+        if not q:
+            return {"total": 0, "items": [], "mode": "empty"}
+        if normalize_hs(q).isdigit():
+            hits = self.by_code(q)
+            page = hits[offset:offset + limit]
+            return {"total": len(hits), "mode": "hs_prefix",
+                    "items": [self._item(k, 1.0, "hs_prefix") for k in page]}
+        total, pos, score = self.by_name(q, top=offset + limit)
+        return {"total": total, "mode": "name",
+                "items": [self._item(int(k), float(s), "name")
+                          for k, s in zip(pos[offset:offset + limit], score[offset:offset + limit])]}
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# ttr_core/serialize.py — быстрая сериализация ответов API
+#
+#   dumps(obj)            — JSON в bytes: orjson, если установлен, иначе stdlib json;
+#   frame_records(df)     — DataFrame → список словарей (как to_dict("records"), но быстрее);
+#   frame_columns(df)     — DataFrame → {"колонка": [значения, ...]} (колоночный формат);
+#   compress(body, ae)    — сжатие по Accept-Encoding: brotli (если установлен) или gzip.
+#
+# Зависимости (необязательные, ускоряют):
+#   pip install orjson brotli
+
+import gzip
+import json
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = 1024  # мелкие ответы не сжимаем: выигрыш меньше накладных расходов
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+
+
+def _default(obj):
+    # numpy-скаляры/массивы и pandas-пропуски, которые могут прийти из DataFrame
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if obj is pd.NA or obj is pd.NaT:
+        return None
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _nan_to_none(obj):
+    # stdlib json пишет NaN как невалидный литерал — приводим к null, как orjson
+    if isinstance(obj, float):
+        return None if math.isnan(obj) or math.isinf(obj) else obj
+    if isinstance(obj, dict):
+        return {k: _nan_to_none(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_nan_to_none(v) for v in obj]
+    return obj
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(_nan_to_none(obj), ensure_ascii=False, separators=(",", ":"),
+                      default=_default).encode("utf-8")
+
+
+def frame_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Строки DataFrame как словари; значения — python-типы (tolist по колонкам)."""
+    cols = list(df.columns)
+    if not len(df):
+        return []
+    return [dict(zip(cols, row)) for row in zip(*(df[c].tolist() for c in cols))]
+
+
+def frame_columns(df: pd.DataFrame) -> Dict[str, List[Any]]:
+    """Колоночный формат: без повторения ключей в каждой строке."""
+    return {c: df[c].tolist() for c in df.columns}
+
+
+def compress(body: bytes, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """(тело, Content-Encoding или None) по заголовку Accept-Encoding клиента."""
+    if len(body) < COMPRESS_MIN_BYTES or not accept_encoding:
+        return body, None
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return brotli.compress(body, quality=BROTLI_QUALITY), "br"
+    if "gzip" in accepted or "*" in accepted:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+    return body, None
@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+# ttr_core/snapshot.py — снимок схемы ttr в памяти API
+#
+# Данных немного (тысячи товаров), поэтому API держит их целиком в памяти и отвечает
+# без запросов к БД. Снимок неизменяемый и колоночный: каждая таблица — массивы numpy
+# по колонкам, строки отсортированы по good_id, starts[k]:ends[k] — строки k-го товара
+# (как CSR); строковые колонки — коды категорий. Поиск товара — searchsorted.
+#
+# Загрузка — одна транзакция REPEATABLE READ (все таблицы согласованы между собой):
+# goods + data_version + recommendations, tariffs, production, consumption,
+# import_values, goods_flags и агрегаты импорта (ttr.import_by_year / import_by_country).
+# Рекомендации, которых нет для текущей версии, досчитываются при сборке снимка
+# векторно (ttr_core/batch.py) и только в памяти — в БД их сохраняют parser.py и API. country_dict API не читает (группы стран уже в import_values).
+#
+# SnapshotStore обновляет снимок в фоне: по уведомлению о загрузке (ttr_core/events.py)
+# или, без подписки, при смене сигнатуры данных (опрос раз в SNAPSHOT_CHECK_S).
+# Новый снимок собирается рядом со старым и подменяет его одной ссылкой — запросы
+# всегда видят целиком старый или целиком новый.
+
+import os
+import time
+import asyncio
+from typing import Dict, Any, List, Optional, Sequence, Tuple, Callable
+
+import numpy as np
+import pandas as pd
+
+from ttr_core import analytics
+from ttr_core.db import DB_SCHEMA
+from ttr_core.logic import make_grounding_message
+from ttr_core.batch import compute_recommendations_batch, iter_recommendations
+from ttr_core.bundle import (
+    GoodBundle, BulkData, Recommendation, BULK_COLUMNS, GOODS_INDEX_COLUMNS, normalize_hs,
+)
+from ttr_core.store import GoodVersion
+
+SNAPSHOT_ENABLED = os.environ.get("API_SNAPSHOT", "1").lower() not in ("0", "false", "no", "off")
+SNAPSHOT_CHECK_S = float(os.environ.get("SNAPSHOT_CHECK_S", "30"))        # опрос сигнатуры без LISTEN
+SNAPSHOT_DEBOUNCE_S = float(os.environ.get("SNAPSHOT_DEBOUNCE_S", "0.5"))  # склейка пачки уведомлений
+SNAPSHOT_TOP_MAX = 50  # топ стран в агрегатах (= максимум top у /imports/summary)
+
+# Сигнатура: меняется при любой загрузке (версии товаров) и правке справочника
+SIGNATURE_SQL = f"""
+SELECT (SELECT count(*) FROM {DB_SCHEMA}.goods),
+       (SELECT COALESCE(sum(hashtext(COALESCE(hs_code, '') || '|' || COALESCE(name, ''))::bigint), 0)
+          FROM {DB_SCHEMA}.goods),
+       (SELECT COALESCE(sum(version), 0) FROM {DB_SCHEMA}.data_version),
+       (SELECT max(updated_at) FROM {DB_SCHEMA}.data_version)
+"""
+
+GOODS_SQL = f"""
+SELECT g.id, g.hs_code, g.name, COALESCE(v.version, 0), v.updated_at,
+       CASE WHEN r.data_version = COALESCE(v.version, 0) THEN json_build_object(
+           'measures', r.measures, 'summary', r.summary, 'grounding', r.grounding) END
+FROM {DB_SCHEMA}.goods g
+LEFT JOIN {DB_SCHEMA}.data_version v ON v.good_id = g.id
+LEFT JOIN {DB_SCHEMA}.recommendations r ON r.good_id = g.id
+ORDER BY g.id
+"""
+
+# Таблицы снимка: SQL (первая колонка — good_id) и тип колонок:
+#   f — float64 (NULL → NaN), i — int64, c — категория (коды + словарь), o — как есть
+TABLES = {
+    "tariffs": (f"SELECT good_id, applied_rate::float8, wto_bound_rate::float8 FROM {DB_SCHEMA}.tariffs",
+                "ff"),
+    "production": (f"SELECT good_id, year, value_usd_mln::float8 FROM {DB_SCHEMA}.production "
+                   f"ORDER BY good_id, year", "if"),
+    "consumption": (f"SELECT good_id, year, value_usd_mln::float8 FROM {DB_SCHEMA}.consumption "
+                    f"ORDER BY good_id, year", "if"),
+    "imports": (f"""SELECT good_id, year, country,
+                           COALESCE(value_usd_mln, 0)::float8, COALESCE(value_tons, 0)::float8, country_group
+                    FROM {DB_SCHEMA}.import_values""", "icffc"),
+    "flags": (f"SELECT good_id, in_techreg, in_pp1875, in_order4114 FROM {DB_SCHEMA}.goods_flags", "ooo"),
+    "import_years": (f"SELECT good_id, {', '.join(analytics.YEAR_COLUMNS)} FROM {DB_SCHEMA}.import_by_year "
+                     f"ORDER BY good_id, year", "iffffcfffffi"),
+    "import_tops": (f"""SELECT good_id, {', '.join(analytics.COUNTRY_COLUMNS)}
+                        FROM {DB_SCHEMA}.import_by_country
+                        WHERE value_rank <= {SNAPSHOT_TOP_MAX} OR skc_rank <= {SNAPSHOT_TOP_MAX}
+                        ORDER BY good_id, year, value_rank""", "iccffffio"),
+}
+TABLE_COLUMNS = {**BULK_COLUMNS, "import_years": analytics.YEAR_COLUMNS,
+                 "import_tops": analytics.COUNTRY_COLUMNS}
+
+
+def _column(values: List[Any], kind: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """(массив, словарь категорий или None); массивы только для чтения."""
+    cats = None
+    if kind == "f":
+        arr = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    elif kind == "i":
+        arr = np.array(values, dtype=np.int64)
+    elif kind == "c":
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+        arr = codes.astype(np.int32)
+        cats = np.append(uniques.to_numpy(dtype=object), None)  # код -1 → None
+    else:
+        arr = np.empty(len(values), dtype=object)
+        arr[:] = values
+    arr.flags.writeable = False
+    return arr, cats
+
+
+class _Table:
+    """Таблица по колонкам; строки товара k — [starts[k], ends[k])."""
+
+    def __init__(self, rows: Sequence[tuple], columns: List[str], kinds: str, ids: np.ndarray):
+        gid = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        # устойчивая сортировка: внутри товара — порядок строк из БД (важен для топ-1 в алгоритме)
+        order = np.argsort(gid, kind="stable")
+        self.columns = columns
+        self.data: Dict[str, np.ndarray] = {}
+        self.cats: Dict[str, np.ndarray] = {}
+        for j, (name, kind) in enumerate(zip(columns, kinds)):
+            arr, cats = _column([rows[i][j + 1] for i in order], kind)
+            self.data[name] = arr
+            if cats is not None:
+                self.cats[name] = cats
+        self.good_id = gid[order]
+        self.good_id.flags.writeable = False
+        self.starts = np.searchsorted(self.good_id, ids, side="left")
+        self.ends = np.searchsorted(self.good_id, ids, side="right")
+
+    def __len__(self) -> int:
+        return len(next(iter(self.data.values()))) if self.data else 0
+
+    def span(self, k: int) -> slice:
+        return slice(int(self.starts[k]), int(self.ends[k]))
+
+    def values(self, name: str, rows) -> np.ndarray:
+        arr = self.data[name][rows]
+        cats = self.cats.get(name)
+        return cats[arr] if cats is not None else arr
+
+    def pylist(self, name: str, rows) -> list:
+        """Значения Python-типами, NaN → None (как из БД)."""
+        values = self.values(name, rows)
+        if values.dtype == np.float64:
+            return [None if v != v else v for v in values.tolist()]
+        return values.tolist()
+
+    def frame(self, rows, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        cols = columns or self.columns
+        return pd.DataFrame({c: self.values(c, rows) for c in cols}, columns=cols)
+
+    def rows(self) -> List[tuple]:
+        """Все строки кортежами (good_id, колонки...) — в порядке снимка (для выгрузки)."""
+        everything = slice(None)
+        return list(zip(self.good_id.tolist(), *(self.pylist(c, everything) for c in self.columns)))
+
+    def nbytes(self) -> int:
+        return int(sum(a.nbytes for a in self.data.values()) + self.good_id.nbytes
+                   + self.starts.nbytes + self.ends.nbytes)
+
+
+class Snapshot:
+    """Неизменяемый снимок схемы ttr (см. описание модуля)."""
+
+    def __init__(self, goods_rows: Sequence[tuple], tables: Dict[str, Sequence[tuple]],
+                 signature: tuple, load_s: float = 0.0):
+        t0 = time.perf_counter()
+        self.signature = tuple(signature)
+        self.catalog_signature = self.signature[:2]
+        self.ids = np.fromiter((r[0] for r in goods_rows), dtype=np.int64, count=len(goods_rows))
+        self.hs_code = [r[1] for r in goods_rows]
+        self.name = [r[2] for r in goods_rows]
+        self.hs_norm = [normalize_hs(h) for h in self.hs_code]
+        self.version = np.fromiter((r[3] for r in goods_rows), dtype=np.int64, count=len(goods_rows))
+        self.updated_at = [r[4] for r in goods_rows]
+        self.recommendations: List[Optional[Recommendation]] = [
+            Recommendation(**r[5]) if r[5] else None for r in goods_rows]
+        self.tables = {name: _Table(tables.get(name) or [], TABLE_COLUMNS[name], TABLES[name][1], self.ids)
+                       for name in TABLES}
+        self.computed = self._fill_recommendations()
+        self.load_s = load_s
+        self.build_s = time.perf_counter() - t0
+        self.created_at = time.time()
+
+    # ---------- товары ----------
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def position(self, good_id: int) -> Optional[int]:
+        k = int(np.searchsorted(self.ids, good_id))
+        return k if k < len(self.ids) and self.ids[k] == good_id else None
+
+    def covers(self, good_ids: Sequence[int]) -> bool:
+        """Все товары есть в снимке (новые появятся в нём после обновления)."""
+        return all(self.position(int(g)) is not None for g in good_ids)
+
+    def good_version(self, good_id: int) -> Optional[GoodVersion]:
+        k = self.position(good_id)
+        if k is None:
+            return None
+        return GoodVersion(int(self.version[k]), self.updated_at[k], self.hs_code[k])
+
+    def goods_rows(self) -> List[Tuple[int, str, str]]:
+        return list(zip(self.ids.tolist(), self.hs_code, self.name))
+
+    def _bundle(self, k: int) -> GoodBundle:
+        frames = {name: self.tables[name].frame(self.tables[name].span(k)) for name in BULK_COLUMNS}
+        return GoodBundle(
+            good={"id": int(self.ids[k]), "hs_code": self.hs_code[k], "name": self.name[k]},
+            data_version=int(self.version[k]),
+            recommendation=self.recommendations[k],
+            updated_at=self.updated_at[k],
+            **frames,
+        )
+
+    def bundle(self, good_id: int) -> Optional[GoodBundle]:
+        k = self.position(good_id)
+        return None if k is None else self._bundle(k)
+
+    # ---------- портфельные запросы ----------
+    def goods_index(self, ids: Optional[Sequence[int]] = None, hs_prefix: Optional[str] = None,
+                    limit: Optional[int] = None) -> pd.DataFrame:
+        """Как bundle.load_goods_index_async: отбор по id и/или префиксу ТН ВЭД, по возрастанию id."""
+        if ids is not None:
+            pos = sorted({k for k in (self.position(int(g)) for g in ids) if k is not None})
+        else:
+            pos = range(len(self.ids))
+        hs = normalize_hs(hs_prefix)
+        if hs:
+            pos = [k for k in pos if self.hs_norm[k].startswith(hs)]
+        pos = list(pos)[:limit] if limit is not None else list(pos)
+        rows = [(int(self.ids[k]), self.hs_code[k], self.name[k], int(self.version[k]),
+                 vars(self.recommendations[k]) if self.recommendations[k] else None) for k in pos]
+        return pd.DataFrame(rows, columns=GOODS_INDEX_COLUMNS)
+
+    def bulk(self, goods: pd.DataFrame) -> BulkData:
+        """Длинные таблицы (с good_id) по отобранным товарам — как bundle.load_bulk_async."""
+        pos = [self.position(int(g)) for g in goods["id"]]
+        frames = {}
+        for name, cols in BULK_COLUMNS.items():
+            table = self.tables[name]
+            starts, ends = table.starts[pos], table.ends[pos]
+            rows = np.concatenate([np.arange(a, b) for a, b in zip(starts, ends)] or [np.zeros(0, np.int64)])
+            gid = np.repeat(self.ids[pos], ends - starts)
+            frame = table.frame(rows, cols)
+            frame.insert(0, "good_id", gid)
+            frames[name] = frame
+        return BulkData(goods=goods, **frames)
+
+    def _fill_recommendations(self) -> int:
+        """Досчитывает рекомендации товаров, у которых нет сохранённой для текущей версии."""
+        missing = [k for k, r in enumerate(self.recommendations) if r is None]
+        if not missing:
+            return 0
+        goods = pd.DataFrame([(int(self.ids[k]), self.hs_code[k], self.name[k], int(self.version[k]), None)
+                              for k in missing], columns=GOODS_INDEX_COLUMNS)
+        bulk = self.bulk(goods)
+        result = compute_recommendations_batch(goods["id"].tolist(), bulk.tariffs, bulk.production,
+                                               bulk.consumption, bulk.imports, bulk.flags)
+        for good_id, measures, summary in iter_recommendations(result):
+            k = self.position(good_id)
+            good = {"id": good_id, "hs_code": self.hs_code[k], "name": self.name[k]}
+            self.recommendations[k] = Recommendation(
+                measures=measures, summary=summary, grounding=make_grounding_message(good, measures, summary))
+        return len(missing)
+
+    # ---------- импорт ----------
+    def import_summaries(self, good_ids: Sequence[int], top: int = 5) -> Dict[int, Dict[str, Any]]:
+        """Как analytics.load_import_summaries_async (те же словари), из агрегатов в снимке."""
+        years_t, tops_t = self.tables["import_years"], self.tables["import_tops"]
+        years, tops = [], []
+        for g in good_ids:
+            k = self.position(int(g))
+            if k is None:
+                continue
+            span = years_t.span(k)
+            cols = [years_t.pylist(c, span) for c in years_t.columns]
+            years.extend((int(g), *row) for row in zip(*cols))
+            span = tops_t.span(k)
+            cols = [tops_t.pylist(c, span) for c in tops_t.columns]
+            for row in zip(*cols):
+                item = dict(zip(tops_t.columns, row))
+                if item["value_rank"] <= top or (item["skc_rank"] is not None and item["skc_rank"] <= top):
+                    tops.append((int(g), *row))
+        return analytics._summaries(good_ids, years, tops, top)
+
+    def import_rows(self, good_id: int, year: Optional[int] = None, country_group: Optional[str] = None,
+                    limit: int = 100, offset: int = 0) -> Dict[str, Any]:
+        """Как analytics.load_import_rows_async: строки постранично (год ↓, стоимость ↓, страна)."""
+        table = self.tables["imports"]
+        span = table.span(self.position(good_id))
+        df = table.frame(span, analytics.ROW_COLUMNS)
+        if year is not None:
+            df = df[df["year"] == year]
+        if country_group is not None:
+            df = df[df["country_group"] == country_group]
+        df = df.sort_values(["year", "value_usd_mln", "country"], ascending=[False, False, True], kind="mergesort")
+        page = df.iloc[offset:offset + limit]
+        items = [dict(zip(analytics.ROW_COLUMNS, row)) for row in page.itertuples(index=False, name=None)]
+        return {"total": len(df), "items": items}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "goods": len(self.ids),
+            "rows": {name: len(t) for name, t in self.tables.items()},
+            "bytes": sum(t.nbytes() for t in self.tables.values()) + self.ids.nbytes + self.version.nbytes,
+            "computed_recommendations": self.computed,
+            "load_s": round(self.load_s, 4),
+            "build_s": round(self.build_s, 4),
+            "age_s": round(time.time() - self.created_at, 1),
+        }
+
+
+async def _signature(conn) -> tuple:
+    cur = await conn.execute(SIGNATURE_SQL)
+    return tuple(await cur.fetchone())
+
+
+async def load_snapshot_async(conn) -> Snapshot:
+    """Все таблицы одной транзакцией REPEATABLE READ (pipeline psycopg 3); сборка — в потоке."""
+    t0 = time.perf_counter()
+    await conn.rollback()
+    try:
+        await conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        async with conn.pipeline():
+            cursors = {"signature": conn.cursor(), "goods": conn.cursor()}
+            await cursors["signature"].execute(SIGNATURE_SQL)
+            await cursors["goods"].execute(GOODS_SQL)
+            for name, (sql, _) in TABLES.items():
+                cursors[name] = conn.cursor()
+                await cursors[name].execute(sql)
+            rows = {name: await cur.fetchall() for name, cur in cursors.items()}
+    finally:
+        await conn.rollback()
+    load_s = time.perf_counter() - t0
+    signature = rows.pop("signature")[0]
+    goods = rows.pop("goods")
+    return await asyncio.to_thread(Snapshot, goods, rows, signature, load_s)
+
+
+class SnapshotStore:
+    """
+    Текущий снимок (current) и его фоновое обновление.
+    connection — фабрика async-соединений (контекстный менеджер), listening —
+    есть ли живая подписка на уведомления (тогда опрос сигнатуры не нужен).
+    """
+
+    def __init__(self, connection: Callable, listening: Callable[[], bool] = lambda: False,
+                 check_s: float = SNAPSHOT_CHECK_S):
+        self.current: Optional[Snapshot] = None
+        self._connection = connection
+        self._listening = listening
+        self.check_s = check_s
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._stats = {"refreshes": 0, "checks": 0, "errors": 0, "last_error": None}
+
+    def request_refresh(self):
+        """Вызывается по уведомлению о загрузке: снимок обновится в фоне."""
+        self._wake.set()
+
+    async def refresh(self, force: bool = False) -> bool:
+        """Новый снимок, если изменилась сигнатура данных (или force); True — подменили."""
+        async with self._lock:
+            async with self._connection() as conn:
+                if not force and self.current is not None:
+                    self._stats["checks"] += 1
+                    signature = await _signature(conn)
+                    await conn.rollback()
+                    if signature == self.current.signature:
+                        return False
+                snap = await load_snapshot_async(conn)
+            self.current = snap
+            self._stats["refreshes"] += 1
+            print(f"[snapshot] {len(snap)} товаров, {snap.stats()['bytes'] / 1e6:.1f} МБ: "
+                  f"чтение {snap.load_s:.2f} c, сборка {snap.build_s:.2f} c, "
+                  f"досчитано рекомендаций: {snap.computed}")
+            return True
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), None if self._listening() else self.check_s)
+                await asyncio.sleep(SNAPSHOT_DEBOUNCE_S)  # пачка уведомлений одной загрузки → одно обновление
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["errors"] += 1
+                self._stats["last_error"] = str(e)
+                print(f"[snapshot] обновление не удалось, остаётся прежний снимок: {e}")
+
+    def start(self) -> asyncio.Task:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": True, **self._stats, "listening": self._listening(),
+                "snapshot": self.current.stats() if self.current is not None else None}
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# ttr_core/startup.py — время холодного старта API и разбивка импорта по модулям
+#
+#   python -m ttr_core.startup                      # отчёт для api.py
+#   python -m ttr_core.startup --budget 1.5         # код возврата 1, если старт дольше 1.5 c
+#   python -m ttr_core.startup --module ttr_core.nightly --top 30
+#
+# Замер — в отдельном чистом процессе (как при старте контейнера):
+#   1) время импорта модуля (минимум из --repeat запусков — меньше шума);
+#   2) `python -X importtime`: собственное и накопленное время каждого модуля,
+#      сумма по пакетам верхнего уровня (pandas, fastapi, psycopg, …).
+# Проверка для CI: старт не дольше бюджета (STARTUP_BUDGET_S) и тяжёлые зависимости,
+# нужные только отдельным эндпоинтам (LAZY_MODULES), не загружаются при импорте.
+
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Dict, Any, List, Sequence
+
+STARTUP_BUDGET_S = float(os.environ.get("STARTUP_BUDGET_S", "2.0"))
+
+# Модули, которые API грузит только по требованию:
+#   docx — сборка DOCX (report/mosprom и задания), requests/httpx — запросы к LLM,
+#   pyarrow.parquet — выгрузка parquet/arrow (ttr_core/export.py); сам pyarrow, если установлен,
+#   импортирует pandas 3 при старте, поэтому проверяется то, что добавляет выгрузка
+LAZY_MODULES = ("docx", "requests", "httpx", "pyarrow.parquet")
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+)\s*\|\s*(\d+)\s*\|( *)(\S+)\s*$")
+
+_PROBE = """
+import sys, time, json
+t0 = time.perf_counter()
+import {module}
+dt = time.perf_counter() - t0
+print(json.dumps({{"import_s": dt, "lazy_loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def _run(args: Sequence[str]) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    return subprocess.run([sys.executable, *args], cwd=BACKEND_DIR, env=env,
+                          capture_output=True, text=True, timeout=300)
+
+
+def measure_import(module: str = "api", repeat: int = 3) -> Dict[str, Any]:
+    """Время импорта модуля в чистом процессе (минимум из repeat) и загруженные LAZY_MODULES."""
+    runs = []
+    for _ in range(max(1, repeat)):
+        proc = _run(["-c", _PROBE.format(module=module, lazy=LAZY_MODULES)])
+        if proc.returncode != 0:
+            raise RuntimeError(f"import {module} упал:\n{proc.stderr.strip()}")
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    best = min(runs, key=lambda r: r["import_s"])
+    return {"module": module, "import_s": best["import_s"],
+            "runs_s": [r["import_s"] for r in runs], "lazy_loaded": best["lazy_loaded"]}
+
+
+def import_breakdown(module: str = "api") -> List[Dict[str, Any]]:
+    """Строки `-X importtime`: [{"module", "self_s", "cumulative_s", "depth"}] в порядке загрузки."""
+    proc = _run(["-X", "importtime", "-c", f"import {module}"])
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} упал:\n{proc.stderr.strip()}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME.match(line)
+        if m:
+            rows.append({"module": m.group(4), "self_s": int(m.group(1)) / 1e6,
+                         "cumulative_s": int(m.group(2)) / 1e6, "depth": (len(m.group(3)) - 1) // 2})
+    return rows
+
+
+def by_package(rows: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Собственное время модулей, сложенное по пакету верхнего уровня, по убыванию."""
+    totals: Dict[str, Dict[str, Any]] = {}
+    for r in rows:
+        pkg = r["module"].split(".")[0]
+        t = totals.setdefault(pkg, {"package": pkg, "self_s": 0.0, "modules": 0})
+        t["self_s"] += r["self_s"]
+        t["modules"] += 1
+    return sorted(totals.values(), key=lambda t: -t["self_s"])
+
+
+def direct_imports(rows: Sequence[Dict[str, Any]], module: str) -> List[Dict[str, Any]]:
+    """Непосредственные импорты модуля: строки глубины 1 перед его собственной строкой."""
+    end = max((i for i, r in enumerate(rows) if r["module"] == module and r["depth"] == 0), default=None)
+    if end is None:
+        return []
+    direct = []
+    for r in reversed(rows[:end]):
+        if r["depth"] == 0:
+            break  # импорт до нашего модуля (site, .pth и т.п.)
+        if r["depth"] == 1:
+            direct.append(r)
+    return direct
+
+
+def report(module: str = "api", budget: float = STARTUP_BUDGET_S, top: int = 20,
+           repeat: int = 3) -> Dict[str, Any]:
+    timing = measure_import(module, repeat)
+    rows = import_breakdown(module)
+    packages = by_package(rows)
+    total = sum(p["self_s"] for p in packages)
+    problems = []
+    if timing["import_s"] > budget:
+        problems.append(f"импорт {module} {timing['import_s']:.3f} c > бюджета {budget:.3f} c")
+    if timing["lazy_loaded"]:
+        problems.append(f"при импорте загружены ленивые зависимости: {', '.join(timing['lazy_loaded'])}")
+
+    print(f"[startup] import {module}: {timing['import_s']:.3f} c "
+          f"(запуски: {', '.join(f'{t:.3f}' for t in timing['runs_s'])}), бюджет {budget:.3f} c")
+    print(f"[startup] -X importtime: {len(rows)} модулей, {total:.3f} c (с накладными расходами замера)")
+    print(f"{'пакет':<28}{'c':>9}{'%':>7}{'модулей':>9}")
+    for p in packages[:top]:
+        share = p["self_s"] / total * 100 if total else 0.0
+        print(f"{p['package']:<28}{p['self_s']:>9.3f}{share:>7.1f}{p['modules']:>9}")
+    direct = direct_imports(rows, module)
+    if direct:
+        print(f"\n{'прямые импорты ' + module:<40}{'накопл., c':>12}")
+        for r in sorted(direct, key=lambda r: -r["cumulative_s"])[:top]:
+            print(f"{r['module']:<40}{r['cumulative_s']:>12.3f}")
+    for p in problems:
+        print(f"[startup] ПРЕВЫШЕНИЕ: {p}")
+    return {**timing, "budget_s": budget, "packages": packages, "ok": not problems, "problems": problems}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Время холодного старта и разбивка импорта по модулям")
+    ap.add_argument("--module", default="api", help="что импортировать (по умолчанию api)")
+    ap.add_argument("--budget", type=float, default=STARTUP_BUDGET_S, help="бюджет времени импорта, c")
+    ap.add_argument("--top", type=int, default=20, help="сколько строк показывать")
+    ap.add_argument("--repeat", type=int, default=3, help="запусков для замера времени")
+    args = ap.parse_args(argv)
+    result = report(args.module, args.budget, args.top, args.repeat)
+    return 0 if result["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
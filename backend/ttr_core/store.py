@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# ttr_core/store.py — материализованные рекомендации по товарам
+#
+# ttr.data_version   — версия данных товара (растёт при каждой загрузке parser.py,
+#                      если данные товара изменились);
+# ttr.recommendations — результат compute_recommendation (меры, summary, заземление),
+#                      посчитанный для конкретной версии данных.
+# API отдаёт рекомендацию из таблицы, если её версия совпадает с текущей.
+
+import json
+from datetime import datetime
+from typing import Iterable, Optional, List, Set, Dict, NamedTuple
+
+from ttr_core.db import DB_SCHEMA
+from ttr_core.bundle import Recommendation, BulkData, load_good_bundle
+from ttr_core.logic import compute_recommendation, make_grounding_message
+from ttr_core.batch import compute_recommendations_batch, iter_recommendations
+from ttr_core.metrics import span
+
+SCHEMA_SQL = f"""
+CREATE TABLE IF NOT EXISTS {DB_SCHEMA}.data_version (
+    good_id    integer PRIMARY KEY REFERENCES {DB_SCHEMA}.goods(id) ON DELETE CASCADE,
+    version    bigint      NOT NULL DEFAULT 1,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS {DB_SCHEMA}.recommendations (
+    good_id      integer PRIMARY KEY REFERENCES {DB_SCHEMA}.goods(id) ON DELETE CASCADE,
+    data_version bigint      NOT NULL,
+    measures     jsonb       NOT NULL,
+    summary      jsonb       NOT NULL,
+    grounding    text        NOT NULL,
+    computed_at  timestamptz NOT NULL DEFAULT now()
+);
+"""
+
+def ensure_schema(cur):
+    cur.execute(SCHEMA_SQL)
+
+async def ensure_schema_async(conn):
+    await conn.execute(SCHEMA_SQL)
+
+# =============================
+# Версии данных
+# =============================
+def bump_versions(cur, good_ids: Iterable[int]) -> Dict[int, int]:
+    """Увеличивает версию данных у изменившихся товаров (в транзакции загрузки); {good_id: новая версия}."""
+    ids = sorted(set(int(g) for g in good_ids))
+    if not ids:
+        return {}
+    cur.execute(f"""
+        INSERT INTO {DB_SCHEMA}.data_version(good_id)
+        SELECT unnest(%s::int[])
+        ON CONFLICT (good_id) DO UPDATE
+        SET version = {DB_SCHEMA}.data_version.version + 1, updated_at = now()
+        RETURNING good_id, version;
+    """, (ids,))
+    return {int(g): int(v) for g, v in cur.fetchall()}
+
+def stale_good_ids(cur) -> Set[int]:
+    """Товары без рекомендации или с рекомендацией для устаревшей версии."""
+    cur.execute(f"""
+        SELECT g.id
+        FROM {DB_SCHEMA}.goods g
+        LEFT JOIN {DB_SCHEMA}.data_version v ON v.good_id = g.id
+        LEFT JOIN {DB_SCHEMA}.recommendations r ON r.good_id = g.id
+        WHERE r.good_id IS NULL OR r.data_version <> COALESCE(v.version, 0)
+    """)
+    return {int(r[0]) for r in cur.fetchall()}
+
+VERSION_SQL = f"""
+    SELECT COALESCE(v.version, 0), v.updated_at, g.hs_code
+    FROM {DB_SCHEMA}.goods g
+    LEFT JOIN {DB_SCHEMA}.data_version v ON v.good_id = g.id
+    WHERE g.id = %s
+"""
+
+class GoodVersion(NamedTuple):
+    data_version: int
+    updated_at: Optional[datetime]
+    hs_code: str
+
+async def load_version_async(conn, good_id: int) -> Optional[GoodVersion]:
+    """Версия данных товара (и код ТН ВЭД) по первичному ключу; None, если товара нет."""
+    cur = await conn.execute(VERSION_SQL, (good_id,))
+    row = await cur.fetchone()
+    if row is None:
+        return None
+    return GoodVersion(int(row[0]), row[1], row[2])
+
+# =============================
+# Рекомендации
+# =============================
+SAVE_RECOMMENDATION_SQL = f"""
+    INSERT INTO {DB_SCHEMA}.recommendations(good_id, data_version, measures, summary, grounding)
+    VALUES (%s, %s, %s::jsonb, %s::jsonb, %s)
+    ON CONFLICT (good_id) DO UPDATE
+    SET data_version = EXCLUDED.data_version,
+        measures     = EXCLUDED.measures,
+        summary      = EXCLUDED.summary,
+        grounding    = EXCLUDED.grounding,
+        computed_at  = now()
+    WHERE {DB_SCHEMA}.recommendations.data_version <= EXCLUDED.data_version;
+"""
+
+def _save_params(good_id: int, data_version: int, rec: Recommendation):
+    # JSON строкой + ::jsonb — одинаково работает и с psycopg2, и с psycopg 3
+    return (good_id, data_version,
+            json.dumps(rec.measures, ensure_ascii=False),
+            json.dumps(rec.summary, ensure_ascii=False),
+            rec.grounding)
+
+def save_recommendation(cur, good_id: int, data_version: int, rec: Recommendation):
+    cur.execute(SAVE_RECOMMENDATION_SQL, _save_params(good_id, data_version, rec))
+
+async def save_recommendation_async(conn, good_id: int, data_version: int, rec: Recommendation):
+    await conn.execute(SAVE_RECOMMENDATION_SQL, _save_params(good_id, data_version, rec))
+
+def compute_for_bundle(bundle) -> Recommendation:
+    with span("compute_recommendation"):
+        measures, summary = compute_recommendation(
+            bundle.tariffs, bundle.production, bundle.consumption, bundle.imports, bundle.flags
+        )
+    with span("make_grounding_message"):
+        grounding = make_grounding_message(bundle.good, measures, summary)
+    return Recommendation(measures=measures, summary=summary, grounding=grounding)
+
+def fill_missing(bundles, bulk: Optional[BulkData] = None) -> List:
+    """
+    Проставляет рекомендации тем товарам, у которых нет актуальной сохранённой.
+    Если переданы длинные таблицы пачки (bulk), меры считаются векторно за один
+    проход (ttr_core/batch.py), иначе — по товару.
+    Возвращает список товаров, для которых расчёт выполнен (их стоит сохранить).
+    """
+    computed = [b for b in bundles if b.recommendation is None]
+    if bulk is None or len(computed) < 2:
+        for b in computed:
+            b.recommendation = compute_for_bundle(b)
+        return computed
+
+    result = compute_recommendations_batch(
+        [b.good_id for b in computed],
+        bulk.tariffs, bulk.production, bulk.consumption, bulk.imports, bulk.flags,
+    )
+    by_id = {gid: (measures, summary) for gid, measures, summary in iter_recommendations(result)}
+    for b in computed:
+        measures, summary = by_id[b.good_id]
+        grounding = make_grounding_message(b.good, measures, summary)
+        b.recommendation = Recommendation(measures=measures, summary=summary, grounding=grounding)
+    return computed
+
+def save_many(cur, bundles):
+    if bundles:
+        cur.executemany(
+            SAVE_RECOMMENDATION_SQL,
+            [_save_params(b.good_id, b.data_version, b.recommendation) for b in bundles],
+        )
+
+async def save_many_async(conn, bundles):
+    if not bundles:
+        return
+    async with conn.cursor() as cur:
+        await cur.executemany(
+            SAVE_RECOMMENDATION_SQL,
+            [_save_params(b.good_id, b.data_version, b.recommendation) for b in bundles],
+        )
+
+def refresh_recommendations(conn, good_ids: Optional[Iterable[int]] = None) -> List[int]:
+    """
+    Пересчитывает и сохраняет рекомендации для указанных товаров
+    (плюс всех, у кого рекомендация отсутствует или устарела). Коммитит сам.
+    """
+    with conn.cursor() as cur:
+        ids = stale_good_ids(cur) | set(int(g) for g in (good_ids or []))
+    done = []
+    for gid in sorted(ids):
+        bundle = load_good_bundle(conn, gid)
+        if bundle is None:
+            continue
+        with conn.cursor() as cur:
+            save_recommendation(cur, gid, bundle.data_version, compute_for_bundle(bundle))
+        done.append(gid)
+    conn.commit()
+    return done
@@ -15,6 +15,40 @@ export interface ImportsByYear extends ByYear {
     "country_group": "friendly"
 }
 
+export interface ImportCountry {
+    country: string,
+    country_group: string | null,
+    value_usd_mln: number,
+    value_tons: number,
+    share_pct: number | null,
+    skc_usd_per_ton: number | null,
+    value_rank: number,
+    skc_rank: number | null
+}
+
+export interface ImportYear {
+    year: number,
+    total_usd_mln: number,
+    total_tons: number,
+    unfriendly_usd_mln: number,
+    unfriendly_tons: number,
+    metric_used: "value_usd_mln" | "value_tons",
+    unfriendly_share_pct: number,
+    unfriendly_delta: number,
+    total_delta_usd_mln: number | null,
+    total_yoy_pct: number | null,
+    total_delta_tons: number | null,
+    countries: number,
+    top_suppliers: ImportCountry[],
+    top_skc: ImportCountry[]
+}
+
+export interface ImportSummary {
+    last_year: number | null,
+    top: number,
+    years: ImportYear[]
+}
+
 export type ProductInfo = {
     "good": {
         "id": 1,
@@ -30,6 +64,7 @@ export type ProductInfo = {
     "production": ByYear[],
     consumption: ByYear[],
     imports: ImportsByYear[],
+    import_summary: ImportSummary,
     "flags": [{
         "in_techreg": true,
         "in_pp1875": true,
@@ -57,9 +92,11 @@ export class GoodsAPI {
     }
 
     static get(id: string) {
+        // исходные строки импорта пока нужны виджетам дашборда (карта, диаграммы)
         return api.get<ProductInfo>({
             methodName: 'dashboard',
-            subId: id
+            subId: id,
+            params: {imports: 'raw'}
         })
     }
 